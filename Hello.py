@@ -1,10 +1,45 @@
+import os
 import streamlit as st
 from streamlit.logger import get_logger
 import threading
+from kpis import build_kpis
+from sheets_refresher import get_refresher
+import metrics
+import warmup
 
 LOGGER = get_logger(__name__)
 _lock = threading.Lock()
 
+# Imagen de las banderas servida por el propio servidor (carpeta 'static', server.enableStaticServing)
+BANDERAS = 'banderas.jpg'
+BANDERAS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', BANDERAS)
+
+# Indicadores de la cartera leídos de la última copia ya procesada; la portada nunca espera a Google Sheets
+def mostrar_indicadores():
+    # Arranca el precalentamiento si está habilitado (tools.serve ya lo arranca junto con el servidor) y muestra su avance
+    precalentamiento = warmup.start_if_enabled()
+    if precalentamiento is not None:
+        avance = precalentamiento.progress()
+        if not avance.terminado:
+            st.progress(avance.hechos / avance.total, text=f"Preparando los datos de la cartera ({avance.paso or 'en espera'})...")
+    refresher = get_refresher()
+    refresher.register('kpis', build_kpis)
+    snapshot = refresher.snapshot(timeout=0)
+    kpis = snapshot.datasets.get('kpis') if snapshot is not None else None
+    if kpis is None:
+        st.info("Los indicadores de la cartera estarán disponibles en cuanto termine la primera descarga de datos.")
+        return
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Total Desembolsado (MM USD)", f"{kpis.total / 1e6:,.1f}")
+    col2.metric(f"Desembolsado en {kpis.fecha_corte.year} (MM USD)", f"{kpis.total_ano / 1e6:,.1f}")
+    col3.metric("Etapas Activas", f"{kpis.etapas_activas:,}", help=f"De {kpis.etapas:,} etapas")
+
+    columnas = st.columns(max(len(kpis.por_pais), 1))
+    for columna, pais, porcentaje in zip(columnas, kpis.por_pais['Pais'], kpis.por_pais['Porcentaje Desembolsado']):
+        columna.metric(f"{pais}: % Desembolsado", f"{porcentaje:,.1f}%")
+    st.caption(f"Datos de Google Sheets al {snapshot.fetched_at.strftime('%d/%m/%Y %H:%M')}")
+
 def pagina_inicial():
     # Configuración de la página
     st.set_page_config(page_title="Análisis de Desembolsos", layout="wide")
@@ -29,10 +64,15 @@ def pagina_inicial():
             <li><strong>Matrices de Desembolsos</strong>: Explora las matrices detalladas de los Montos de los desembolsos y Porcentaje de los Desembolsos en los Años.</li>
             <li><strong>Curva de Sectores</strong>: Análisis de los Montos Desembolsados de los proyectos y su progreso en Años y por Sectores.</li>
             <li><strong>Curva de Paises</strong>: Análisis de los Montos Desembolsados de los proyectos y su progreso en Años y por Paises.</li>      
+            <li><strong>Cohortes de Vigencia</strong>: Compara el porcentaje acumulado desembolsado de los proyectos según su año de vigencia, por País y Sector.</li>
+            <li><strong>Simulación de Flujos</strong>: Proyecta los desembolsos pendientes de la cartera activa por País y Año, con bandas P10-P90 de los escenarios simulados.</li>
         </ul>
     </div>
     """, unsafe_allow_html=True)
 
+    # Indicadores de la cartera
+    mostrar_indicadores()
+
     # Resumen ejecutivo o highlights con margen
     st.markdown("""
     <div style="margin-left: 4em;">
@@ -45,11 +85,12 @@ def pagina_inicial():
     </div>
     """, unsafe_allow_html=True)
 
-    st.markdown("""
-        <div style='text-align: center;'>
-            <img src='https://www.fonplata.org/sites/default/files/glazed-cms-media/SELECCION-BANDERAS.jpg?fid=5544' width='800'>
-        </div>
-        """, unsafe_allow_html=True)
+    if os.path.exists(BANDERAS_PATH):
+        st.markdown(f"""
+            <div style='text-align: center;'>
+                <img src='app/static/{BANDERAS}' width='800'>
+            </div>
+            """, unsafe_allow_html=True)
 
     # Metodología y fuentes de datos con margen
     st.markdown("""
@@ -76,6 +117,7 @@ def pagina_inicial():
     """, unsafe_allow_html=True)
 
 if __name__ == "__main__":
-    pagina_inicial()
+    with metrics.page_run('inicio'):
+        pagina_inicial()
 
 
@@ -0,0 +1,63 @@
+from utils import lazy_import
+
+np = lazy_import('numpy')
+
+# Granularidades disponibles en las páginas de curvas: etiqueta -> (columna, meses por periodo)
+GRANULARIDADES = {
+    'Años': ('Ano', 12),
+    'Semestres': ('Semestre', 6),
+    'Trimestres': ('Trimestre', 3),
+    'Meses': ('Meses', 1),
+}
+
+BUCKET_COLUMNS = [columna for columna, _ in GRANULARIDADES.values()]
+
+
+# Meses calendario completos transcurridos entre dos arreglos de fechas (aritmética entera sobre datetime64).
+# Un mes se completa al llegar al mismo día del mes siguiente; las fechas nulas devuelven -1.
+def elapsed_months(inicio, fin):
+    inicio = np.asarray(inicio, dtype='datetime64[D]')
+    fin = np.asarray(fin, dtype='datetime64[D]')
+    nulos = np.isnat(inicio) | np.isnat(fin)
+
+    mes_inicio = inicio.astype('datetime64[M]')
+    mes_fin = fin.astype('datetime64[M]')
+    dia_inicio = (inicio - mes_inicio.astype('datetime64[D]')).astype(np.int64)
+    dia_fin = (fin - mes_fin.astype('datetime64[D]')).astype(np.int64)
+
+    # Si el mes de inicio tiene más días que el de fin (p. ej. 31 de enero -> 28 de febrero), el fin de mes cuenta como aniversario
+    ultimo_dia_fin = ((mes_fin + 1).astype('datetime64[D]') - mes_fin.astype('datetime64[D]')).astype(np.int64) - 1
+    incompleto = (dia_fin < dia_inicio) & (dia_fin < ultimo_dia_fin)
+
+    meses = (mes_fin - mes_inicio).astype(np.int64) - incompleto
+    return np.where(nulos, -1, meses)
+
+
+# Año calendario en que termina el periodo 'periodo' (contado desde la vigencia, como en add_time_buckets): el periodo
+# p cubre las fechas con p * meses_por_periodo a (p + 1) * meses_por_periodo meses completos desde la vigencia, así
+# que su último día es la víspera del aniversario (p + 1) * meses_por_periodo. Las vigencias nulas devuelven -1.
+def period_end_year(vigencia, periodo, meses_por_periodo):
+    vigencia = np.asarray(vigencia, dtype='datetime64[D]')
+    nulos = np.isnat(vigencia)
+    mes = vigencia.astype('datetime64[M]')
+    dia = (vigencia - mes.astype('datetime64[D]')).astype(np.int64)
+    # Mes del aniversario; si la vigencia es el día 1, la víspera cae en el mes anterior
+    ultimo_mes = mes + (np.asarray(periodo, dtype=np.int64) + 1) * meses_por_periodo - (dia == 0)
+    return np.where(nulos, -1, ultimo_mes.astype('datetime64[Y]').astype(np.int64) + 1970)
+
+
+# Agrega las columnas 'Meses', 'Trimestre', 'Semestre' y 'Ano' con periodos exactos desde la vigencia
+def add_time_buckets(df, inicio_col='FechaVigencia', fin_col='FechaEfectiva'):
+    meses = elapsed_months(df[inicio_col].to_numpy(dtype='datetime64[ns]'), df[fin_col].to_numpy(dtype='datetime64[ns]'))
+    nulos = (df[inicio_col].isna() | df[fin_col].isna()).to_numpy()
+    for columna, meses_por_periodo in GRANULARIDADES.values():
+        df[columna] = np.where(nulos, -1, np.floor_divide(meses, meses_por_periodo))
+    return df
+
+
+# Selector de granularidad en la barra lateral; devuelve (etiqueta, columna)
+def granularity_selector(key='granularidad'):
+    import streamlit as st
+
+    etiqueta = st.sidebar.selectbox('Granularidad', list(GRANULARIDADES), key=key)
+    return etiqueta, GRANULARIDADES[etiqueta][0]
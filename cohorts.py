@@ -0,0 +1,138 @@
+from collections import namedtuple
+import functools
+
+from bucketing import elapsed_months
+import core
+import metrics
+from utils import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Cubo de montos por cohorte de vigencia x país x sector x años desde la vigencia, con el aporte y la cantidad de
+# etapas de cada celda. Cualquier cohorte, país o sector se obtiene sumando ejes, sin volver a recorrer los desembolsos.
+CohortCube = namedtuple('CohortCube', ['cohortes', 'paises', 'sectores', 'montos', 'aportes', 'proyectos', 'horizonte'])
+
+TODOS = 'Todos'
+
+
+# Arma el cubo en una sola pasada agrupada sobre el dataset combinado (un desembolso por fila)
+def build_cohort_cube(df, etapa_col='IDEtapa', monto_col='Monto', aporte_col='AporteFONPLATAVigente',
+                      pais_col='Pais', sector_col='IDAreaPrioritaria', vigencia_col='FechaVigencia', efectiva_col='FechaEfectiva'):
+    vigencia = pd.to_datetime(df[vigencia_col]).to_numpy(dtype='datetime64[ns]')
+    efectiva = pd.to_datetime(df[efectiva_col]).to_numpy(dtype='datetime64[ns]')
+    anos = np.floor_divide(elapsed_months(vigencia, efectiva), 12)
+    validos = anos >= 0
+    data = df.loc[validos, [etapa_col, pais_col, sector_col, monto_col, aporte_col]].copy()
+    data['Cohorte'] = vigencia[validos].astype('datetime64[Y]').astype(np.int64) + 1970
+    data['Anos'] = anos[validos]
+
+    cohorte_idx, cohortes = pd.factorize(data['Cohorte'], sort=True)
+    pais_idx, paises = pd.factorize(data[pais_col].fillna('Sin País').astype(str), sort=True)
+    sector_idx, sectores = pd.factorize(data[sector_col].fillna('Sin Sector').astype(str), sort=True)
+    n_anos = int(data['Anos'].max()) + 1 if len(data) else 0
+    forma = (len(cohortes), len(paises), len(sectores))
+
+    # Montos: un único bincount sobre el índice plano (cohorte, país, sector, año)
+    celda = np.ravel_multi_index((cohorte_idx, pais_idx, sector_idx), forma) if len(data) else np.zeros(0, dtype=np.int64)
+    plano = celda * n_anos + data['Anos'].to_numpy(dtype=np.int64)
+    montos = np.bincount(plano, weights=data[monto_col].fillna(0).to_numpy(dtype=float), minlength=int(np.prod(forma)) * n_anos)
+    montos = montos.reshape(forma + (n_anos,))
+
+    # Aporte y cantidad de etapas por celda, contando cada etapa una sola vez
+    primera = ~data[etapa_col].duplicated().to_numpy()
+    aportes = np.bincount(celda[primera], weights=data[aporte_col].fillna(0).to_numpy(dtype=float)[primera],
+                          minlength=int(np.prod(forma))).reshape(forma)
+    proyectos = np.bincount(celda[primera], minlength=int(np.prod(forma))).reshape(forma)
+
+    # Último año observado de cada cohorte: más allá la curva quedaría plana sin datos reales
+    horizonte = np.full(len(cohortes), -1)
+    np.maximum.at(horizonte, cohorte_idx, data['Anos'].to_numpy(dtype=np.int64))
+
+    return CohortCube(np.asarray(cohortes, dtype=int), np.asarray(paises), np.asarray(sectores), montos, aportes, proyectos, horizonte)
+
+
+def _seleccion(valores, valor):
+    if valor is None or valor == TODOS:
+        return np.ones(len(valores), dtype=bool)
+    return valores == valor
+
+
+# Suma el cubo sobre el país y el sector elegidos: (montos cohorte x año, aporte por cohorte, etapas por cohorte)
+def _por_cohorte(cube, pais=None, sector=None):
+    paises = _seleccion(cube.paises, pais)
+    sectores = _seleccion(cube.sectores, sector)
+    montos = cube.montos[:, paises][:, :, sectores].sum(axis=(1, 2))
+    aportes = cube.aportes[:, paises][:, :, sectores].sum(axis=(1, 2))
+    proyectos = cube.proyectos[:, paises][:, :, sectores].sum(axis=(1, 2))
+    return montos, aportes, proyectos
+
+
+def _acumulado(montos, aportes, horizonte):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        acumulado = np.cumsum(montos, axis=-1) / aportes[..., None] * 100
+    observado = np.arange(montos.shape[-1]) <= np.asarray(horizonte)[..., None]
+    return np.where(observado & (aportes[..., None] > 0), acumulado, np.nan)
+
+
+# Porcentaje acumulado del aporte por cohorte y años desde la vigencia (formato largo, para el mapa de calor y las curvas)
+def cohort_curves(cube, pais=None, sector=None):
+    montos, aportes, proyectos = _por_cohorte(cube, pais, sector)
+    acumulado = _acumulado(montos, aportes, cube.horizonte)
+    n_cohortes, n_anos = acumulado.shape
+    resultado = pd.DataFrame({
+        'Cohorte': np.repeat(cube.cohortes, n_anos),
+        'Anos': np.tile(np.arange(n_anos), n_cohortes),
+        'Porcentaje Acumulado': acumulado.ravel(),
+        'Proyectos': np.repeat(proyectos, n_anos),
+    })
+    return resultado.dropna(subset=['Porcentaje Acumulado']).reset_index(drop=True)
+
+
+# Curvas de una cohorte separadas por país ('Pais') o por sector ('Sector')
+def cohort_breakdown(cube, cohorte, por='Pais'):
+    fila = np.flatnonzero(cube.cohortes == cohorte)
+    if len(fila) == 0:
+        return pd.DataFrame(columns=[por, 'Anos', 'Porcentaje Acumulado', 'Proyectos'])
+    fila = fila[0]
+    # Se suma sobre el otro eje: los sectores para ver países, los países para ver sectores
+    eje = 1 if por == 'Pais' else 0
+    etiquetas = cube.paises if por == 'Pais' else cube.sectores
+    montos = cube.montos[fila].sum(axis=eje)
+    aportes = cube.aportes[fila].sum(axis=eje)
+    proyectos = cube.proyectos[fila].sum(axis=eje)
+    acumulado = _acumulado(montos, aportes, cube.horizonte[fila])
+    n_anos = acumulado.shape[1]
+    resultado = pd.DataFrame({
+        por: np.repeat(etiquetas, n_anos),
+        'Anos': np.tile(np.arange(n_anos), len(etiquetas)),
+        'Porcentaje Acumulado': acumulado.ravel(),
+        'Proyectos': np.repeat(proyectos, n_anos),
+    })
+    return resultado.dropna(subset=['Porcentaje Acumulado']).reset_index(drop=True)
+
+
+# Dataset de Cohortes de Vigencia: el cubo se arma en el actualizador, una vez por descarga de las hojas, sobre los
+# desembolsos en el esquema canónico
+def build_dataset(frames):
+    reports = []
+    desembolsos, _ = core.from_sheets(frames, reports)
+    return build_cohort_cube(desembolsos), reports
+
+
+def _cohort_curves_cached(_cube, version, pais, sector):
+    metrics.cache_miss('cohort_curves')
+    return cohort_curves(_cube, pais, sector)
+
+
+@functools.lru_cache(maxsize=None)
+def _cached_curves():
+    import streamlit as st
+
+    return st.cache_data(max_entries=64, show_spinner=False)(_cohort_curves_cached)
+
+
+# Curvas de todas las cohortes para un país y sector por versión del dataset (cambiar de cohorte solo filtra este resultado)
+def load_cohort_curves(cube, version, pais, sector):
+    metrics.cache_call('cohort_curves')
+    return _cached_curves()(cube, version, pais, sector)
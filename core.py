@@ -0,0 +1,266 @@
+from collections import namedtuple
+import functools
+import io
+import re
+
+from bucketing import BUCKET_COLUMNS, add_time_buckets
+from joins import build_dimension, merge_many_to_one, stage_keys
+import metrics
+from utils import lazy_import
+from workbook import load_sheets, workbook_bytes
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Formato de un libro: hojas que lo identifican, hoja de desembolsos y nombres propios -> nombres del esquema canónico
+Layout = namedtuple('Layout', ['nombre', 'hojas', 'hoja_desembolsos', 'columnas'])
+
+LAYOUT_OPERACIONES = Layout('operaciones', ('Proyectos', 'Operaciones', 'OperacionesDesembolsos'), 'OperacionesDesembolsos', {})
+LAYOUT_DESEMBOLSOS = Layout('desembolsos', ('Desembolsos', 'Operaciones'), 'Desembolsos', {
+    'AporteFonplata': 'AporteFONPLATAVigente',
+    'SECTOR': 'IDAreaPrioritaria',
+    'SUBSECTOR': 'IDAreaIntervencion',
+})
+LAYOUTS = (LAYOUT_OPERACIONES, LAYOUT_DESEMBOLSOS)
+
+# Esquema canónico: los nombres del libro de Operaciones, que también usan las hojas de Google Sheets y el almacén local
+APORTE = 'AporteFONPLATAVigente'
+SECTOR = 'IDAreaPrioritaria'
+SUBSECTOR = 'IDAreaIntervencion'
+FECHAS = ('FechaVigencia', 'FechaEfectiva')
+
+COUNTRY_MAP = {'AR': 'Argentina', 'BO': 'Bolivia', 'BR': 'Brasil', 'PY': 'Paraguay', 'UR': 'Uruguay'}
+
+# Libro normalizado: desembolsos con los datos de su etapa (una fila por desembolso), una fila por etapa y avisos del merge
+Dataset = namedtuple('Dataset', ['layout', 'desembolsos', 'etapas', 'reports'])
+
+
+# Formato del libro según sus hojas
+def detect_layout(sheet_names):
+    nombres = set(sheet_names)
+    for layout in LAYOUTS:
+        if nombres.issuperset(layout.hojas):
+            return layout
+    esperados = ' o '.join('/'.join(layout.hojas) for layout in LAYOUTS)
+    raise ValueError(f"El libro no tiene las hojas esperadas ({esperados}); tiene: {', '.join(sheet_names)}")
+
+
+# Nombres de las hojas sin leer su contenido
+def workbook_sheet_names(data):
+    import openpyxl
+
+    wb = openpyxl.load_workbook(io.BytesIO(data), read_only=True)
+    try:
+        return wb.sheetnames
+    finally:
+        wb.close()
+
+
+# Nombre del país a partir de su código ('AR' -> 'Argentina'); los valores que no son códigos se conservan
+def country_name(serie):
+    return serie.map(COUNTRY_MAP).fillna(serie)
+
+
+# Meses abreviados en español de las fechas que exportan las hojas ('15-ago-14', 'martes, 17 de noviembre de 2015')
+MESES = {'ene': 1, 'feb': 2, 'mar': 3, 'abr': 4, 'may': 5, 'jun': 6, 'jul': 7, 'ago': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dic': 12}
+_FECHA_ESPANOL = re.compile(r'(?:\w+,\s*)?(\d{1,2})(?:-|\s+de\s+)([a-zñ]{3})[a-zñ]*(?:-|\s+de\s+)(\d{2}|\d{4})$', re.I)
+
+
+# Fecha con el mes en español, o NaT si el texto no tiene ese formato (los años de dos cifras son 20xx)
+def spanish_date(texto):
+    coincidencia = _FECHA_ESPANOL.match(str(texto).strip())
+    if coincidencia is None or coincidencia.group(2).lower() not in MESES:
+        return pd.NaT
+    dia, mes, ano = coincidencia.groups()
+    ano = int(ano) + 2000 if len(ano) == 2 else int(ano)
+    return pd.Timestamp(year=ano, month=MESES[mes.lower()], day=int(dia))
+
+
+# Fechas de una columna: se interpreta cada valor distinto una sola vez (los desembolsos repiten muchas fechas); los
+# valores que no son fechas día/mes/año se prueban con el mes en español
+def parse_dates(serie):
+    codigos, unicos = pd.factorize(serie)
+    unicos = pd.Series(unicos, dtype=object)
+    fechas = pd.to_datetime(unicos, dayfirst=True, errors='coerce')
+    fallidas = fechas.isna() & unicos.notna()
+    if fallidas.any():
+        fechas[fallidas] = [spanish_date(texto) for texto in unicos[fallidas]]
+    fechas = fechas.to_numpy(dtype='datetime64[ns]')
+    resultado = np.full(len(codigos), np.datetime64('NaT'), dtype='datetime64[ns]')
+    validos = codigos >= 0
+    resultado[validos] = fechas[codigos[validos]]
+    return pd.Series(resultado, index=serie.index)
+
+
+# Montos en formato español ('65.000.000,00') a número; los que ya son numéricos se dejan igual
+def to_number(serie):
+    if pd.api.types.is_numeric_dtype(serie):
+        return serie
+    texto = serie.astype('string').str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
+    return pd.to_numeric(texto, errors='coerce')
+
+
+def _dates(serie):
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie
+    return parse_dates(serie)
+
+
+def _canonical(df, layout):
+    df = df.rename(columns=layout.columnas)
+    for columna in FECHAS:
+        if columna in df.columns:
+            df[columna] = _dates(df[columna])
+    for columna in ('Monto', APORTE):
+        if columna in df.columns:
+            df[columna] = to_number(df[columna])
+    if 'IDEtapa' in df.columns:
+        df['IDEtapa'] = df['IDEtapa'].astype(str)
+        # El libro de Desembolsos no siempre trae el país ni el proyecto: se toman del prefijo de 'IDEtapa' y de la etapa
+        if 'Pais' not in df.columns:
+            df['Pais'] = df['IDEtapa'].str[:2]
+        if 'NoProyecto' not in df.columns:
+            df['NoProyecto'] = df['IDEtapa']
+    return df
+
+
+# Tabla de etapas del libro con los datos de su proyecto, las claves con que se unen a 'desembolsos' y las operaciones
+# cuyos desembolsos se excluyen por ambiguos (basta con sus columnas: el modo por bloques la arma con el primer bloque)
+def stage_dimension(hojas, layout, desembolsos, reports=None):
+    operaciones = hojas['Operaciones']
+    excluidas = ()
+    if layout is LAYOUT_OPERACIONES:
+        keys, excluidas = stage_keys(desembolsos, operaciones, reports)
+        if excluidas:
+            operaciones = operaciones[~operaciones['NoOperacion'].isin(excluidas)]
+        etapas = build_dimension(operaciones, keys, name='Operaciones', reports=reports)
+        proyectos = hojas['Proyectos']
+        # Las columnas repetidas (p. ej. 'Pais' o 'Alias') se toman de 'Operaciones'
+        columnas = [c for c in proyectos.columns if c not in etapas.columns]
+        etapas = merge_many_to_one(etapas, build_dimension(proyectos, 'NoProyecto', columns=columnas, name='Proyectos', reports=reports), on='NoProyecto')
+    else:
+        keys = ['IDEtapa']
+        etapas = build_dimension(operaciones, keys, name='Operaciones', reports=reports)
+    return etapas, keys, excluidas
+
+
+# Desembolsos (todos o un bloque) con los datos de su etapa, en el esquema canónico y con los periodos desde la vigencia
+def join_stages(desembolsos, etapas, keys, layout, excluidas=()):
+    if excluidas:
+        desembolsos = desembolsos[~desembolsos['NoOperacion'].isin(excluidas)]
+    columnas = keys + [c for c in etapas.columns if c not in desembolsos.columns]
+    merged = merge_many_to_one(desembolsos, etapas[columnas], on=keys)
+    return add_time_buckets(_canonical(merged, layout))
+
+
+# Une las hojas de cualquiera de los dos formatos en el esquema canónico.
+# 'hojas' es un dict nombre de hoja -> DataFrame (libro subido, almacén local o lo que devuelva load_sheets).
+def normalize(hojas, layout=None, reports=None):
+    layout = layout or detect_layout(hojas)
+    desembolsos = hojas[layout.hoja_desembolsos]
+    etapas, keys, excluidas = stage_dimension(hojas, layout, desembolsos, reports)
+    return join_stages(desembolsos, etapas, keys, layout, excluidas), _canonical(etapas, layout)
+
+
+# Hojas publicadas en Google Sheets (proyectos, operaciones, desembolsos): mismo formato que el libro de Operaciones
+def from_sheets(frames, reports=None):
+    hojas = {'Proyectos': frames['proyectos'], 'Operaciones': frames['operaciones'], 'OperacionesDesembolsos': frames['desembolsos']}
+    return normalize(hojas, LAYOUT_OPERACIONES, reports)
+
+
+def _load(data):
+    metrics.cache_miss('load_workbook')
+    layout = detect_layout(workbook_sheet_names(data))
+    reports = []
+    desembolsos, etapas = normalize(load_sheets(data, layout.hojas), layout, reports)
+    return Dataset(layout.nombre, desembolsos, etapas, reports)
+
+
+@functools.lru_cache(maxsize=None)
+def _cached_loader():
+    import streamlit as st
+
+    return st.cache_data(max_entries=4, show_spinner=False)(_load)
+
+
+# Libro de cualquiera de los dos formatos, normalizado una sola vez por contenido del archivo
+def load_workbook(source):
+    metrics.cache_call('load_workbook')
+    return _cached_loader()(workbook_bytes(source))
+
+
+# Fecha de corte por defecto: la del último desembolso del libro y no la del reloj, para que los resultados dependan
+# solo de los datos (se pueden guardar en caché y reproducir). NaT si ningún desembolso tiene fecha.
+def as_of_date(desembolsos):
+    fecha = desembolsos['FechaEfectiva'].max()
+    return pd.NaT if pd.isna(fecha) else fecha.normalize()
+
+
+# Desembolsos hechos hasta la fecha de corte, ese día incluido (los que no tienen fecha se conservan)
+def filter_as_of(desembolsos, fecha_corte):
+    if fecha_corte is None or pd.isna(fecha_corte):
+        return desembolsos
+    return desembolsos[~(desembolsos['FechaEfectiva'] >= pd.Timestamp(fecha_corte).normalize() + pd.Timedelta(days=1))]
+
+
+# Libro como estaba a la fecha de corte, sin volver a leerlo: las etapas no cambian, solo se filtran sus desembolsos
+def dataset_as_of(dataset, fecha_corte):
+    return dataset._replace(desembolsos=filter_as_of(dataset.desembolsos, fecha_corte))
+
+
+# Aporte por grupo contando cada etapa una sola vez
+def group_aporte(etapas, by):
+    return etapas.drop_duplicates(subset='IDEtapa').groupby(by, as_index=False)[APORTE].sum()
+
+
+# Desembolsos con ambas fechas (los periodos de las filas sin fecha valen -1)
+def with_dates(desembolsos):
+    return desembolsos[desembolsos['FechaVigencia'].notna() & desembolsos['FechaEfectiva'].notna()]
+
+
+# Desembolsos hechos desde la vigencia (sin los periodos negativos)
+def since_vigencia(desembolsos):
+    return desembolsos[desembolsos['Meses'] >= 0]
+
+
+# Monto por 'keys', Monto Acumulado dentro de cada 'acumular_por' y, si se da el aporte por 'acumular_por', sus porcentajes
+def cumulative_table(desembolsos, keys, acumular_por, aporte=None):
+    return accumulate(desembolsos.groupby(keys)['Monto'].sum().reset_index(), acumular_por, aporte)
+
+
+# Lo mismo a partir de los montos ya sumados por 'keys' (ordenados por 'keys', como los devuelve un groupby)
+def accumulate(tabla, acumular_por, aporte=None):
+    tabla['Monto Acumulado'] = tabla.groupby(acumular_por)['Monto'].cumsum()
+    if aporte is not None:
+        tabla = merge_many_to_one(tabla, aporte, on=acumular_por)
+        tabla['Porcentaje del Monto'] = tabla['Monto'] / tabla[APORTE] * 100
+        tabla['Porcentaje del Monto Acumulado'] = tabla['Monto Acumulado'] / tabla[APORTE] * 100
+    return tabla
+
+
+# Claves de la tabla por proyecto y periodo
+PROJECT_PERIOD_KEYS = ['NoProyecto', *BUCKET_COLUMNS, 'IDEtapa']
+
+
+# Montos por proyecto, etapa y periodo con su acumulado y porcentajes sobre el aporte del proyecto, más el sector,
+# subsector, país y alias del proyecto (Curva Países y las matrices de Google Sheets)
+def project_period_table(desembolsos, etapas):
+    return project_period_totals(with_dates(desembolsos).groupby(PROJECT_PERIOD_KEYS)['Monto'].sum().reset_index(), etapas)
+
+
+# La misma tabla a partir de los montos ya sumados por PROJECT_PERIOD_KEYS (p. ej. por bloques)
+def project_period_totals(tabla, etapas):
+    tabla = accumulate(tabla, 'NoProyecto', aporte=group_aporte(etapas, 'NoProyecto'))
+    columnas = [c for c in [SECTOR, SUBSECTOR, 'Pais', 'Alias'] if c in etapas.columns]
+    return merge_many_to_one(tabla, build_dimension(etapas, 'NoProyecto', columns=columnas), on='NoProyecto')
+
+
+# Monto por periodo en millones, su acumulado y los porcentajes sobre el total del periodo mostrado
+def period_summary(df, periodo):
+    resumen = df.groupby(periodo)['Monto'].sum().reset_index()
+    resumen['Monto'] /= 1e6
+    resumen['Monto Acumulado'] = resumen['Monto'].cumsum()
+    total = resumen['Monto'].sum()
+    resumen['Porcentaje del Monto'] = (resumen['Monto'] / total * 100).round(2)
+    resumen['Porcentaje Acumulado del Monto'] = (resumen['Monto Acumulado'] / total * 100).round(2)
+    return resumen
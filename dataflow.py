@@ -0,0 +1,148 @@
+from collections import namedtuple, OrderedDict
+import itertools
+import os
+import threading
+import time
+
+from streamlit.logger import get_logger
+
+import metrics
+
+LOGGER = get_logger(__name__)
+
+# Memoria máxima (aprox.) de los resultados que guarda el grafo de cada sesión; al pasarla se descartan los usados
+# hace más tiempo, que se vuelven a calcular si se necesitan
+MAX_BYTES = int(float(os.environ.get('DESEMBOLSOS_DATAFLOW_MB', 512)) * 2**20)
+
+# Resultado de una etapa; la versión cambia cada vez que la etapa se vuelve a ejecutar
+Node = namedtuple('Node', ['name', 'version', 'value'])
+
+_versions = itertools.count(1)
+
+
+# Valor capturado por una función que no se puede comparar por contenido (p. ej. un DataFrame): se compara por identidad
+class _Ref:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return isinstance(other, _Ref) and other.value is self.value
+
+    def __hash__(self):
+        return id(self.value)
+
+
+# Convierte los parámetros de los widgets (listas, dicts, sets) en algo comparable
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_freeze(v) for v in value)
+    try:
+        hash(value)
+    except TypeError:
+        return _Ref(value)
+    return value
+
+
+# Identidad de la función de una etapa: su código (los objetos de código se comparan con sus constantes, nombres y
+# funciones anidadas), los valores que captura del entorno y sus valores por defecto. Así una lambda que se vuelve a
+# crear en cada ejecución de la página sigue coincidiendo, pero no una que capturó otro valor.
+def _function_key(fn):
+    celdas = tuple(_freeze(c.cell_contents) for c in getattr(fn, '__closure__', None) or ())
+    return (fn.__code__, celdas, _freeze(fn.__defaults__), _freeze(getattr(fn, '__self__', None)))
+
+
+# Memoria aproximada de un resultado (sin contar el contenido de las columnas de texto, que costaría recorrerlas)
+def _size(value):
+    if hasattr(value, 'memory_usage') and hasattr(value, 'shape'):
+        uso = value.memory_usage(index=True, deep=False)
+        return int(getattr(uso, 'sum', lambda: uso)())
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_size(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_size(v) for v in value)
+    return 0
+
+
+# Grafo de etapas de una página (load → normalize → merge → bucket → aggregate → pivot → categorize → render).
+# Cada etapa declara sus entradas (etapas anteriores y parámetros); solo se vuelve a ejecutar si alguna cambió.
+# Las etapas pueden resolverse desde el hilo de la página y desde un trabajo en segundo plano (progressive.py) a la
+# vez: el lock protege la tabla de nodos y el registro de la ejecución, no el cálculo, que corre fuera de él.
+class Dataflow:
+    def __init__(self, max_bytes=MAX_BYTES):
+        self._nodes = OrderedDict()
+        self._bytes = 0
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.executed = []
+        self.timings = {}
+
+    # Marca el inicio de una ejecución de la página
+    def begin(self):
+        with self._lock:
+            self.executed = []
+        return self
+
+    # Valor externo (p. ej. el archivo subido) identificado por una clave barata de comparar
+    def source(self, name, value, key):
+        return self._resolve(name, ('source', _freeze(key)), lambda: value)
+
+    # Ejecuta fn(*valores de las entradas, **params) solo si cambiaron las entradas, los parámetros o la función
+    def stage(self, name, fn, *inputs, **params):
+        key = (_function_key(fn), tuple((n.name, n.version) for n in inputs), _freeze(params))
+        return self._resolve(name, key, lambda: fn(*(n.value for n in inputs), **params))
+
+    def _resolve(self, name, key, compute):
+        with self._lock:
+            guardado = self._nodes.get(name)
+            if guardado is not None and guardado[0] == key:
+                self._nodes.move_to_end(name)
+        if guardado is not None and guardado[0] == key:
+            metrics.stage_result(name)
+            return guardado[1]
+
+        inicio = time.perf_counter()
+        value = compute()
+        segundos = time.perf_counter() - inicio
+        tamano = _size(value)
+        with self._lock:
+            node = Node(name, next(_versions), value)
+            self.timings[name] = segundos
+            self.executed.append(name)
+            anterior = self._nodes.pop(name, None)
+            if anterior is not None:
+                self._bytes -= anterior[2]
+            self._nodes[name] = (key, node, tamano)
+            self._bytes += tamano
+            self._evict()
+        metrics.stage_result(name, segundos)
+        LOGGER.debug(f"Etapa '{name}' recalculada en {segundos * 1000:.1f} ms")
+        return node
+
+    # Descarta los resultados usados hace más tiempo hasta volver al límite (el recién calculado siempre se guarda).
+    # Las etapas posteriores de un resultado descartado siguen guardadas: como recalcularlo cambia su versión, también
+    # se recalculan si se vuelven a pedir.
+    def _evict(self):
+        while self._bytes > self.max_bytes and len(self._nodes) > 1:
+            nombre, (_, _, tamano) = self._nodes.popitem(last=False)
+            self._bytes -= tamano
+            LOGGER.debug(f"Etapa '{nombre}' descartada del grafo ({tamano / 2**20:.1f} MiB)")
+
+
+# Grafo de la página guardado en la sesión del usuario
+def session_flow(page):
+    import streamlit as st
+
+    clave = f'dataflow:{page}'
+    if clave not in st.session_state:
+        st.session_state[clave] = Dataflow()
+    return st.session_state[clave].begin()
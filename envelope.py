@@ -0,0 +1,82 @@
+from bucketing import GRANULARIDADES, elapsed_months
+from forecast import cumulative_percentage_matrix
+from utils import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+CUANTILES = (0.10, 0.50, 0.90)
+
+
+# Matriz IDEtapa x Periodo del porcentaje acumulado y atributos por etapa. Después del último desembolso el porcentaje
+# se mantiene hasta la edad del proyecto a la fecha de corte (la del último desembolso de la cartera, si no se indica);
+# solo quedan en NaN los periodos que el proyecto todavía no vivió. Así un proyecto que terminó en el año 3 sigue
+# contando en las bandas de los años siguientes.
+def build_envelope_matrix(df, etapa_col='IDEtapa', period_col='Ano', monto_col='Monto', aporte_col='AporteFONPLATAVigente',
+                          pais_col='Pais', sector_col='IDAreaPrioritaria', vigencia_col='FechaVigencia',
+                          fecha_col='FechaEfectiva', fecha_corte=None):
+    etapas, acumulado, _, _, ultimo = cumulative_percentage_matrix(df, etapa_col, period_col, monto_col, aporte_col)
+
+    atributos = df.drop_duplicates(subset=etapa_col).copy()
+    atributos[etapa_col] = atributos[etapa_col].astype(str)
+    atributos = atributos.set_index(etapa_col).reindex(etapas)
+
+    # Edad (en periodos) de cada proyecto a la fecha de corte; sin vigencia se usa el último periodo con desembolsos
+    edad = ultimo
+    if vigencia_col in atributos and fecha_col in df:
+        if fecha_corte is None:
+            fecha_corte = df[fecha_col].max()
+        if pd.notna(fecha_corte):
+            meses_por_periodo = dict(GRANULARIDADES.values())[period_col]
+            meses = elapsed_months(atributos[vigencia_col].to_numpy(dtype='datetime64[ns]'),
+                                   np.datetime64(pd.Timestamp(fecha_corte), 'ns'))
+            edad = np.maximum(ultimo, np.where(meses >= 0, meses // meses_por_periodo, -1))
+    observado = np.arange(acumulado.shape[1])[None, :] <= edad[:, None]
+    matriz = np.where(observado & np.isfinite(acumulado), acumulado, np.nan)
+
+    etapas_df = pd.DataFrame({
+        etapa_col: etapas,
+        'Pais': atributos[pais_col].to_numpy() if pais_col in atributos else None,
+        'Sector': atributos[sector_col].to_numpy() if sector_col in atributos else None,
+        'Cohorte': pd.to_datetime(atributos[vigencia_col]).dt.year.to_numpy() if vigencia_col in atributos else None,
+    })
+    return etapas_df, matriz
+
+
+# Filas de la matriz que cumplen el filtro (None o 'Todos' no filtra)
+def filter_rows(etapas_df, pais=None, sector=None, cohorte=None):
+    seleccion = np.ones(len(etapas_df), dtype=bool)
+    for columna, valor in (('Pais', pais), ('Sector', sector), ('Cohorte', cohorte)):
+        if valor is not None and valor != 'Todos':
+            seleccion &= (etapas_df[columna] == valor).to_numpy()
+    return seleccion
+
+
+# Bandas de percentiles por periodo sobre los proyectos seleccionados
+def percentile_bands(matriz, seleccion, period_col='Ano', cuantiles=CUANTILES):
+    sub = matriz[seleccion]
+    columnas = [f'P{int(round(q * 100))}' for q in cuantiles]
+    if sub.size == 0:
+        return pd.DataFrame(columns=[period_col, *columnas, 'Proyectos'])
+
+    observados = np.isfinite(sub).sum(axis=0)
+    validos = observados > 0
+    bandas = np.full((len(cuantiles), sub.shape[1]), np.nan)
+    bandas[:, validos] = np.nanquantile(sub[:, validos], cuantiles, axis=0)
+
+    resultado = pd.DataFrame(bandas.T, columns=columnas)
+    resultado.insert(0, period_col, np.arange(sub.shape[1]))
+    resultado['Proyectos'] = observados
+    return resultado[validos].reset_index(drop=True)
+
+
+# Percentil (0-100) del proyecto frente a sus pares en cada periodo observado
+def percentile_rank(matriz, seleccion, fila):
+    sub = matriz[seleccion]
+    valores = matriz[fila]
+    with np.errstate(invalid='ignore'):
+        debajo = (sub <= valores[None, :]).sum(axis=0)
+    observados = np.isfinite(sub).sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rango = np.where(np.isfinite(valores) & (observados > 0), debajo / observados * 100, np.nan)
+    return rango
@@ -0,0 +1,175 @@
+import os
+
+from pools import SpawnPool
+from utils import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Umbral (en %) a partir del cual se considera que un proyecto terminó de desembolsar
+UMBRAL_COMPLETADO = 99.0
+
+# Cantidad mínima de proyectos por proceso para que valga la pena paralelizar
+MIN_PROYECTOS_POR_PROCESO = 2000
+
+# Pool de procesos de los ajustes, compartido por todas las sesiones
+_pool = SpawnPool(os.cpu_count() or 1)
+
+_K_LIMITES = (0.05, 5.0)
+_T0_LIMITES = (-5.0, 40.0)
+
+
+# Curva S logística en porcentaje: 100 / (1 + e^(-k (t - t0)))
+def logistic_curve(t, k, t0):
+    return 100.0 / (1.0 + np.exp(-k * (t - t0)))
+
+
+# Matriz IDEtapa x Periodo con el porcentaje acumulado del aporte (los periodos sin desembolsos repiten el acumulado)
+def cumulative_percentage_matrix(df, etapa_col='IDEtapa', period_col='Ano', monto_col='Monto', aporte_col='AporteFONPLATAVigente'):
+    data = df[[etapa_col, period_col, monto_col, aporte_col]].dropna(subset=[etapa_col, period_col])
+    data = data[data[period_col] >= 0]
+
+    etapas, etapa_idx = np.unique(data[etapa_col].astype(str).to_numpy(), return_inverse=True)
+    periodos = data[period_col].to_numpy(dtype=np.int64)
+    n_periodos = int(periodos.max()) + 1 if len(periodos) else 0
+
+    montos = np.zeros((len(etapas), n_periodos))
+    np.add.at(montos, (etapa_idx, periodos), data[monto_col].fillna(0).to_numpy(dtype=float))
+
+    aportes = np.zeros(len(etapas))
+    aportes[etapa_idx] = data[aporte_col].to_numpy(dtype=float)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        acumulado = np.cumsum(montos, axis=1) / aportes[:, None] * 100
+
+    # Solo son observados los periodos hasta el último desembolso de cada etapa
+    ultimo = np.full(len(etapas), -1)
+    np.maximum.at(ultimo, etapa_idx, periodos)
+    mask = np.arange(n_periodos)[None, :] <= ultimo[:, None]
+    mask &= np.isfinite(acumulado)
+
+    return etapas, acumulado, mask, aportes, ultimo
+
+
+# Ajuste Levenberg-Marquardt de todas las curvas a la vez (un sistema 2x2 por proyecto, resuelto en forma vectorizada).
+# El tiempo se mide en años: el periodo p cierra en t = (p + 1) / periodos_por_ano.
+def fit_s_curves(acumulado, mask, periodos_por_ano=1, iteraciones=60):
+    n, n_periodos = acumulado.shape
+    t = np.arange(1, n_periodos + 1, dtype=float)[None, :] / periodos_por_ano
+    y = np.where(mask, acumulado, 0.0)
+    w = mask.astype(float)
+
+    # Punto inicial: periodo en que se cruza el 50% o, si aún no se cruzó, el siguiente al último observado
+    cruza = (y >= 50) & mask
+    ultimo = np.where(mask.any(axis=1), n_periodos - np.argmax(mask[:, ::-1], axis=1), 1)
+    t0 = np.where(cruza.any(axis=1), np.argmax(cruza, axis=1) + 1.0, ultimo + periodos_por_ano) / periodos_por_ano
+    k = np.ones(n)
+    lam = np.full(n, 1e-2)
+
+    def sse(k, t0):
+        r = logistic_curve(t, k[:, None], t0[:, None]) - y
+        return (w * r * r).sum(axis=1)
+
+    error = sse(k, t0)
+    for _ in range(iteraciones):
+        s = 1.0 / (1.0 + np.exp(-k[:, None] * (t - t0[:, None])))
+        r = 100.0 * s - y
+        ds = 100.0 * s * (1.0 - s)
+        jk = ds * (t - t0[:, None])
+        jt = -ds * k[:, None]
+
+        a = (w * jk * jk).sum(axis=1)
+        b = (w * jk * jt).sum(axis=1)
+        c = (w * jt * jt).sum(axis=1)
+        gk = (w * jk * r).sum(axis=1)
+        gt = (w * jt * r).sum(axis=1)
+
+        a_l = a + lam * (a + 1e-9)
+        c_l = c + lam * (c + 1e-9)
+        det = a_l * c_l - b * b
+        det = np.where(np.abs(det) < 1e-12, 1e-12, det)
+        dk = -(c_l * gk - b * gt) / det
+        dt = -(a_l * gt - b * gk) / det
+
+        k_nuevo = np.clip(k + dk, *_K_LIMITES)
+        t0_nuevo = np.clip(t0 + dt, *_T0_LIMITES)
+        error_nuevo = sse(k_nuevo, t0_nuevo)
+
+        mejora = error_nuevo < error
+        k = np.where(mejora, k_nuevo, k)
+        t0 = np.where(mejora, t0_nuevo, t0)
+        error = np.where(mejora, error_nuevo, error)
+        lam = np.where(mejora, lam * 0.3, lam * 10.0)
+
+    return k, t0
+
+
+def _fit_chunk(args):
+    acumulado, mask, periodos_por_ano = args
+    return fit_s_curves(acumulado, mask, periodos_por_ano)
+
+
+# Reparte los proyectos en bloques entre varios procesos cuando el volumen lo justifica
+def fit_s_curves_parallel(acumulado, mask, periodos_por_ano=1, max_workers=None):
+    n = acumulado.shape[0]
+    n_bloques = min(max_workers or _pool.workers, _pool.workers, n // MIN_PROYECTOS_POR_PROCESO)
+    if n_bloques <= 1:
+        return fit_s_curves(acumulado, mask, periodos_por_ano)
+
+    bloques = np.array_split(np.arange(n), n_bloques)
+    resultados = _pool.map(_fit_chunk, [(acumulado[b], mask[b], periodos_por_ano) for b in bloques])
+    if resultados is None:
+        return fit_s_curves(acumulado, mask, periodos_por_ano)
+    k = np.concatenate([r[0] for r in resultados])
+    t0 = np.concatenate([r[1] for r in resultados])
+    return k, t0
+
+
+# Ajusta la curva S de cada IDEtapa y proyecta los desembolsos de los periodos restantes (horizonte en años)
+def forecast_projects(df, etapa_col='IDEtapa', period_col='Ano', monto_col='Monto', aporte_col='AporteFONPLATAVigente', periodos_por_ano=1, horizonte=15):
+    etapas, acumulado, mask, aportes, ultimo = cumulative_percentage_matrix(df, etapa_col, period_col, monto_col, aporte_col)
+    columnas_proyeccion = [etapa_col, period_col, 'Porcentaje Acumulado Proyectado', 'Monto Proyectado', 'Monto Acumulado Proyectado']
+    if len(etapas) == 0:
+        return pd.DataFrame(columns=[etapa_col, 'k', 't0', 'Porcentaje Actual', 'Fin Proyectado']), pd.DataFrame(columns=columnas_proyeccion)
+
+    k, t0 = fit_s_curves_parallel(acumulado, mask, periodos_por_ano)
+    horizonte = int(horizonte * periodos_por_ano)
+
+    filas = np.arange(len(etapas))
+    actual = np.where(ultimo >= 0, acumulado[filas, np.maximum(ultimo, 0)], 0.0)
+    actual = np.nan_to_num(actual)
+
+    # Periodo en que la curva alcanza el umbral
+    t_fin = t0 + np.log(UMBRAL_COMPLETADO / (100.0 - UMBRAL_COMPLETADO)) / k
+    fin = np.maximum(np.ceil(t_fin * periodos_por_ano - 1), ultimo + 1)
+    fin = np.where(actual >= UMBRAL_COMPLETADO, ultimo, np.minimum(fin, ultimo + horizonte))
+
+    parametros = pd.DataFrame({
+        etapa_col: etapas,
+        'k': k,
+        't0': t0,
+        'Porcentaje Actual': actual,
+        'Fin Proyectado': fin.astype(int),
+    })
+
+    # Proyección de los periodos restantes: la curva nunca baja del acumulado observado ni supera el 100%
+    futuros = ultimo[:, None] + np.arange(1, horizonte + 1)[None, :]
+    curva = logistic_curve((futuros + 1.0) / periodos_por_ano, k[:, None], t0[:, None])
+    proyectado = np.minimum(np.maximum.accumulate(np.maximum(curva, actual[:, None]), axis=1), 100.0)
+    proyectado = np.where(futuros >= fin[:, None], 100.0, proyectado)
+    pendiente = (futuros <= fin[:, None]) & (actual[:, None] < UMBRAL_COMPLETADO)
+
+    incremento = np.diff(np.concatenate([actual[:, None], proyectado], axis=1), axis=1)
+    monto = incremento / 100.0 * aportes[:, None]
+    monto_acumulado = proyectado / 100.0 * aportes[:, None]
+
+    fila, columna = np.nonzero(pendiente)
+    proyeccion = pd.DataFrame({
+        etapa_col: etapas[fila],
+        period_col: futuros[fila, columna],
+        'Porcentaje Acumulado Proyectado': proyectado[fila, columna],
+        'Monto Proyectado': monto[fila, columna],
+        'Monto Acumulado Proyectado': monto_acumulado[fila, columna],
+    })
+
+    return parametros, proyeccion
@@ -0,0 +1,91 @@
+from collections import namedtuple
+
+from streamlit.logger import get_logger
+
+LOGGER = get_logger(__name__)
+
+# Claves repetidas encontradas al armar una tabla de dimensión (cada una multiplicaría filas en un merge)
+JoinReport = namedtuple('JoinReport', ['dimension', 'key', 'duplicated_keys', 'conflicting_keys', 'extra_rows', 'sample'])
+
+
+# Tabla de dimensión con una fila por clave; las claves repetidas se reportan y se conserva la primera fila
+def build_dimension(df, key, columns=None, name=None, reports=None):
+    key = [key] if isinstance(key, str) else list(key)
+    if columns is not None:
+        df = df[key + [c for c in columns if c not in key]]
+    df = df.dropna(subset=key)
+
+    repetidas = df.duplicated(subset=key, keep=False)
+    if not repetidas.any():
+        return df
+
+    filas = df[repetidas]
+    claves = filas[key].drop_duplicates()
+    # Claves cuyas filas repetidas tienen valores distintos (no son simples copias)
+    distintas = filas.drop_duplicates()
+    en_conflicto = distintas[distintas.duplicated(subset=key, keep=False)][key].drop_duplicates()
+    muestra = [tuple(v) if len(key) > 1 else v[0] for v in claves.head(5).itertuples(index=False, name=None)]
+
+    report = JoinReport(name or ', '.join(key), tuple(key), len(claves), len(en_conflicto), int(repetidas.sum() - len(claves)), muestra)
+    LOGGER.warning(f"{report.dimension}: {report.duplicated_keys} claves repetidas ({report.conflicting_keys} con valores distintos), p. ej. {muestra}")
+    if reports is not None:
+        reports.append(report)
+    return df.drop_duplicates(subset=key, keep='first')
+
+
+# Merge validado muchos-a-uno: el resultado nunca tiene más filas que la tabla de hechos
+def merge_many_to_one(fact, dimension, on, how='left'):
+    return fact.merge(dimension, on=on, how=how, validate='many_to_one')
+
+
+# Columnas que identifican una etapa dentro de una operación
+IDENTIFICADORES_ETAPA = ('IDEtapa', 'NoEtapa')
+
+
+# Operaciones cuyos desembolsos se excluyeron porque no se puede saber a qué etapa corresponde cada uno (las filas
+# excluidas se cuentan en la tabla de hechos recibida: en el modo por bloques, el primer bloque)
+ExcludedReport = namedtuple('ExcludedReport', ['dimension', 'key', 'excluded_keys', 'excluded_rows', 'sample'])
+
+
+# Claves de etapa disponibles en ambas tablas: 'IDEtapa', ('NoOperacion', 'NoEtapa') o, si no hay otra, solo
+# 'NoOperacion'. En este último caso una operación con varias etapas es ambigua: sus desembolsos quedarían todos en la
+# primera (con su aporte, sector y vigencia). Esas operaciones se reportan y se devuelven para excluirlas, sin frenar
+# la carga del resto del libro. Devuelve (claves, operaciones excluidas).
+def stage_keys(fact, dimension, reports=None):
+    if 'IDEtapa' in fact.columns and 'IDEtapa' in dimension.columns:
+        return ['IDEtapa'], ()
+    if 'NoEtapa' in fact.columns and 'NoEtapa' in dimension.columns:
+        return ['NoOperacion', 'NoEtapa'], ()
+    identificadores = [c for c in IDENTIFICADORES_ETAPA if c in dimension.columns]
+    if not identificadores:
+        return ['NoOperacion'], ()
+
+    etapas = dimension.dropna(subset=['NoOperacion']).drop_duplicates(subset=['NoOperacion'] + identificadores)
+    repetidas = etapas['NoOperacion'][etapas.duplicated(subset='NoOperacion')].unique()
+    if len(repetidas):
+        filas = int(fact['NoOperacion'].isin(repetidas).sum()) if 'NoOperacion' in fact.columns else 0
+        report = ExcludedReport('Desembolsos', ('NoOperacion',), len(repetidas), filas, list(repetidas[:5]))
+        LOGGER.warning(f"{len(repetidas)} operaciones con varias etapas y desembolsos sin 'IDEtapa' ni 'NoEtapa': "
+                       f"se excluyen sus desembolsos, p. ej. {report.sample}")
+        if reports is not None:
+            reports.append(report)
+    return ['NoOperacion'], tuple(repetidas)
+
+
+# Aviso en la página con las claves repetidas que se descartaron y los desembolsos excluidos
+def show_join_reports(reports):
+    import streamlit as st
+
+    for report in reports:
+        if isinstance(report, ExcludedReport):
+            st.warning(
+                f"{report.excluded_keys} operaciones tienen varias etapas y sus desembolsos no traen 'IDEtapa' ni "
+                f"'NoEtapa': no se puede saber a qué etapa corresponde cada desembolso, así que se excluyeron "
+                f"({report.excluded_rows} desembolsos). Ejemplos: {report.sample}"
+            )
+            continue
+        st.warning(
+            f"Se encontraron {report.duplicated_keys} claves repetidas en {report.dimension} "
+            f"({report.conflicting_keys} con valores distintos); se usó la primera fila de cada una "
+            f"para no multiplicar los desembolsos. Ejemplos: {report.sample}"
+        )
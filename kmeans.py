@@ -0,0 +1,93 @@
+from utils import lazy_import
+
+np = lazy_import('numpy')
+
+# Tamaño del lote de k-means y puntos por bloque al asignar todos los puntos (limita la matriz de distancias en memoria)
+BATCH_SIZE = 1024
+BLOQUE_ASIGNACION = 65536
+
+# Pasadas máximas sobre todos los puntos y mejora relativa mínima de la inercia entre dos pasadas para seguir
+MAX_ITER = 200
+TOLERANCIA = 1e-4
+
+
+# Columnas con media 0 y desviación 1; las columnas constantes quedan en 0. Devuelve también la media y la desviación
+def standardize(X):
+    X = np.asarray(X, dtype=float)
+    media = X.mean(axis=0)
+    desviacion = X.std(axis=0)
+    desviacion[desviacion == 0] = 1.0
+    return (X - media) / desviacion, media, desviacion
+
+
+# Distancias al cuadrado de cada punto a cada centroide: |x|² - 2 x·c + |c|², sin armar el arreglo n x k x d
+def squared_distances(X, centroides):
+    d = (X * X).sum(axis=1)[:, None] - 2.0 * X @ centroides.T + (centroides * centroides).sum(axis=1)[None, :]
+    return np.maximum(d, 0.0)
+
+
+# Centroide más cercano de cada punto y su distancia al cuadrado, por bloques de BLOQUE_ASIGNACION puntos
+def assign(X, centroides):
+    etiquetas = np.empty(len(X), dtype=np.int64)
+    distancias = np.empty(len(X))
+    for inicio in range(0, len(X), BLOQUE_ASIGNACION):
+        d = squared_distances(X[inicio:inicio + BLOQUE_ASIGNACION], centroides)
+        cercano = d.argmin(axis=1)
+        etiquetas[inicio:inicio + BLOQUE_ASIGNACION] = cercano
+        distancias[inicio:inicio + BLOQUE_ASIGNACION] = d[np.arange(len(d)), cercano]
+    return etiquetas, distancias
+
+
+# Centroides iniciales k-means++: cada uno se elige con probabilidad proporcional a la distancia al más cercano ya elegido
+def kmeans_plus_plus(X, k, rng):
+    centroides = np.empty((k, X.shape[1]))
+    centroides[0] = X[rng.integers(len(X))]
+    cercana = squared_distances(X, centroides[:1])[:, 0]
+    for i in range(1, k):
+        total = cercana.sum()
+        elegido = rng.choice(len(X), p=cercana / total) if total > 0 else rng.integers(len(X))
+        centroides[i] = X[elegido]
+        cercana = np.minimum(cercana, squared_distances(X, centroides[i:i + 1])[:, 0])
+    return centroides
+
+
+# K-means por mini-lotes (Sculley, 2010) sobre X ya estandarizado. Cada lote se asigna al centroide más cercano y
+# mueve cada centroide hacia la media de sus puntos del lote con tasa (puntos del lote / puntos vistos), todo
+# vectorizado por centroide. Una pasada son los lotes que suman len(X) puntos; al cerrar cada una se mide la inercia de
+# todos los puntos y se termina cuando mejora menos de 'tol' (relativo). El desplazamiento de los centroides no sirve
+# para esto: se achica solo porque la tasa decae como 1 / puntos vistos, aunque los centroides no hayan convergido.
+# Con menos puntos que el lote, cada pasada usa todos (k-means clásico).
+# Devuelve los centroides, la etiqueta de cada punto y la inercia (suma de distancias al cuadrado).
+def minibatch_kmeans(X, k, batch_size=BATCH_SIZE, max_iter=MAX_ITER, tol=TOLERANCIA, seed=0):
+    X = np.asarray(X, dtype=float)
+    k = min(k, len(X))
+    rng = np.random.default_rng(seed)
+    centroides = kmeans_plus_plus(X, k, rng)
+    completo = len(X) <= batch_size
+    lotes_por_pasada = 1 if completo else -(-len(X) // batch_size)
+    vistos = np.zeros(k)
+    inercia = np.inf
+
+    for _ in range(max_iter):
+        for _ in range(lotes_por_pasada):
+            lote = X if completo else X[rng.choice(len(X), batch_size, replace=False)]
+            etiquetas, _ = assign(lote, centroides)
+            cantidad = np.bincount(etiquetas, minlength=k).astype(float)
+            sumas = np.zeros_like(centroides)
+            np.add.at(sumas, etiquetas, lote)
+
+            con_puntos = cantidad > 0
+            if completo:
+                centroides[con_puntos] = sumas[con_puntos] / cantidad[con_puntos, None]
+            else:
+                vistos += cantidad
+                tasa = cantidad[con_puntos] / vistos[con_puntos]
+                media_lote = sumas[con_puntos] / cantidad[con_puntos, None]
+                centroides[con_puntos] += tasa[:, None] * (media_lote - centroides[con_puntos])
+
+        etiquetas, distancias = assign(X, centroides)
+        anterior, inercia = inercia, float(distancias.sum())
+        if anterior - inercia <= tol * inercia:
+            break
+
+    return centroides, etiquetas, inercia
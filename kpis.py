@@ -0,0 +1,37 @@
+from collections import namedtuple
+
+import core
+from utils import lazy_import
+
+pd = lazy_import('pandas')
+
+# Indicadores de la portada, precalculados junto con cada copia de las hojas
+PortfolioKpis = namedtuple('PortfolioKpis', ['fecha_corte', 'total', 'total_ano', 'etapas_activas', 'etapas', 'por_pais'])
+
+
+# Total desembolsado, desembolsado en el año de la fecha de corte, etapas activas y porcentaje desembolsado por país
+def portfolio_kpis(desembolsos, etapas, fecha_corte):
+    fecha_corte = pd.Timestamp(fecha_corte)
+    total = float(desembolsos['Monto'].sum())
+    total_ano = float(desembolsos.loc[desembolsos['FechaEfectiva'].dt.year == fecha_corte.year, 'Monto'].sum())
+
+    etapas = etapas.drop_duplicates(subset='IDEtapa').set_index('IDEtapa')
+    desembolsado = desembolsos.groupby('IDEtapa')['Monto'].sum().reindex(etapas.index, fill_value=0)
+    if 'Estado' in etapas.columns:
+        activas = int((etapas['Estado'].astype(str).str.strip().str.lower() == 'vigente').sum())
+    else:
+        # Sin 'Estado': activa mientras no haya desembolsado todo su aporte
+        activas = int((desembolsado < etapas[core.APORTE] * 0.995).sum())
+
+    por_pais = pd.DataFrame({'Pais': etapas['Pais'], 'Desembolsado': desembolsado, 'Aporte': etapas[core.APORTE]})
+    por_pais = por_pais.groupby('Pais', as_index=False)[['Desembolsado', 'Aporte']].sum()
+    por_pais['Porcentaje Desembolsado'] = por_pais['Desembolsado'] / por_pais['Aporte'] * 100
+    por_pais['Pais'] = core.country_name(por_pais['Pais'])
+    return PortfolioKpis(fecha_corte, total, total_ano, activas, len(etapas), por_pais)
+
+
+# Constructor para el actualizador de Google Sheets: se recalcula con cada descarga, fuera de la portada.
+# La fecha de corte es la del último desembolso publicado, así los indicadores solo cambian cuando cambian los datos.
+def build_kpis(frames):
+    desembolsos, etapas = core.from_sheets(frames)
+    return portfolio_kpis(desembolsos, etapas, core.as_of_date(desembolsos))
@@ -0,0 +1,65 @@
+import functools
+
+import core
+import metrics
+
+
+# Dataset de Matrices de Desembolsos a partir de las hojas de Google Sheets (se ejecuta en el actualizador, fuera de la
+# página): el mismo esquema canónico y la misma tabla por proyecto y periodo que Curva Países
+def build_dataset(frames):
+    reports = []
+    desembolsos, etapas = core.from_sheets(frames, reports)
+    return core.project_period_table(desembolsos, etapas), reports
+
+
+# Matrices de montos (millones) y porcentajes por IDEtapa y periodo para los países elegidos
+def pivot_tables(result_df, paises, periodo):
+    filtered_df = result_df[result_df['Pais'].isin(paises)]
+
+    # Crear la tabla de Montos con los periodos como columnas y IDEtapa como filas
+    montos_pivot = filtered_df.pivot_table(
+        index='IDEtapa', 
+        columns=periodo, 
+        values='Monto', 
+        aggfunc='sum'
+    ).fillna(0)
+
+    # Convertir los montos a millones
+    montos_pivot = (montos_pivot / 1_000_000).round(3)
+
+    # Agregar la columna de totales al final de la tabla de Montos
+    montos_pivot['Total'] = montos_pivot.sum(axis=1)
+
+    # Crear la tabla de Porcentajes con los periodos como columnas y IDEtapa como filas
+    porcentaje_pivot = filtered_df.pivot_table(
+        index='IDEtapa', 
+        columns=periodo, 
+        values='Porcentaje del Monto', 
+        aggfunc='sum'
+    ).fillna(0)
+
+    # Redondear a dos decimales en el DataFrame de porcentajes
+    porcentaje_pivot = porcentaje_pivot.round(2)
+
+    # Agregar la columna de totales al final de la tabla de Porcentajes
+    porcentaje_pivot['Total'] = porcentaje_pivot.sum(axis=1).round(0)
+
+    return montos_pivot, porcentaje_pivot
+
+
+def _pivot_tables_cached(_result_df, version, paises, periodo):
+    metrics.cache_miss('pivot_tables')
+    return pivot_tables(_result_df, list(paises), periodo)
+
+
+@functools.lru_cache(maxsize=None)
+def _cached_pivots():
+    import streamlit as st
+
+    return st.cache_data(max_entries=64, show_spinner=False)(_pivot_tables_cached)
+
+
+# Matrices por versión del dataset, países y granularidad, compartidas entre sesiones (y precalculadas al arrancar)
+def load_pivot_tables(result_df, version, paises, periodo):
+    metrics.cache_call('pivot_tables')
+    return _cached_pivots()(result_df, version, tuple(paises), periodo)
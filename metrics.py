@@ -0,0 +1,236 @@
+from contextlib import contextmanager
+from datetime import datetime
+import functools
+import json
+import logging.handlers
+import os
+import resource
+import threading
+import time
+
+from streamlit.logger import get_logger
+
+LOGGER = get_logger(__name__)
+
+# Archivo JSONL de métricas por ejecución de página (sin él no se registra nada), con rotación por tamaño
+METRICS_FILE = os.environ.get('DESEMBOLSOS_METRICS_FILE')
+METRICS_MAX_BYTES = int(os.environ.get('DESEMBOLSOS_METRICS_MAX_BYTES', 10 * 2**20))
+METRICS_BACKUPS = int(os.environ.get('DESEMBOLSOS_METRICS_BACKUPS', 5))
+
+# Versiones de Streamlit (mayor, menor) en las que se verificó ScriptRunContext._enqueue, que es privado: fuera de este
+# rango no se cuentan los bytes enviados (el registro lleva bytes_sent = None) en vez de tocar un atributo que cambió
+ENQUEUE_VERSIONS = ((1, 52), (1, 66))
+
+# Registro de la ejecución en curso de cada hilo (Streamlit ejecuta cada sesión en su propio hilo)
+_actual = threading.local()
+_en_curso = 0
+_en_curso_lock = threading.Lock()
+_records_logger = None
+_records_lock = threading.Lock()
+
+
+# Logger de los registros: un JSON por línea en el archivo rotativo. Es un logger hijo de LOGGER sin registrar en
+# Streamlit, que le volvería a poner la consola y el nivel de logger.level cada vez que cambia la configuración.
+def _metrics_logger():
+    global _records_logger
+    with _records_lock:
+        if _records_logger is None:
+            records = logging.getLogger(f'{LOGGER.name}.records')
+            records.propagate = False
+            records.setLevel(logging.INFO)
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(METRICS_FILE)), exist_ok=True)
+                handler = logging.handlers.RotatingFileHandler(METRICS_FILE, maxBytes=METRICS_MAX_BYTES, backupCount=METRICS_BACKUPS, encoding='utf-8')
+                handler.setFormatter(logging.Formatter('%(message)s'))
+                records.addHandler(handler)
+            except OSError as e:
+                LOGGER.error("No se pudo abrir el archivo de métricas: " + str(e))
+            _records_logger = records
+        return _records_logger
+
+
+def _rss_mib():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError):
+        return None
+
+
+def _peak_rss_mib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# Sesiones abiertas en el servidor (None fuera de un servidor de Streamlit)
+def _active_sessions():
+    from streamlit.runtime import Runtime
+
+    if not Runtime.exists():
+        return None
+    session_mgr = getattr(Runtime.instance(), '_session_mgr', None)
+    return session_mgr.num_active_sessions() if session_mgr is not None else None
+
+
+# Datos de una ejecución de la página
+class PageRun:
+    def __init__(self, page):
+        self.page = page
+        self.rows = None
+        self.stages = {}
+        self.reused = []
+        self.cache = {}
+        self.updates = {}
+        self.bytes_sent = 0
+
+    def stage(self, name, seconds):
+        self.stages[name] = round(self.stages.get(name, 0.0) + seconds * 1000, 2)
+
+    def cache_event(self, name, hit):
+        contador = self.cache.setdefault(name, {'hits': 0, 'misses': 0})
+        contador['hits' if hit else 'misses'] += 1
+
+    def update(self, name, incremental):
+        contador = self.updates.setdefault(name, {'incremental': 0, 'full': 0})
+        contador['incremental' if incremental else 'full'] += 1
+
+    # Cuenta los bytes de cada mensaje que la sesión envía al navegador durante la ejecución
+    def _count_bytes(self, enqueue):
+        def contar(msg):
+            self.bytes_sent += msg.ByteSize()
+            return enqueue(msg)
+        return contar
+
+
+# Si se puede envolver ctx._enqueue para contar bytes: versión de Streamlit dentro de ENQUEUE_VERSIONS y el atributo
+# presente. Se avisa una sola vez cuando no.
+@functools.lru_cache(maxsize=None)
+def _enqueue_supported():
+    import streamlit
+
+    try:
+        version = tuple(int(parte) for parte in streamlit.__version__.split('.')[:2])
+    except ValueError:
+        version = None
+    soportada = version is not None and ENQUEUE_VERSIONS[0] <= version <= ENQUEUE_VERSIONS[1]
+    if not soportada:
+        LOGGER.warning(f"Streamlit {streamlit.__version__} no está entre las versiones verificadas para medir los bytes "
+                       f"enviados ({'.'.join(map(str, ENQUEUE_VERSIONS[0]))} a {'.'.join(map(str, ENQUEUE_VERSIONS[1]))}); "
+                       "las métricas no los incluyen")
+    return soportada
+
+
+def current():
+    return getattr(_actual, 'run', None)
+
+
+# Mide una ejecución completa de la página y agrega una línea al archivo de métricas:
+#     with metrics.page_run('curvas_proyectos'):
+#         run()
+@contextmanager
+def page_run(page):
+    global _en_curso
+    if not METRICS_FILE:
+        yield None
+        return
+
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    registro = PageRun(page)
+    ctx = get_script_run_ctx()
+    enqueue = getattr(ctx, '_enqueue', None) if _enqueue_supported() else None
+    if enqueue is not None:
+        ctx._enqueue = registro._count_bytes(enqueue)
+    else:
+        registro.bytes_sent = None
+    _actual.run = registro
+    with _en_curso_lock:
+        _en_curso += 1
+        concurrentes = _en_curso
+    inicio = time.perf_counter()
+    status = 'ok'
+    try:
+        yield registro
+    except BaseException as e:
+        # Streamlit interrumpe el script con excepciones propias al volver a ejecutar o detener la página
+        status = 'stopped' if type(e).__name__ in ('RerunException', 'StopException') else 'error'
+        raise
+    finally:
+        total = time.perf_counter() - inicio
+        _actual.run = None
+        if enqueue is not None:
+            ctx._enqueue = enqueue
+        with _en_curso_lock:
+            _en_curso -= 1
+        _metrics_logger().info(json.dumps({
+            'ts': datetime.now().isoformat(timespec='milliseconds'),
+            'page': page,
+            'session': getattr(ctx, 'session_id', None),
+            'status': status,
+            'total_ms': round(total * 1000, 2),
+            'rows': registro.rows,
+            'stages': registro.stages,
+            'reused': registro.reused,
+            'cache': registro.cache,
+            'updates': registro.updates,
+            'bytes_sent': registro.bytes_sent,
+            'rss_mib': _rss_mib(),
+            'peak_rss_mib': _peak_rss_mib(),
+            'sessions': _active_sessions(),
+            'concurrent_runs': concurrentes,
+        }, ensure_ascii=False, default=str))
+
+
+# Filas del dataset con el que trabaja la página
+def dataset_size(rows):
+    registro = current()
+    if registro is not None:
+        registro.rows = int(rows)
+
+
+# Mide un bloque de la página como una etapa:
+#     with metrics.stage('index'):
+#         index = load_project_index(...)
+@contextmanager
+def stage(name):
+    registro = current()
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        if registro is not None:
+            registro.stage(name, time.perf_counter() - inicio)
+
+
+# Etapa del grafo de la página (dataflow): recalculada con su duración o reutilizada
+def stage_result(name, seconds=None):
+    registro = current()
+    if registro is None:
+        return
+    if seconds is None:
+        registro.reused.append(name)
+    else:
+        registro.stage(name, seconds)
+    registro.cache_event('dataflow', hit=seconds is None)
+
+
+# Aciertos y fallos de los cachés compartidos: cache_call en cada llamada y cache_miss dentro de la función cacheada
+# (que Streamlit solo ejecuta cuando no tiene el resultado)
+def cache_call(name):
+    registro = current()
+    if registro is not None:
+        registro.cache_event(name, hit=True)
+
+
+def cache_miss(name):
+    registro = current()
+    if registro is not None:
+        contador = registro.cache.setdefault(name, {'hits': 0, 'misses': 0})
+        contador['hits'] -= 1
+        contador['misses'] += 1
+
+
+# Resúmenes que se actualizan con las filas nuevas (incremental) o se vuelven a calcular desde cero (full)
+def update_mode(name, incremental):
+    registro = current()
+    if registro is not None:
+        registro.update(name, incremental)
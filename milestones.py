@@ -0,0 +1,74 @@
+from bucketing import elapsed_months
+from utils import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Hitos en porcentaje del aporte
+HITOS = (25, 50, 75, 90, 100)
+
+# Margen (puntos porcentuales) para el redondeo de los montos: 99,999% cuenta como 100%
+TOLERANCIA = 0.01
+
+# Separación entre proyectos en la clave de búsqueda; mayor que cualquier porcentaje acumulado recortado
+_ESCALA = 1000.0
+
+
+def milestone_columns(hitos=HITOS):
+    return [f'Meses al {h}%' for h in hitos]
+
+
+# Meses desde la vigencia hasta que cada etapa alcanza cada hito, para todas las etapas a la vez.
+# Los desembolsos se ordenan por (etapa, fecha) y el porcentaje acumulado de cada etapa se desplaza por
+# etapa * _ESCALA: el arreglo queda ordenado globalmente y un solo searchsorted encuentra todos los cruces.
+def milestone_months(df, etapa_col='IDEtapa', monto_col='Monto', aporte_col='AporteFonplata',
+                     vigencia_col='FechaVigencia', efectiva_col='FechaEfectiva', hitos=HITOS):
+    data = df[[etapa_col, monto_col, aporte_col, vigencia_col, efectiva_col]].dropna(subset=[etapa_col, efectiva_col])
+    etapas, etapa_idx = np.unique(data[etapa_col].astype(str).to_numpy(), return_inverse=True)
+    efectiva = data[efectiva_col].to_numpy(dtype='datetime64[ns]')
+    orden = np.lexsort((efectiva, etapa_idx))
+    etapa_idx = etapa_idx[orden]
+    meses = elapsed_months(data[vigencia_col].to_numpy(dtype='datetime64[ns]')[orden], efectiva[orden])
+    montos = data[monto_col].fillna(0).to_numpy(dtype=float)[orden]
+
+    aportes = np.zeros(len(etapas))
+    aportes[etapa_idx] = data[aporte_col].to_numpy(dtype=float)[orden]
+    inicio = np.searchsorted(etapa_idx, np.arange(len(etapas)), side='left')
+    fin = np.searchsorted(etapa_idx, np.arange(len(etapas)), side='right')
+
+    # Acumulado por etapa: acumulado global menos lo acumulado antes del primer desembolso de la etapa
+    acumulado = np.cumsum(montos)
+    antes = np.concatenate(([0.0], acumulado))[inicio]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        porcentaje = (acumulado - antes[etapa_idx]) / aportes[etapa_idx] * 100
+    porcentaje = np.clip(np.nan_to_num(porcentaje, nan=0.0), 0, _ESCALA / 2)
+
+    # Los reintegros pueden bajar el acumulado; el primer cruce es el mismo sobre el máximo corrido
+    clave = np.maximum.accumulate(etapa_idx * _ESCALA + porcentaje)
+
+    objetivos = np.asarray(hitos, dtype=float) - TOLERANCIA
+    posicion = np.searchsorted(clave, (np.arange(len(etapas)) * _ESCALA)[:, None] + objetivos[None, :], side='left')
+    alcanzado = (posicion < fin[:, None]) & (aportes[:, None] > 0)
+    resultado = np.where(alcanzado, meses[np.minimum(posicion, len(meses) - 1)], np.nan)
+    resultado[resultado < 0] = np.nan
+
+    salida = pd.DataFrame(resultado, columns=milestone_columns(hitos))
+    salida.insert(0, etapa_col, etapas)
+    salida['Porcentaje Actual'] = np.where(fin > inicio, porcentaje[np.maximum(fin - 1, 0)], 0.0).round(2)
+    return salida
+
+
+# Distribución de los meses a cada hito por grupo (p. ej. país o sector): etapas que lo alcanzaron y cuartiles
+def milestone_distribution(hitos_df, por, hitos=HITOS):
+    largo = hitos_df.melt(id_vars=[por], value_vars=milestone_columns(hitos), var_name='Hito', value_name='Meses')
+    largo['Hito'] = pd.Categorical(largo['Hito'], categories=milestone_columns(hitos), ordered=True)
+    grupos = largo.groupby([por, 'Hito'], observed=True)['Meses']
+    resultado = grupos.agg(
+        Etapas='size',
+        Alcanzado='count',
+        P25=lambda s: s.quantile(0.25),
+        Mediana='median',
+        P75=lambda s: s.quantile(0.75),
+    ).reset_index()
+    resultado['% Alcanzado'] = (resultado['Alcanzado'] / resultado['Etapas'] * 100).round(1)
+    return resultado
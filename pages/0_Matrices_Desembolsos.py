@@ -1,46 +1,233 @@
 import streamlit as st
-import pandas as pd
 from streamlit.logger import get_logger
-import altair as alt
-import threading
-import io  # <-- Importa io
+from dataflow import session_flow
+from bucketing import BUCKET_COLUMNS, granularity_selector
+import core
+import metrics
+from joins import build_dimension, merge_many_to_one
+from milestones import milestone_distribution, milestone_months
+from progressive import cancel_session_job, session_job, stratified_sample, wait_for
+from snapshot_diff import category_changes, delta_matrices, disbursement_changes
+from utils import excel_download, lazy_import
+
+pd = lazy_import('pandas')
+alt = lazy_import('altair')
 
 LOGGER = get_logger(__name__)
-_lock = threading.Lock()
+
+# Etapa 'aggregate': montos por etapa, periodo y desembolso con sus porcentajes sobre el aporte de la etapa
+def aggregate(dataset):
+    result_df = core.cumulative_table(dataset.desembolsos, ['IDEtapa', *BUCKET_COLUMNS, 'IDDesembolso'], 'IDEtapa',
+                                      aporte=core.group_aporte(dataset.etapas, 'IDEtapa'))
+    result_df['Pais'] = country_of(result_df['IDEtapa'])
+
+    # Añadir sector, subsector y 'FechaVigencia' al DataFrame resultante
+    columnas = [c for c in [core.SECTOR, core.SUBSECTOR, 'FechaVigencia'] if c in dataset.etapas.columns]
+    return merge_many_to_one(result_df, build_dimension(dataset.etapas, 'IDEtapa', columns=columnas), on='IDEtapa')
+
+# País según el prefijo de 'IDEtapa'
+def country_of(etapas):
+    return etapas.str[:2].map(core.COUNTRY_MAP).fillna('Desconocido')
 
 def process_dataframe(xls_path):
-    with _lock:
-        xls = pd.ExcelFile(xls_path, engine='openpyxl')
-        desembolsos = xls.parse('Desembolsos')
-        operaciones = xls.parse('Operaciones')
+    return aggregate(core.load_workbook(xls_path))
+
+# Etapa 'pivot': matrices de montos (millones) y porcentajes por IDEtapa y periodo para los países elegidos
+def pivot(result_df, paises, periodo):
+    filtered_df = result_df[result_df['Pais'].isin(paises)]
+
+    # Crear la tabla de Montos con los periodos como columnas y IDEtapa como filas
+    montos_pivot = filtered_df.pivot_table(
+        index='IDEtapa', 
+        columns=periodo, 
+        values='Monto', 
+        aggfunc='sum'
+    ).fillna(0)
+
+    # Convertir los montos a millones
+    montos_pivot = (montos_pivot / 1_000_000).round(3)
+
+    # Agregar la columna de totales al final de la tabla de Montos
+    montos_pivot['Total'] = montos_pivot.sum(axis=1)
+
+    # Crear la tabla de Porcentajes con los periodos como columnas y IDEtapa como filas
+    porcentaje_pivot = filtered_df.pivot_table(
+        index='IDEtapa', 
+        columns=periodo, 
+        values='Porcentaje del Monto', 
+        aggfunc='sum'
+    ).fillna(0)
+
+    # Redondear a dos decimales en el DataFrame de porcentajes
+    porcentaje_pivot = porcentaje_pivot.round(2)
+
+    # Agregar la columna de totales al final de la tabla de Porcentajes
+    porcentaje_pivot['Total'] = porcentaje_pivot.sum(axis=1).round(0)
+
+    return montos_pivot, porcentaje_pivot
+
+# Creando la función de categorización
+def categorize_project(row):
+    if row['Total'] == 100:
+        return 'Completado'
+    elif row['Total'] >= 50:
+        return 'Últimos Desembolsos'
+    else:
+        return 'Empezando sus Desembolsos'
+
+# Etapa 'categorize': trabaja sobre una copia para no modificar la matriz de porcentajes ya mostrada
+def categorize(pivots):
+    porcentaje_pivot = pivots[1].copy()
+
+    # Aplicando la misma lógica para calcular los años hasta ahora y la categorización
+    porcentaje_pivot['Años hasta Ahora'] = porcentaje_pivot.iloc[:, 1:10].apply(
+        lambda row: row.last_valid_index(), axis=1
+    )
+
+    # Identificamos las columnas que contienen los porcentajes por año, excluyendo 'Total' y 'Años hasta Ahora'
+    year_columns = [col for col in porcentaje_pivot.columns if col not in ['Total', 'Años hasta Ahora']]
+
+    # Encontramos el último año con un valor que no sea cero para cada proyecto
+    last_year_with_value = porcentaje_pivot[year_columns].apply(lambda row: row[row > 0].last_valid_index(), axis=1)
+
+    # Agregamos esta información al DataFrame
+    porcentaje_pivot['Último Año'] = last_year_with_value
 
-    # Asegúrate de que las columnas 'SECTOR' y 'SUBSECTOR' estén en 'operaciones'
-    merged_df = pd.merge(desembolsos, operaciones[['IDEtapa', 'FechaVigencia', 'AporteFonplata', 'SECTOR', 'SUBSECTOR']], on='IDEtapa', how='left')
-    merged_df['FechaEfectiva'] = pd.to_datetime(merged_df['FechaEfectiva'], dayfirst=True)
-    merged_df['FechaVigencia'] = pd.to_datetime(merged_df['FechaVigencia'], dayfirst=True)
-    merged_df['Ano'] = ((merged_df['FechaEfectiva'] - merged_df['FechaVigencia']).dt.days / 366).astype(int)
-    merged_df['Meses'] = ((merged_df['FechaEfectiva'] - merged_df['FechaVigencia']).dt.days / 30).astype(int)
+    # Creando la columna de categorización
+    porcentaje_pivot['Categoría'] = porcentaje_pivot.apply(categorize_project, axis=1)
 
-    result_df = merged_df.groupby(['IDEtapa', 'Ano', 'Meses', 'IDDesembolso', 'AporteFonplata'])['Monto'].sum().reset_index()
-    result_df['Monto Acumulado'] = result_df.groupby(['IDEtapa'])['Monto'].cumsum().reset_index(drop=True)
-    result_df['Porcentaje del Monto'] = result_df['Monto'] / result_df['AporteFonplata'] * 100
-    result_df['Porcentaje del Monto Acumulado'] = result_df['Monto Acumulado'] / result_df['AporteFonplata'] * 100
+    # Restableciendo el índice para convertir 'IDEtapa' de nuevo en una columna
+    porcentaje_pivot_reset = porcentaje_pivot.reset_index()
 
-    country_map = {'AR': 'Argentina', 'BO': 'Bolivia', 'BR': 'Brasil', 'PY': 'Paraguay', 'UR': 'Uruguay'}
-    result_df['Pais'] = result_df['IDEtapa'].str[:2].map(country_map).fillna('Desconocido')
+    # Seleccionando las columnas para la tabla final
+    final_table_pivot = porcentaje_pivot_reset[['IDEtapa', 'Total', 'Último Año', 'Categoría']]
 
-    # Añadir 'SECTOR', 'SUBSECTOR' y 'FechaVigencia' al DataFrame resultante
-    result_df = pd.merge(result_df, operaciones[['IDEtapa', 'SECTOR', 'SUBSECTOR', 'FechaVigencia']], on='IDEtapa', how='left')
+    # Contando el número de proyectos en cada categoría
+    category_counts_pivot = porcentaje_pivot['Categoría'].value_counts()
 
-    return result_df
+    return final_table_pivot, category_counts_pivot
 
+# Etapa 'milestones': meses desde la vigencia hasta el 25/50/75/90/100% del aporte de cada etapa, con su país y sector
+def milestones(dataset):
+    hitos_df = milestone_months(dataset.desembolsos, aporte_col=core.APORTE)
+    hitos_df['Pais'] = country_of(hitos_df['IDEtapa'])
+    return merge_many_to_one(hitos_df, build_dimension(dataset.etapas, 'IDEtapa', columns=[core.SECTOR]), on='IDEtapa')
+
+# Cuartiles de los meses a cada hito por país o sector
+def milestone_chart(distribucion_df, por):
+    base = alt.Chart(distribucion_df).encode(
+        x=alt.X('Hito:N', sort=None, axis=alt.Axis(title=None, labelAngle=0)),
+        xOffset=alt.XOffset(f'{por}:N'),
+        color=alt.Color(f'{por}:N'),
+    )
+    rango = base.mark_rule(strokeWidth=2).encode(
+        y=alt.Y('P25:Q', axis=alt.Axis(title='Meses desde la Vigencia')),
+        y2='P75:Q',
+    )
+    mediana = base.mark_point(filled=True, size=60).encode(
+        y='Mediana:Q',
+        tooltip=[por, 'Hito', 'Mediana', 'P25', 'P75', 'Alcanzado', '% Alcanzado'],
+    )
+    return (rango + mediana).properties(title='Meses hasta cada Hito (P25, Mediana, P75)', width=600, height=400)
+
+
+# Libro reducido a las etapas de una muestra estratificada por país y sector, para la vista previa
+def sample_dataset(dataset):
+    etapas = dataset.etapas.assign(Pais=country_of(dataset.etapas['IDEtapa']))
+    muestra = stratified_sample(etapas, ['Pais', core.SECTOR] if core.SECTOR in etapas.columns else ['Pais'])
+    return core.Dataset(
+        dataset.layout,
+        dataset.desembolsos[dataset.desembolsos['IDEtapa'].isin(muestra)],
+        dataset.etapas[dataset.etapas['IDEtapa'].isin(muestra)],
+        [],
+    ), len(muestra), dataset.etapas['IDEtapa'].nunique()
+
+def excel_button(df, file_name):
+    st.download_button(
+        label="Descargar DataFrame en Excel",
+        data=excel_download(df),
+        file_name=file_name,
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    )
+
+def show_result(result_df):
+    st.write(result_df)
+    # Convertir el DataFrame a bytes y agregar botón de descarga
+    excel_button(result_df, "resultados_desembolsos.xlsx")
+
+# La vista previa no ofrece descargas: solo se exportan las tablas exactas
+def show_pivots(montos_pivot, porcentaje_pivot, descargas=True):
+    # Mostrar las tablas en Streamlit con un ancho fijo y la posibilidad de desplazamiento horizontal
+    st.write('Tabla de Montos En Millones de USD:')
+    st.dataframe(montos_pivot, width=1500, height=600)  # Ajusta el ancho y alto según sea necesario
+    if descargas:
+        excel_button(montos_pivot, "matriz_montos_desembolsos.xlsx")
+
+    st.write('Tabla de Porcentajes del Monto:')
+    st.dataframe(porcentaje_pivot, width=1500, height=600)
+    if descargas:
+        excel_button(porcentaje_pivot, "matriz_porcentaje_desembolsos.xlsx")
+
+def show_categories(final_table_pivot, category_counts_pivot):
+    # Utilizar st.columns para colocar gráficos lado a lado
+    col1, col2 = st.columns(2)
+    with col1:
+        # Mostrando las primeras filas de la tabla final
+        st.write(final_table_pivot)
+
+    with col2:
+        # Mostrando las primeras filas de la tabla final
+        st.write(category_counts_pivot)
+
+def show_milestones(hitos_df):
+    st.dataframe(hitos_df, width=1500, height=400)
+    excel_button(hitos_df, "hitos_desembolsos.xlsx")
+
+def show_distribution(distribucion_df, por):
+    st.altair_chart(milestone_chart(distribucion_df, por), width='stretch')
+    st.write(distribucion_df)
+
+# Cambios desde el corte anterior: desembolsos, categorías y matrices para los países elegidos
+def show_comparison(cambios, categorias, deltas, paises):
+    desembolsos = cambios.cambios[country_of(cambios.cambios['IDEtapa']).isin(paises)]
+    conteos = desembolsos['Cambio'].value_counts()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric('Desembolsos nuevos', f"{conteos.get('Nuevo', 0):,}")
+    col2.metric('Desembolsos eliminados', f"{conteos.get('Eliminado', 0):,}")
+    col3.metric('Desembolsos modificados', f"{conteos.get('Modificado', 0):,}")
+    col4.metric('Diferencia en Monto (Millones)', f"{desembolsos['Diferencia Monto'].sum() / 1e6:,.2f}")
+
+    st.write('Desembolsos Nuevos, Eliminados y Modificados:')
+    st.dataframe(desembolsos, width=1500, height=400)
+    excel_button(desembolsos, "cambios_desembolsos.xlsx")
+
+    cambios_categoria, movimientos = categorias
+    st.write(f'Etapas que cambiaron de Categoría ({len(cambios_categoria):,}):')
+    col1, col2 = st.columns(2)
+    with col1:
+        st.write(cambios_categoria)
+    with col2:
+        st.write(movimientos)
+
+    montos, porcentajes, celdas_montos, celdas_porcentajes = deltas
+    st.write(f'Cambio en la Tabla de Montos En Millones de USD ({celdas_montos:,} celdas distintas):')
+    st.dataframe(montos, width=1500, height=400)
+    excel_button(montos, "delta_montos_desembolsos.xlsx")
+    st.write(f'Cambio en la Tabla de Porcentajes del Monto ({celdas_porcentajes:,} celdas distintas):')
+    st.dataframe(porcentajes, width=1500, height=400)
+    excel_button(porcentajes, "delta_porcentaje_desembolsos.xlsx")
+
+# Etapas exactas de la página, en el orden en que se muestran; corren en segundo plano sobre el grafo de la sesión
+def calculation_steps(flow, dataset, paises, periodo, por, fecha_corte):
+    return [
+        ('as_of', lambda r: flow.stage('as_of', core.dataset_as_of, dataset, fecha_corte=fecha_corte)),
+        ('aggregate', lambda r: flow.stage('aggregate', aggregate, r['as_of'])),
+        ('pivot', lambda r: flow.stage('pivot', pivot, r['aggregate'], paises=paises, periodo=periodo)),
+        ('categorize', lambda r: flow.stage('categorize', categorize, r['pivot'])),
+        ('milestones', lambda r: flow.stage('milestones', milestones, r['as_of'])),
+        ('distribution', lambda r: flow.stage('distribution', milestone_distribution, r['milestones'], por=por)),
+    ]
 
-def dataframe_to_excel_bytes(df):
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Resultados', index=False)
-    output.seek(0)
-    return output
 
 def run():
     st.set_page_config(
@@ -51,154 +238,133 @@ def run():
     st.title("Matrices de Desembolsos 📊")
     st.write("Carga tu archivo Excel y explora las métricas relacionadas con los desembolsos.")
     uploaded_file = st.file_uploader("Carga tu Excel aquí", type="xlsx")
-    
-    if uploaded_file:
-        result_df = process_dataframe(uploaded_file)
-        st.write(result_df)
-        
-        # Convertir el DataFrame a bytes y agregar botón de descarga
-        excel_bytes = dataframe_to_excel_bytes(result_df)
-        st.download_button(
-            label="Descargar DataFrame en Excel",
-            data=excel_bytes,
-            file_name="resultados_desembolsos.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
-        
-        filtered_df = result_df
-        
-        # Calcular Monto y Monto Acumulado para cada año
-        df_monto_anual = filtered_df.groupby('Ano')["Monto"].sum().reset_index()
-        df_monto_acumulado_anual = df_monto_anual['Monto'].cumsum()
-
-        # Calcular Porcentaje del Monto de forma acumulativa
-        aporte_total = filtered_df['AporteFonplata'].iloc[0]  # Asume que AporteFonplata es constante
-        df_porcentaje_monto_anual = (df_monto_anual['Monto'] / aporte_total * 100).round(2)
-        df_porcentaje_monto_acumulado_anual = (df_monto_acumulado_anual / aporte_total * 100).round(2)
-
-        # Crear DataFrame combinado para el cuadro de resumen
-        combined_df = pd.DataFrame({
-            'Ano': df_monto_anual['Ano'],
-            'Monto': df_monto_anual['Monto'],
-            'Monto Acumulado': df_monto_acumulado_anual,
-            'Porcentaje del Monto': df_porcentaje_monto_anual,
-            'Porcentaje del Monto Acumulado': df_porcentaje_monto_acumulado_anual
-        })
-
-        st.write("Resumen de Datos:")
-
-        combined_df = process_dataframe(uploaded_file)
-        
-        # Filtrar por países múltiples
-        countries = combined_df['Pais'].unique()
-        selected_countries = st.multiselect('Selecciona Países:', countries, default=countries)
-        filtered_df = combined_df[combined_df['Pais'].isin(selected_countries)]
-
-        # Configuración del formato de visualización de los DataFrame
-        pd.options.display.float_format = '{:,.2f}'.format
-
-        # Crear la tabla de Montos con años como columnas y IDEtapa como filas
-        montos_pivot = filtered_df.pivot_table(
-            index='IDEtapa', 
-            columns='Ano', 
-            values='Monto', 
-            aggfunc='sum'
-        ).fillna(0)
-
-        # Convertir los montos a millones
-        montos_pivot = (montos_pivot / 1_000_000).round(3)
-
-        # Agregar la columna de totales al final de la tabla de Montos
-        montos_pivot['Total'] = montos_pivot.sum(axis=1)
-
-        # Crear la tabla de Porcentajes con años como columnas y IDEtapa como filas
-        porcentaje_pivot = filtered_df.pivot_table(
-            index='IDEtapa', 
-            columns='Ano', 
-            values='Porcentaje del Monto', 
-            aggfunc='sum'
-        ).fillna(0)
-
-        # Redondear a dos decimales en el DataFrame de porcentajes
-        porcentaje_pivot = porcentaje_pivot.round(2)
-
-        # Agregar la columna de totales al final de la tabla de Porcentajes
-        porcentaje_pivot['Total'] = porcentaje_pivot.sum(axis=1).round(0)
-
-        # Mostrar las tablas en Streamlit con un ancho fijo y la posibilidad de desplazamiento horizontal
-        st.write('Tabla de Montos En Millones de USD:')
-        st.dataframe(montos_pivot, width=1500, height=600)  # Ajusta el ancho y alto según sea necesario
-
-        # Convertir el DataFrame a bytes y agregar botón de descarga
-        excel_bytes = dataframe_to_excel_bytes(montos_pivot)
-        st.download_button(
-            label="Descargar DataFrame en Excel",
-            data=excel_bytes,
-            file_name="matriz_montos_desembolsos.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
-
-        st.write('Tabla de Porcentajes del Monto:')
-        st.dataframe(porcentaje_pivot, width=1500, height=600)
-
-        # Convertir el DataFrame a bytes y agregar botón de descarga
-        excel_bytes = dataframe_to_excel_bytes(porcentaje_pivot)
-        st.download_button(
-            label="Descargar DataFrame en Excel",
-            data=excel_bytes,
-            file_name="matriz_porcentaje_desembolsos.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
-
-        # Aplicando la misma lógica para calcular los años hasta ahora y la categorización
-        porcentaje_pivot['Años hasta Ahora'] = porcentaje_pivot.iloc[:, 1:10].apply(
-            lambda row: row.last_valid_index(), axis=1
-        )
-
-        # Creando la función de categorización
-        def categorize_project(row):
-            if row['Total'] == 100:
-                return 'Completado'
-            elif row['Total'] >= 50:
-                return 'Últimos Desembolsos'
-            else:
-                return 'Empezando sus Desembolsos'
-
-        # Identificamos las columnas que contienen los porcentajes por año, excluyendo 'Total' y 'Años hasta Ahora'
-        year_columns = [col for col in porcentaje_pivot.columns if col not in ['Total', 'Años hasta Ahora']]
-
-        # Encontramos el último año con un valor que no sea cero para cada proyecto
-        last_year_with_value = porcentaje_pivot[year_columns].apply(lambda row: row[row > 0].last_valid_index(), axis=1)
-
-        # Agregamos esta información al DataFrame
-        porcentaje_pivot['Último Año'] = last_year_with_value
-
-        # Creando la columna de categorización
-        porcentaje_pivot['Categoría'] = porcentaje_pivot.apply(categorize_project, axis=1)
-
-        # Restableciendo el índice para convertir 'IDEtapa' de nuevo en una columna
-        porcentaje_pivot_reset = porcentaje_pivot.reset_index()
-
-        # Seleccionando las columnas para la tabla final
-        final_table_pivot = porcentaje_pivot_reset[['IDEtapa', 'Total', 'Último Año', 'Categoría']]
-
-        # Creando la columna de categorización
-        porcentaje_pivot['Categoría'] = porcentaje_pivot.apply(categorize_project, axis=1)
-
-        # Contando el número de proyectos en cada categoría
-        category_counts_pivot = porcentaje_pivot['Categoría'].value_counts()
-
-        # Utilizar st.columns para colocar gráficos lado a lado
-        col1, col2 = st.columns(2)
-        with col1:
-            # Mostrando las primeras filas de la tabla final
-            final_table_pivot
-
-        with col2:
-            # Mostrando las primeras filas de la tabla final
-            category_counts_pivot
-
-        
+    _, periodo = granularity_selector()
+    uploaded_anterior = st.sidebar.file_uploader("Corte anterior para comparar (opcional)", type="xlsx",
+                                                 help="Muestra los desembolsos nuevos, eliminados y modificados, las etapas que cambiaron de categoría y la diferencia en las matrices.")
+    progresivo = st.sidebar.checkbox('Vista previa mientras se calcula', value=True,
+                                     help="Una vez leído el libro, muestra primero las tablas de una muestra estratificada por país y sector y las reemplaza por las exactas a medida que terminan.")
+
+    if not uploaded_file:
+        cancel_session_job('carga')
+        cancel_session_job('calculo')
+        return
+
+    # Las etapas corren en segundo plano; la página espera cada resultado sin bloquearse, así que cambiar un widget
+    # interrumpe la espera y cancela el trabajo que quedó desactualizado
+    flow = session_flow('matrices_desembolsos')
+    archivo_id = getattr(uploaded_file, 'file_id', uploaded_file)
+    archivo = flow.source('archivo', uploaded_file, key=archivo_id)
+    estado = st.empty()
+    aviso = st.empty()
+    carga = session_job('carga', archivo_id, lambda: [('load', lambda r: flow.stage('load', core.load_workbook, archivo))])
+    # La muestra de la vista previa sale del libro ya unido: hasta que termine la lectura no hay nada que mostrar
+    try:
+        dataset = wait_for(carga, 'load', estado, "Leyendo el libro (la vista previa aparece al terminar la lectura)..."
+                           if progresivo else "Leyendo el libro...")
+    except ValueError as e:
+        # Libro con otras hojas o columnas: el error de la lectura en segundo plano se muestra como mensaje
+        estado.empty()
+        st.error(f"No se pudo leer el libro: {e}")
+        return
+    metrics.dataset_size(len(dataset.value.desembolsos))
+
+    # Fecha de corte: por defecto la del último desembolso del libro; una fecha anterior muestra la cartera (matrices,
+    # categorías e hitos) como estaba ese día, filtrando los desembolsos sin volver a leer el libro
+    fecha_corte = None
+    ultima = core.as_of_date(dataset.value.desembolsos)
+    if pd.notna(ultima):
+        fecha_corte = st.sidebar.date_input('Fecha de corte', value=ultima.date(), max_value=ultima.date(),
+                                            min_value=dataset.value.desembolsos['FechaEfectiva'].min().date())
+
+    # Marcadores en el orden de la página; los widgets se crean antes de esperar los resultados exactos
+    ph_result = st.empty()
+    st.write("Resumen de Datos:")
+
+    # Filtrar por países múltiples
+    countries = country_of(dataset.value.desembolsos['IDEtapa'].drop_duplicates().sort_values()).unique()
+    selected_countries = st.multiselect('Selecciona Países:', countries, default=countries)
+
+    # Configuración del formato de visualización de los DataFrame
+    pd.options.display.float_format = '{:,.2f}'.format
+
+    ph_pivots = st.empty()
+    ph_categories = st.empty()
+
+    # Meses hasta cada hito de desembolso, calculados para todas las etapas en una sola pasada
+    st.write('Meses desde la Vigencia hasta cada Hito de Desembolso:')
+    ph_milestones = st.empty()
+    por = st.selectbox('Distribución de los Hitos por', ['Pais', core.SECTOR])
+    ph_distribution = st.empty()
+
+    calculo = session_job('calculo', (archivo_id, periodo, tuple(selected_countries), por, fecha_corte),
+                          lambda: calculation_steps(flow, dataset, selected_countries, periodo, por, fecha_corte))
+
+    # Vista previa de las secciones que todavía no tienen su resultado exacto
+    if progresivo and not calculo.done('categorize'):
+        muestra, n_muestra, n_etapas = sample_dataset(core.dataset_as_of(dataset.value, fecha_corte))
+        preview_df = aggregate(muestra)
+        preview_pivots = pivot(preview_df, selected_countries, periodo)
+        aviso.caption(f"Vista previa: muestra estratificada por país y sector de {n_muestra:,} de {n_etapas:,} etapas. Calculando las tablas exactas...")
+        if not calculo.done('aggregate'):
+            with ph_result.container():
+                st.write(preview_df)
+        if not calculo.done('pivot'):
+            with ph_pivots.container():
+                show_pivots(*preview_pivots, descargas=False)
+        with ph_categories.container():
+            show_categories(*categorize(preview_pivots))
+
+    result_df = wait_for(calculo, 'aggregate', estado, "Calculando los montos por etapa...").value
+    with ph_result.container():
+        show_result(result_df)
+
+    pivots = wait_for(calculo, 'pivot', estado, "Calculando las matrices...")
+    montos_pivot, porcentaje_pivot = pivots.value
+    with ph_pivots.container():
+        show_pivots(montos_pivot, porcentaje_pivot)
+
+    categorias = wait_for(calculo, 'categorize', estado, "Clasificando las etapas...")
+    final_table_pivot, category_counts_pivot = categorias.value
+    with ph_categories.container():
+        show_categories(final_table_pivot, category_counts_pivot)
+    aviso.empty()
+
+    hitos_df = wait_for(calculo, 'milestones', estado, "Calculando los hitos...").value
+    with ph_milestones.container():
+        show_milestones(hitos_df)
+
+    distribucion_df = wait_for(calculo, 'distribution', estado, "Calculando la distribución de los hitos...").value
+    with ph_distribution.container():
+        show_distribution(distribucion_df, por)
+    estado.empty()
+
+    # Comparación con el corte anterior: su lectura usa el mismo caché por contenido que el libro actual y sus etapas
+    # solo se recalculan si cambia alguno de los dos archivos, los países, la granularidad o la fecha de corte
+    if uploaded_anterior:
+        st.write('Cambios desde el Corte Anterior:')
+        anterior_id = getattr(uploaded_anterior, 'file_id', uploaded_anterior)
+        archivo_anterior = flow.source('archivo_anterior', uploaded_anterior, key=anterior_id)
+        with st.spinner("Comparando con el corte anterior..."):
+            try:
+                anterior = flow.stage('load_anterior', core.load_workbook, archivo_anterior)
+            except ValueError as e:
+                st.error(f"No se pudo leer el corte anterior: {e}")
+                return
+            # Los dos cortes se comparan a la misma fecha de corte
+            anterior = flow.stage('as_of_anterior', core.dataset_as_of, anterior, fecha_corte=fecha_corte)
+            result_anterior = flow.stage('aggregate_anterior', aggregate, anterior)
+            pivots_anterior = flow.stage('pivot_anterior', pivot, result_anterior, paises=selected_countries, periodo=periodo)
+            categorias_anterior = flow.stage('categorize_anterior', categorize, pivots_anterior)
+            try:
+                cambios = flow.stage('diff_desembolsos', disbursement_changes, anterior, calculo.result('as_of'))
+            except ValueError as e:
+                st.error(str(e))
+                return
+            cambios_categoria = flow.stage('diff_categorias', lambda a, d: category_changes(a[0], d[0]), categorias_anterior, categorias)
+            deltas = flow.stage('diff_matrices', delta_matrices, pivots_anterior, pivots)
+        show_comparison(cambios.value, cambios_categoria.value, deltas.value, selected_countries)
+
 
 if __name__ == "__main__":
-    run()
+    with metrics.page_run('matrices_desembolsos'):
+        run()
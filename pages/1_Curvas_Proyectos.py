@@ -1,108 +1,71 @@
 import streamlit as st
-import pandas as pd
-import altair as alt
-import numpy as np
-import threading
-import io
 from datetime import datetime
-from dateutil.relativedelta import relativedelta
+import metrics
+from envelope import filter_rows, percentile_bands, percentile_rank
+from bucketing import granularity_selector
+from joins import show_join_reports
+from project_index import build_dataset, load_project_index
+from search_index import search
+from sheets_refresher import get_refresher
+from utils import lazy_import, show_freshness, show_load_error
+
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
+alt = lazy_import('altair')
 
 # Configuración inicial
 LOGGER = st.logger.get_logger(__name__)
-_lock = threading.Lock()
 
-# URLs de las hojas de Google Sheets
-sheet_url_proyectos = "https://docs.google.com/spreadsheets/d/e/2PACX-1vSHedheaRLyqnjwtsRvlBFFOnzhfarkFMoJ04chQbKZCBRZXh_2REE3cmsRC69GwsUK0PoOVv95xptX/pub?gid=2084477941&single=true&output=csv"
-sheet_url_operaciones = "https://docs.google.com/spreadsheets/d/e/2PACX-1vSHedheaRLyqnjwtsRvlBFFOnzhfarkFMoJ04chQbKZCBRZXh_2REE3cmsRC69GwsUK0PoOVv95xptX/pub?gid=1468153763&single=true&output=csv"
-sheet_url_desembolsos = "https://docs.google.com/spreadsheets/d/e/2PACX-1vSHedheaRLyqnjwtsRvlBFFOnzhfarkFMoJ04chQbKZCBRZXh_2REE3cmsRC69GwsUK0PoOVv95xptX/pub?gid=1657640798&single=true&output=csv"
+# Espera máxima (segundos) por la primera descarga cuando todavía no hay ninguna copia
+PRIMERA_CARGA_TIMEOUT = 120
 
 # Inicializar la aplicación de Streamlit
 st.title("Análisis de Desembolsos por Proyecto")
 
-# Función para cargar los datos desde las hojas de Google Sheets
-def load_data(url):
-    with _lock:
-        return pd.read_csv(url)
-
-# Función para convertir el monto a un número flotante
-def convert_to_float(monto_str):
-    try:
-        monto_str = monto_str.replace('.', '').replace(',', '.')
-        return float(monto_str)
-    except ValueError:
-        return np.nan
-
-# Función para procesar los datos
-def process_data(df_proyectos, df_operaciones, df_operaciones_desembolsos):
-    # Preparar los DataFrames seleccionando las columnas requeridas
-    df_proyectos = df_proyectos[['NoProyecto', 'IDAreaPrioritaria', 'IDAreaIntervencion']]
-    df_operaciones = df_operaciones[['NoProyecto', 'NoOperacion', 'IDEtapa', 'Alias', 'Pais', 'FechaVigencia', 'Estado', 'AporteFONPLATAVigente']]
-    df_operaciones_desembolsos = df_operaciones_desembolsos[['IDDesembolso', 'NoOperacion', 'Monto', 'FechaEfectiva']]
-    
-    # Convertir 'Monto' a numérico
-    df_operaciones_desembolsos['Monto'] = df_operaciones_desembolsos['Monto'].apply(convert_to_float)
-    df_operaciones_desembolsos = df_operaciones_desembolsos.iloc[:, 1:].drop_duplicates()
-
-    # Fusionar DataFrames
-    merged_df = pd.merge(df_operaciones_desembolsos, df_operaciones, on='NoOperacion', how='left')
-    merged_df = pd.merge(merged_df, df_proyectos, on='NoProyecto', how='left')
-    
-    # Convertir fechas y calcular años
-    merged_df['FechaEfectiva'] = pd.to_datetime(merged_df['FechaEfectiva'], dayfirst=True, errors='coerce')
-    merged_df['FechaVigencia'] = pd.to_datetime(merged_df['FechaVigencia'], dayfirst=True, errors='coerce')
-    merged_df['Ano'] = ((merged_df['FechaEfectiva'] - merged_df['FechaVigencia']).dt.days / 365).fillna(-1)
-    merged_df['Ano_FechaEfectiva'] = pd.to_datetime(merged_df['FechaEfectiva']).dt.year
-    filtered_df = merged_df[merged_df['Ano'] >= 0]
-    filtered_df['Ano'] = filtered_df['Ano'].astype(int)
-    st.write(filtered_df)
-
-    # Crear diccionario para mapear IDEtapa a Alias
-    etapa_to_alias = df_operaciones.set_index('IDEtapa')['Alias'].to_dict()
-    filtered_df['IDEtapa'] = filtered_df['IDEtapa'].astype(str)
-    filtered_df['IDEtapa_Alias'] = filtered_df['IDEtapa'].map(lambda x: f"{x} ({etapa_to_alias.get(x, '')})")
-
-    # Selectbox para filtrar por IDEtapa
-    unique_etapas_alias = filtered_df['IDEtapa_Alias'].unique()
-    selected_etapa_alias = st.selectbox('Select IDEtapa to filter', unique_etapas_alias)
-    selected_etapa = selected_etapa_alias.split(' ')[0]
-    filtered_result_df = filtered_df[filtered_df['IDEtapa'] == selected_etapa]
-
-    # Realizar cálculos
-    result_df = filtered_result_df.groupby(['IDEtapa', 'Ano'])['Monto'].sum().reset_index()
-    result_df['Monto Acumulado'] = result_df.groupby(['IDEtapa'])['Monto'].cumsum().reset_index(drop=True)
-    result_df['Porcentaje del Monto'] = result_df.groupby(['IDEtapa'])['Monto'].apply(lambda x: x / x.sum() * 100).reset_index(drop=True)
-    result_df['Porcentaje Acumulado'] = result_df.groupby(['IDEtapa'])['Monto Acumulado'].apply(lambda x: x / x.max() * 100).reset_index(drop=True)
-
-    # Convertir 'Monto' y 'Monto Acumulado' a millones y redondear a 2 decimales
-    result_df['Monto'] = (result_df['Monto'] / 1000000).round(2)
-    result_df['Monto Acumulado'] = (result_df['Monto Acumulado'] / 1000000).round(2)
-    
-    # Realizar cálculos para result_df_ano_efectiva
-    result_df_ano_efectiva = filtered_result_df.groupby(['IDEtapa', 'Ano_FechaEfectiva'])['Monto'].sum().reset_index()
-    result_df_ano_efectiva['Monto Acumulado'] = result_df_ano_efectiva.groupby(['IDEtapa'])['Monto'].cumsum().reset_index(drop=True)
-    result_df_ano_efectiva['Porcentaje del Monto'] = result_df_ano_efectiva.groupby(['IDEtapa'])['Monto'].apply(lambda x: x / x.sum() * 100).reset_index(drop=True)
-    result_df_ano_efectiva['Porcentaje Acumulado'] = result_df_ano_efectiva.groupby(['IDEtapa'])['Monto Acumulado'].apply(lambda x: x / x.max() * 100).reset_index(drop=True)
-
-    # Convertir 'Monto' y 'Monto Acumulado' a millones y redondear a 2 decimales para ambas tablas
-    result_df['Monto'] = (result_df['Monto']).round(2)
-    result_df['Monto Acumulado'] = (result_df['Monto Acumulado']).round(2)
-    result_df_ano_efectiva['Monto'] = (result_df_ano_efectiva['Monto'] / 1000000).round(2)
-    result_df_ano_efectiva['Monto Acumulado'] = (result_df_ano_efectiva['Monto Acumulado'] / 1000000).round(2)
-
-    return result_df, result_df_ano_efectiva
-
-# Función para convertir DataFrame a Excel
-def dataframe_to_excel_bytes(df):
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Resultados', index=False)
-    output.seek(0)
-    return output
-
-# Función para crear una gráfica de líneas con etiquetas
-def line_chart_with_labels(data, x_col, y_col, title, color):
+# Bandas P10/P50/P90 por periodo para un filtro de país, sector y cohorte de vigencia (se guardan en caché por filtro)
+@st.cache_data(max_entries=256, show_spinner=False)
+def envelope_bands(_index, version, periodo, pais, sector, cohorte):
+    return percentile_bands(_index.matriz, filter_rows(_index.etapas_df, pais, sector, cohorte), period_col=periodo)
+
+# Función para seleccionar un proyecto: solo búsquedas en el índice, sin recalcular sobre el dataset completo
+def select_project(index, version, periodo):
+    if st.checkbox('Mostrar datos combinados'):
+        st.write(index.data)
+
+    # Buscador de IDEtapa: el índice vive en el servidor y al selector solo llegan los mejores resultados de la búsqueda
+    consulta = st.text_input('Buscar proyecto', placeholder='IDEtapa, alias, número de proyecto, país o sector')
+    etapas = search(index.buscador, consulta)
+    if not etapas:
+        st.warning(f"Ningún proyecto coincide con '{consulta}'.")
+        return None
+    selected_etapa = st.selectbox('Select IDEtapa to filter', etapas, format_func=index.buscador.etiquetas.get)
+    curvas = index.curves[selected_etapa]
+
+    # Filtros de la cartera con la que se compara el proyecto
+    etapas_df = index.etapas_df
+    col_pais, col_sector, col_cohorte = st.columns(3)
+    pais = col_pais.selectbox('Comparar con País', ['Todos'] + sorted(etapas_df['Pais'].dropna().unique().tolist()))
+    sector = col_sector.selectbox('Comparar con Sector', ['Todos'] + sorted(etapas_df['Sector'].dropna().unique().tolist()))
+    cohorte = col_cohorte.selectbox('Comparar con Cohorte de Vigencia', ['Todos'] + sorted(etapas_df['Cohorte'].dropna().astype(int).unique().tolist()))
+    bandas_df = envelope_bands(index, version, periodo, pais, sector, cohorte)
+
+    # Curva del proyecto en porcentaje del aporte y su percentil frente a la cartera
+    fila = index.fila_by_etapa.get(selected_etapa)
+    if fila is not None:
+        curva = index.matriz[fila]
+        rango = percentile_rank(index.matriz, filter_rows(etapas_df, pais, sector, cohorte), fila)
+        bandas_df = bandas_df.merge(pd.DataFrame({
+            periodo: np.arange(len(curva)),
+            'Proyecto': curva,
+            'Percentil del Proyecto': rango,
+        }), on=periodo, how='left')
+
+    return curvas.por_periodo, curvas.por_ano_efectiva, curvas.proyeccion, curvas.parametros, bandas_df
+
+# Función para crear una gráfica de líneas con etiquetas (con proyección opcional en línea punteada)
+def line_chart_with_labels(data, x_col, y_col, title, color, projection=None, x_title='Año'):
     chart = alt.Chart(data).mark_line(point=True, color=color).encode(
-        x=alt.X(f'{x_col}:O', axis=alt.Axis(title='Año', labelAngle=0)),
+        x=alt.X(f'{x_col}:O', axis=alt.Axis(title=x_title, labelAngle=0)),
         y=alt.Y(f'{y_col}:Q', axis=alt.Axis(title=y_col)),
         tooltip=[x_col, y_col]
     ).properties(
@@ -118,15 +81,59 @@ def line_chart_with_labels(data, x_col, y_col, title, color):
     ).encode(
         text=alt.Text(f'{y_col}:Q', format='.2f')
     )
+    if projection is not None and not projection.empty:
+        # La línea punteada parte del último punto observado
+        projection = pd.concat([data[[x_col, y_col]].tail(1), projection[[x_col, y_col]]], ignore_index=True)
+        dashed = alt.Chart(projection).mark_line(point=True, color=color, strokeDash=[6, 4], opacity=0.7).encode(
+            x=alt.X(f'{x_col}:O'),
+            y=alt.Y(f'{y_col}:Q'),
+            tooltip=[x_col, y_col]
+        )
+        return chart + text + dashed
     return chart + text
 
+# Función para crear la gráfica de la banda P10-P90 de la cartera detrás de la curva del proyecto
+def envelope_chart(bandas_df, x_col, title, x_title='Año'):
+    base = alt.Chart(bandas_df).encode(x=alt.X(f'{x_col}:O', axis=alt.Axis(title=x_title, labelAngle=0)))
+    banda = base.mark_area(color='lightgray', opacity=0.6).encode(
+        y=alt.Y('P10:Q', axis=alt.Axis(title='Porcentaje Acumulado del Aporte')),
+        y2='P90:Q',
+        tooltip=[x_col, 'P10', 'P50', 'P90', 'Proyectos']
+    )
+    mediana = base.mark_line(color='gray', strokeDash=[4, 4]).encode(y='P50:Q')
+    capas = banda + mediana
+    if 'Proyecto' in bandas_df.columns:
+        proyecto = base.transform_filter('isValid(datum.Proyecto)').mark_line(point=True, color='salmon').encode(
+            y='Proyecto:Q',
+            tooltip=[x_col, alt.Tooltip('Proyecto:Q', format='.2f'), alt.Tooltip('Percentil del Proyecto:Q', format='.0f')]
+        )
+        capas = capas + proyecto
+    return capas.properties(title=title, width=600, height=400)
+
 #Funcion
 def run():
-    # Cargar y procesar los datos
-    df_proyectos = load_data(sheet_url_proyectos)
-    df_operaciones = load_data(sheet_url_operaciones)
-    df_operaciones_desembolsos = load_data(sheet_url_desembolsos)
-    result_df, result_df_ano_efectiva = process_data(df_proyectos, df_operaciones, df_operaciones_desembolsos)
+    granularidad, periodo = granularity_selector()
+
+    # Tomar la última copia válida de los datos (nunca se espera a Google Sheets salvo en la primera carga)
+    refresher = get_refresher()
+    refresher.register('curvas_proyectos', build_dataset)
+    snapshot = refresher.snapshot(timeout=PRIMERA_CARGA_TIMEOUT)
+    if snapshot is None or snapshot.datasets.get('curvas_proyectos') is None:
+        show_load_error(refresher, 'curvas_proyectos')
+        return
+    show_freshness(snapshot)
+    data, reports = snapshot.datasets['curvas_proyectos']
+    show_join_reports(reports)
+
+    # Cargar el índice por proyecto y seleccionar el proyecto
+    metrics.dataset_size(len(data))
+    with metrics.stage('index'):
+        index = load_project_index(data, snapshot.version, periodo)
+    with metrics.stage('select'):
+        seleccion = select_project(index, snapshot.version, periodo)
+    if seleccion is None:
+        return
+    result_df, result_df_ano_efectiva, proyeccion_df, parametros, bandas_df = seleccion
 
     # Define los colores para cada gráfico
     color_monto = 'steelblue'
@@ -134,16 +141,30 @@ def run():
     color_porcentaje = 'salmon'
 
     # Crear y mostrar gráficos para result_df
-    chart_monto = line_chart_with_labels(result_df, 'Ano', 'Monto', 'Monto por Año en Millones', color_monto)
-    chart_monto_acumulado = line_chart_with_labels(result_df, 'Ano', 'Monto Acumulado', 'Monto Acumulado por Año en Millones', color_acumulado)
-    chart_porcentaje_acumulado = line_chart_with_labels(result_df, 'Ano', 'Porcentaje Acumulado', 'Porcentaje Acumulado del Monto por Año', color_porcentaje)
+    chart_monto = line_chart_with_labels(result_df, periodo, 'Monto', f'Monto por Periodo ({granularidad}) en Millones', color_monto, projection=proyeccion_df, x_title=granularidad)
+    chart_monto_acumulado = line_chart_with_labels(result_df, periodo, 'Monto Acumulado', f'Monto Acumulado por Periodo ({granularidad}) en Millones', color_acumulado, projection=proyeccion_df, x_title=granularidad)
+    chart_porcentaje_acumulado = line_chart_with_labels(result_df, periodo, 'Porcentaje Acumulado', f'Porcentaje Acumulado del Monto por Periodo ({granularidad})', color_porcentaje, x_title=granularidad)
 
     st.altair_chart(chart_monto, use_container_width=True)
     st.altair_chart(chart_monto_acumulado, use_container_width=True)
     st.altair_chart(chart_porcentaje_acumulado, use_container_width=True)
+
+    # Banda de percentiles de la cartera detrás de la curva del proyecto
+    if not bandas_df.empty:
+        st.altair_chart(envelope_chart(bandas_df, periodo, 'Porcentaje Acumulado del Aporte frente a la Cartera (P10-P90)', x_title=granularidad), width='stretch')
     
-    # Mostrar la tabla "Tabla por Año"
-    st.write("Tabla por Año:", result_df)
+    # Mostrar la tabla "Tabla por Periodo"
+    st.write(f"Tabla por Periodo ({granularidad}):", result_df)
+
+    # Mostrar la proyección de los desembolsos restantes
+    if parametros is not None:
+        fin_proyectado = int(parametros['Fin Proyectado'])
+        ano_fin = int(parametros['Año Fin Proyectado'])
+        porcentaje_actual = parametros['Porcentaje Actual']
+        st.write(f"Porcentaje desembolsado del aporte: {porcentaje_actual:,.2f}% — Año de finalización proyectado: "
+                 f"{ano_fin if ano_fin >= 0 else 'sin fecha de vigencia'} (periodo {fin_proyectado} en {granularidad.lower()} desde la vigencia)")
+    if not proyeccion_df.empty:
+        st.write("Proyección de Desembolsos Restantes (Millones):", proyeccion_df[[periodo, 'Monto', 'Monto Acumulado', 'Porcentaje Acumulado Proyectado']])
   
     # Crear y mostrar gráficos para result_df_ano_efectiva
     chart_monto_efectiva = line_chart_with_labels(result_df_ano_efectiva, 'Ano_FechaEfectiva', 'Monto', 'Monto por Año de Fecha Efectiva en Millones', color_monto)
@@ -158,4 +179,5 @@ def run():
     st.write("Tabla por Año de Fecha Efectiva:", result_df_ano_efectiva)
 
 if __name__ == "__main__":
-    run()
+    with metrics.page_run('curvas_proyectos'):
+        run()
@@ -1,55 +1,47 @@
 import streamlit as st
-import pandas as pd
 from streamlit.logger import get_logger
-import altair as alt
-import threading
-import io
+from bucketing import granularity_selector
+import core
+import metrics
+from joins import show_join_reports
+import streaming
+import warehouse
+from utils import excel_download, lazy_import
+
+alt = lazy_import('altair')
 
 LOGGER = get_logger(__name__)
-_lock = threading.Lock()
 
 def process_dataframe(xls_path):
-    with _lock:
-        xls = pd.ExcelFile(xls_path, engine='openpyxl')
-        proyectos = xls.parse('Proyectos')
-        operaciones = xls.parse('Operaciones')
-        operaciones_desembolsos = xls.parse('OperacionesDesembolsos')
-
-    # Fusionar los datos
-    merged_op_desembolsos = pd.merge(operaciones, operaciones_desembolsos, on=['NoOperacion', 'NoEtapa'], how='left')
-    merged_all = pd.merge(merged_op_desembolsos, proyectos, on='NoProyecto', how='left')
-
-    # Convertir fechas a datetime y calcular la diferencia en años
-    merged_all['FechaEfectiva'] = pd.to_datetime(merged_all['FechaEfectiva'], dayfirst=True)
-    merged_all['FechaVigencia'] = pd.to_datetime(merged_all['FechaVigencia'], dayfirst=True)
-    merged_all.dropna(subset=['FechaEfectiva', 'FechaVigencia'], inplace=True)
-    merged_all['Ano'] = ((merged_all['FechaEfectiva'] - merged_all['FechaVigencia']).dt.days / 366).astype(int)
-
-    # Realizar cálculos utilizando 'AporteFONPLATA'
-    result_df = merged_all.groupby(['NoProyecto', 'Ano', 'IDEtapa'])['Monto'].sum().reset_index()
-    result_df['Monto Acumulado'] = result_df.groupby(['NoProyecto'])['Monto'].cumsum().reset_index(drop=True)
-
-    # Verificar si 'AporteFONPLATA' está en 'operaciones'
-    if 'AporteFONPLATAVigente' in operaciones.columns:
-        result_df = pd.merge(result_df, operaciones[['NoProyecto', 'AporteFONPLATAVigente']], on='NoProyecto', how='left')
-        result_df['Porcentaje del Monto'] = result_df['Monto'] / result_df['AporteFONPLATAVigente'] * 100
-        result_df['Porcentaje del Monto Acumulado'] = result_df['Monto Acumulado'] / result_df['AporteFONPLATAVigente'] * 100
-    else:
-        st.error("La columna 'AporteFONPLATA' no se encontró en la hoja 'Operaciones'.")
+    # Los libros grandes se agregan por bloques sin cargar la hoja de desembolsos entera (mismo resultado)
+    if streaming.is_large(xls_path):
+        totales, etapas, reports = streaming.load_workbook_totals(xls_path, core.PROJECT_PERIOD_KEYS)
+        return core.project_period_totals(totales.copy(), etapas), reports
+    dataset = core.load_workbook(xls_path)
+    return process_dataset(dataset.desembolsos, dataset.etapas), dataset.reports
 
-    # Añadir 'IDAreaPrioritaria' (Sector) y 'IDAreaIntervencion' (Subsector) al DataFrame resultante
-    result_df = pd.merge(result_df, proyectos[['NoProyecto', 'IDAreaPrioritaria', 'IDAreaIntervencion','Pais', 'Alias']], on='NoProyecto', how='left')
+# Mismo cálculo sobre el esquema canónico (del archivo subido, en cualquiera de los dos formatos, o del almacén local)
+def process_dataset(desembolsos, etapas):
+    # Montos por proyecto y periodo, con porcentajes sobre el aporte del proyecto
+    return core.project_period_table(desembolsos, etapas)
 
-    return result_df
 
 
+@st.cache_data(max_entries=4, show_spinner=False)
+def warehouse_countries(version):
+    with warehouse.connection() as conn:
+        return warehouse.countries(conn)
+
+# Hojas filtradas por país en SQLite (índices de Pais, NoProyecto y NoOperacion/NoEtapa), con los desembolsos ya
+# sumados por etapa y fecha, y el cálculo de la página
+@st.cache_data(max_entries=16, show_spinner=False)
+def country_from_warehouse(version, pais):
+    with warehouse.connection() as conn:
+        hojas = warehouse.query_frames(conn, pais=pais, agregar=True)
+    reports = []
+    desembolsos, etapas = core.normalize(hojas, core.LAYOUT_OPERACIONES, reports)
+    return process_dataset(desembolsos, etapas), reports
 
-def dataframe_to_excel_bytes(df):
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Resultados', index=False)
-    output.seek(0)
-    return output
 
 def run():
     st.set_page_config(
@@ -61,15 +53,17 @@ def run():
     st.write("Carga tu archivo Excel y explora las métricas relacionadas con los desembolsos por país.")
 
     uploaded_file = st.file_uploader("Carga tu Excel aquí", type="xlsx")
+    granularidad, periodo = granularity_selector()
 
     if uploaded_file:
-        result_df = process_dataframe(uploaded_file)
+        with metrics.stage('process'):
+            result_df, reports = process_dataframe(uploaded_file)
+        metrics.dataset_size(len(result_df))
+        show_join_reports(reports)
         st.write(result_df)
-
-        excel_bytes = dataframe_to_excel_bytes(result_df)
         st.download_button(
             label="Descargar DataFrame en Excel",
-            data=excel_bytes,
+            data=excel_download(result_df),
             file_name="resultados_desembolsos.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
         )
@@ -78,57 +72,70 @@ def run():
         selected_country = st.selectbox('Selecciona el País:', sorted_countries)
 
         filtered_df = result_df[result_df['Pais'] == selected_country]
+    elif warehouse.WAREHOUSE_PATH:
+        # Sin archivo: se consulta el almacén local solo por el país elegido
+        st.caption("Datos del almacén local de Operaciones y Desembolsos.")
+        paises = warehouse_countries(warehouse.version())
+        if not paises:
+            st.warning("El almacén local no tiene proyectos con país.")
+            return
+        selected_country = st.selectbox('Selecciona el País:', paises)
+        with metrics.stage('warehouse'):
+            filtered_df, reports = country_from_warehouse(warehouse.version(), selected_country)
+        metrics.dataset_size(len(filtered_df))
+        show_join_reports(reports)
+    else:
+        return
 
-        df_monto = filtered_df.groupby('Ano')['Monto'].sum().reset_index()
-        df_monto['Monto'] /= 1e6
-        df_monto['Monto Acumulado'] = df_monto['Monto'].cumsum()
-        df_monto['Porcentaje del Monto'] = ((df_monto['Monto'] / df_monto['Monto'].sum()) * 100).round(2)
-        df_monto['Porcentaje Acumulado del Monto'] = (df_monto['Monto Acumulado'] / df_monto['Monto'].sum() * 100).round(2)
+    show_country_summary(filtered_df, granularidad, periodo)
 
-        st.write("Resumen de Datos:")
-        st.write(df_monto)
 
-        excel_bytes = dataframe_to_excel_bytes(df_monto)
-        st.download_button(
-            label="Descargar DataFrame en Excel",
-            data=excel_bytes,
-            file_name="Paises_desembolsos.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+def show_country_summary(filtered_df, granularidad, periodo):
+    df_monto = core.period_summary(filtered_df, periodo)
+
+    st.write("Resumen de Datos:")
+    st.write(df_monto)
+    st.download_button(
+        label="Descargar DataFrame en Excel",
+        data=excel_download(df_monto),
+        file_name="Paises_desembolsos.xlsx",
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    )
+
+    # Definir colores para los gráficos
+    color_monto = 'steelblue'
+    color_acumulado = 'goldenrod'
+    color_porcentaje = 'salmon'
+
+    def line_chart_with_labels(data, x_col, y_col, title, color):
+        chart = alt.Chart(data).mark_line(point=True, color=color).encode(
+            x=alt.X(f'{x_col}:O', axis=alt.Axis(title=granularidad, labelAngle=0)),
+            y=alt.Y(f'{y_col}:Q', axis=alt.Axis(title=y_col)),
+            tooltip=[x_col, y_col]
+        ).properties(
+            title=title,
+            width=600,
+            height=400
         )
 
-        # Definir colores para los gráficos
-        color_monto = 'steelblue'
-        color_acumulado = 'goldenrod'
-        color_porcentaje = 'salmon'
-
-        def line_chart_with_labels(data, x_col, y_col, title, color):
-            chart = alt.Chart(data).mark_line(point=True, color=color).encode(
-                x=alt.X(f'{x_col}:O', axis=alt.Axis(title='Año', labelAngle=0)),
-                y=alt.Y(f'{y_col}:Q', axis=alt.Axis(title=y_col)),
-                tooltip=[x_col, y_col]
-            ).properties(
-                title=title,
-                width=600,
-                height=400
-            )
-
-            text = chart.mark_text(
-                align='left',
-                baseline='middle',
-                dx=18,
-                dy=-18
-            ).encode(
-                text=alt.Text(f'{y_col}:Q', format='.2f')
-            )
-            return chart + text
-
-        chart_monto = line_chart_with_labels(df_monto, 'Ano', 'Monto', 'Monto por Año en Millones', color_monto)
-        chart_monto_acumulado = line_chart_with_labels(df_monto, 'Ano', 'Monto Acumulado', 'Monto Acumulado por Año en Millones', color_acumulado)
-        chart_porcentaje_acumulado = line_chart_with_labels(df_monto, 'Ano', 'Porcentaje Acumulado del Monto', 'Porcentaje Acumulado del Monto por Año', color_porcentaje)
-
-        st.altair_chart(chart_monto, use_container_width=True)
-        st.altair_chart(chart_monto_acumulado, use_container_width=True)
-        st.altair_chart(chart_porcentaje_acumulado, use_container_width=True)
+        text = chart.mark_text(
+            align='left',
+            baseline='middle',
+            dx=18,
+            dy=-18
+        ).encode(
+            text=alt.Text(f'{y_col}:Q', format='.2f')
+        )
+        return chart + text
+
+    chart_monto = line_chart_with_labels(df_monto, periodo, 'Monto', f'Monto por Periodo ({granularidad}) en Millones', color_monto)
+    chart_monto_acumulado = line_chart_with_labels(df_monto, periodo, 'Monto Acumulado', f'Monto Acumulado por Periodo ({granularidad}) en Millones', color_acumulado)
+    chart_porcentaje_acumulado = line_chart_with_labels(df_monto, periodo, 'Porcentaje Acumulado del Monto', f'Porcentaje Acumulado del Monto por Periodo ({granularidad})', color_porcentaje)
+
+    st.altair_chart(chart_monto, use_container_width=True)
+    st.altair_chart(chart_monto_acumulado, use_container_width=True)
+    st.altair_chart(chart_porcentaje_acumulado, use_container_width=True)
 
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    with metrics.page_run('curva_paises'):
+        run()
\ No newline at end of file
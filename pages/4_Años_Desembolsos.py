@@ -1,36 +1,32 @@
 import streamlit as st
-import pandas as pd
-import io
 from datetime import datetime
 from streamlit.logger import get_logger
-import threading
+import core
+import metrics
+from dataflow import session_flow
+from joins import show_join_reports
+import warehouse
+from utils import lazy_import
 
-LOGGER = get_logger(__name__)
-_lock = threading.Lock()
-
-def dataframe_to_excel_bytes(df):
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False)
-    output.seek(0)
-    return output.getvalue()
+pd = lazy_import('pandas')
 
-def merge_data(xls):
-    proyectos = xls.parse('Proyectos')
-    operaciones = xls.parse('Operaciones')
-    operaciones_desembolsos = xls.parse('OperacionesDesembolsos')
+LOGGER = get_logger(__name__)
 
-    # Fusionar 'OperacionesDesembolsos' con 'Operaciones' usando 'NoEtapa'
-    merged_op_desembolsos = pd.merge(operaciones_desembolsos, operaciones, on='NoOperacion', how='left')
+# Desembolsos del esquema canónico ordenados por 'FechaEfectiva' para cortar un mes con búsqueda binaria
+def normalize_data(desembolsos):
+    return desembolsos.sort_values('FechaEfectiva', kind='stable', na_position='last').reset_index(drop=True)
 
-    # Fusionar el resultado con 'Proyectos' usando 'NoOperacion'
-    merged_data = pd.merge(merged_op_desembolsos, proyectos, on='NoProyecto', how='left')
+# Etapa 'normalize'
+def normalize_dataset(dataset):
+    return normalize_data(dataset.desembolsos)
 
-    return merged_data
+# Etapa 'slice': desembolsos de un mes
+def slice_month(data, selected_year, selected_month):
+    inicio = pd.Timestamp(year=selected_year, month=selected_month, day=1)
+    desde, hasta = data['FechaEfectiva'].searchsorted([inicio, inicio + pd.DateOffset(months=1)])
+    return data.iloc[desde:hasta]
 
-def process_data(merge_data, selected_year, selected_month):
-    filtered_data = merge_data[(merge_data['FechaEfectiva'].dt.year == selected_year) & 
-                         (merge_data['FechaEfectiva'].dt.month == selected_month)]
+def process_data(filtered_data):
     total_monto = filtered_data['Monto'].sum()
     st.write(f"Monto Total: {total_monto:,.2f}")
     columns_to_display = ['IDOperacion', 'Pais', 'FechaEfectiva', 'Monto', 'IDAreaPrioritaria', 'IDAreaIntervencion']
@@ -39,35 +35,85 @@ def process_data(merge_data, selected_year, selected_month):
     else:
         st.write("One or more columns are missing in the DataFrame.")
 
+# Desembolsos de un mes consultados en el almacén local (rango sobre el índice de 'FechaEfectiva')
+@st.cache_data(max_entries=4, show_spinner=False)
+def warehouse_years(version):
+    with warehouse.connection() as conn:
+        return warehouse.year_range(conn)
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def month_from_warehouse(version, selected_year, selected_month):
+    inicio = pd.Timestamp(year=selected_year, month=selected_month, day=1)
+    fin = inicio + pd.DateOffset(months=1)
+    with warehouse.connection() as conn:
+        hojas = warehouse.query_frames(conn, desde=inicio.strftime('%Y-%m-%d'), hasta=fin.strftime('%Y-%m-%d'))
+    reports = []
+    desembolsos, _ = core.normalize(hojas, core.LAYOUT_OPERACIONES, reports)
+    return normalize_data(desembolsos), reports
+
+# Año a mostrar; con un solo año no hay rango para el slider
+def year_selector(min_year, max_year):
+    if min_year == max_year:
+        st.caption(f"Año: {max_year}")
+        return max_year
+    return st.slider("Selecciona el Año", min_year, max_year, max_year)
+
+def show_month(preview_data):
+    columns_to_display = ['IDOperacion', 'Pais', 'FechaEfectiva', 'Monto', 'IDAreaPrioritaria', 'IDAreaIntervencion']
+    if all(col in preview_data.columns for col in columns_to_display):
+        st.dataframe(preview_data[columns_to_display])
+    else:
+        st.write("One or more columns are missing in the DataFrame.")
+
+    if st.button('Calcular'):
+        process_data(preview_data)
+
 def main():
     st.set_page_config(page_title="Análisis de Datos Mensual", page_icon="📊")
     st.title('Análisis de Datos Mensual')
 
     uploaded_file = st.file_uploader("Elige un archivo Excel", type=["xlsx"])
     if uploaded_file is not None:
-        xls = pd.ExcelFile(uploaded_file)
-        data = merge_data(xls)
-        data['FechaEfectiva'] = pd.to_datetime(data['FechaEfectiva'])
-
+        # Los sliders solo vuelven a ejecutar la etapa 'slice'
+        flow = session_flow('anos_desembolsos')
+        archivo = flow.source('archivo', uploaded_file, key=getattr(uploaded_file, 'file_id', uploaded_file))
+        dataset = flow.stage('load', core.load_workbook, archivo)
+        show_join_reports(dataset.value.reports)
+        metrics.dataset_size(len(dataset.value.desembolsos))
+        normalized = flow.stage('normalize', normalize_dataset, dataset)
+        data = normalized.value
+
+        if data['FechaEfectiva'].isna().all():
+            st.warning("El libro no tiene desembolsos con fecha efectiva.")
+            return
         min_year = int(data['FechaEfectiva'].dt.year.min())
         max_year = int(data['FechaEfectiva'].dt.year.max())
 
-        selected_year = st.slider("Selecciona el Año", min_year, max_year, max_year)
+        selected_year = year_selector(min_year, max_year)
         selected_month = st.slider("Selecciona el Mes", 1, 12, 1)
 
-        preview_data = data[(data['FechaEfectiva'].dt.year == selected_year) & 
-                            (data['FechaEfectiva'].dt.month == selected_month)]
-        columns_to_display = ['IDOperacion', 'Pais', 'FechaEfectiva', 'Monto', 'IDAreaPrioritaria', 'IDAreaIntervencion']
-        if all(col in preview_data.columns for col in columns_to_display):
-            st.dataframe(preview_data[columns_to_display])
-        else:
-            st.write("One or more columns are missing in the DataFrame.")
+        preview_data = flow.stage('slice', slice_month, normalized, selected_year=selected_year, selected_month=selected_month).value
+        show_month(preview_data)
+    elif warehouse.WAREHOUSE_PATH:
+        # Sin archivo: cada mes es una consulta por rango de fechas en el almacén local
+        st.caption("Datos del almacén local de Operaciones y Desembolsos.")
+        anos = warehouse_years(warehouse.version())
+        if anos is None:
+            st.warning("El almacén local no tiene desembolsos con fecha efectiva.")
+            return
+        min_year, max_year = anos
+
+        selected_year = year_selector(min_year, max_year)
+        selected_month = st.slider("Selecciona el Mes", 1, 12, 1)
 
-        if st.button('Calcular'):
-            process_data(data, selected_year, selected_month)
+        with metrics.stage('warehouse'):
+            preview_data, reports = month_from_warehouse(warehouse.version(), selected_year, selected_month)
+        show_join_reports(reports)
+        show_month(preview_data)
 
 if __name__ == "__main__":
-    main()
+    with metrics.page_run('anos_desembolsos'):
+        main()
 
 
 
@@ -1,70 +1,27 @@
 import streamlit as st
-import pandas as pd
-import numpy as np
-from datetime import datetime
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
-
-# Función para calcular los puntajes RFM
-def calculate_rfm_scores(data):
-    recency = data.groupby('IDEtapa')['FechaEfectiva'].max().reset_index()
-    recency['Recency'] = (datetime.now() - recency['FechaEfectiva']).dt.days
-    frequency = data.groupby('IDEtapa').size().reset_index(name='Frequency')
-    monetary = data.groupby('IDEtapa')['Monto'].sum().reset_index()
-    monetary.rename(columns={'Monto': 'Monetary'}, inplace=True)
-    rfm = recency.merge(frequency, on='IDEtapa').merge(monetary, on='IDEtapa')
-    return rfm
-
-# Función para asignar puntajes R, F, M
-def assign_rfm_scores(rfm):
-    quantiles = rfm[['Recency', 'Frequency', 'Monetary']].quantile(q=[0.25, 0.5, 0.75]).to_dict()
-    rfm['R_Score'] = rfm['Recency'].apply(lambda x: 1 if x <= quantiles['Recency'][0.25] else 2 if x <= quantiles['Recency'][0.5] else 3 if x <= quantiles['Recency'][0.75] else 4)
-    rfm['F_Score'] = rfm['Frequency'].apply(lambda x: 4 if x <= quantiles['Frequency'][0.25] else 3 if x <= quantiles['Frequency'][0.5] else 2 if x <= quantiles['Frequency'][0.75] else 1)
-    rfm['M_Score'] = rfm['Monetary'].apply(lambda x: 4 if x <= quantiles['Monetary'][0.25] else 3 if x <= quantiles['Monetary'][0.5] else 2 if x <= quantiles['Monetary'][0.75] else 1)
-    return rfm
-
-# Función para asignar segmentos
-def assign_segment(row):
-    if row['R_Score'] <= 2 and row['F_Score'] <= 2:
-        return 'Champions'
-    elif row['F_Score'] <= 2:
-        return 'Loyal Customers'
-    elif row['R_Score'] <= 2 and row['F_Score'] > 2 and row['M_Score'] > 2:
-        return 'Potential Loyalist'
-    elif row['R_Score'] <= 2:
-        return 'New Customers'
-    elif row['R_Score'] >= 3 and row['F_Score'] <= 2 and row['M_Score'] <= 2:
-        return 'At Risk'
-    elif row['R_Score'] == 4 and row['F_Score'] <= 2 and row['M_Score'] <= 2:
-        return 'Can’t Lose Them'
-    else:
-        return 'Hibernating'
-    
-def calculate_segment_statistics(rfm):
-    segment_stats = rfm.groupby('Segment').agg(
-        Recency_mean=('Recency', 'mean'),
-        Frequency_mean=('Frequency', 'mean'),
-        Monetary_mean=('Monetary', 'mean'),
-        Count=('IDEtapa', 'count')
-    ).reset_index()
-
-    # Aplicar redondeo después del cálculo
-    segment_stats['Recency_mean'] = segment_stats['Recency_mean'].round(0)
-    segment_stats['Frequency_mean'] = segment_stats['Frequency_mean'].round(0)
-    segment_stats['Monetary_mean'] = (segment_stats['Monetary_mean']/1000000).round(3)
-
-    return segment_stats
+import core
+import metrics
+from rfm import K_GRUPOS, build_dataset, calculate_segment_statistics, load_clusters, load_rfm_table
+from sheets_refresher import get_refresher
+from stalled import MESES_SIN_DESEMBOLSO, PUNTOS_BRECHA, VECES_INTERVALO, load_stalled_alerts
+from utils import lazy_import, show_freshness, show_load_error
 
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
 
 # Función para crear el gráfico 3D
 def plot_3d(rfm, sector_data):
+    # matplotlib solo se carga cuando se marca un gráfico 3D
+    import matplotlib.pyplot as plt
+    from mpl_toolkits.mplot3d import Axes3D  # noqa: F401
+
     fig = plt.figure(figsize=(10, 8))
     ax = fig.add_subplot(111, projection='3d')
-    sectors = sector_data['SECTOR'].unique()
+    sectors = sector_data[core.SECTOR].unique()
     colors = plt.cm.tab10(np.linspace(0, 1, len(sectors)))
     sector_to_color = dict(zip(sectors, colors))
     for sector in sectors:
-        sector_rfm = rfm[rfm['SECTOR'] == sector]
+        sector_rfm = rfm[rfm[core.SECTOR] == sector]
         ax.scatter(sector_rfm['Recency'], sector_rfm['Frequency'], sector_rfm['Monetary'], color=sector_to_color[sector], label=sector)
     ax.set_xlabel('Recency')
     ax.set_ylabel('Frequency')
@@ -76,6 +33,9 @@ def plot_3d(rfm, sector_data):
 
 # Función para crear el gráfico 3D por país
 def plot_3d_by_country(rfm):
+    import matplotlib.pyplot as plt
+    from mpl_toolkits.mplot3d import Axes3D  # noqa: F401
+
     fig = plt.figure(figsize=(10, 8))
     ax = fig.add_subplot(111, projection='3d')
     countries = rfm['Country'].unique()
@@ -98,51 +58,92 @@ def main():
     uploaded_file = st.file_uploader("Sube tu archivo Excel", type="xlsx")
 
     if uploaded_file is not None:
-        data = pd.read_excel(uploaded_file, sheet_name='Desembolsos')
-        operaciones = pd.read_excel(uploaded_file, sheet_name='Operaciones')[['IDEtapa', 'SECTOR', 'AporteFonplata']]
-
-        rfm = calculate_rfm_scores(data)
-        rfm = assign_rfm_scores(rfm)
-        rfm['Segment'] = rfm.apply(assign_segment, axis=1)
-        rfm = rfm.merge(operaciones, on='IDEtapa', how='left')
-        rfm['Desembolsado'] = (rfm['Monetary'] / rfm['AporteFonplata']) * 100
-        rfm['Estado'] = np.where(rfm['Desembolsado'] == 100, 'Terminado', 'Vigente')
-        rfm['Country'] = rfm['IDEtapa'].str[:2]
-
-        # Selectbox para filtrar por Estado
-        estado_filter = st.selectbox('Filtrar por Estado', ['Todos', 'Terminado', 'Vigente'])
-        if estado_filter != 'Todos':
-            rfm = rfm[rfm['Estado'] == estado_filter]
-
-        # Selector de sector para el gráfico 3D
-        sectors = ['Todos'] + list(operaciones['SECTOR'].unique())
-        selected_sector = st.selectbox('Selecciona un sector para el gráfico 3D', sectors)
-        if selected_sector != 'Todos':
-            rfm = rfm[rfm['SECTOR'] == selected_sector]
-
-        # Selector de país para el gráfico 3D
-        countries = ['Todos'] + list(rfm['Country'].unique())
-        selected_country = st.selectbox('Selecciona un país para el gráfico 3D', countries)
-        if selected_country != 'Todos':
-            rfm = rfm[rfm['Country'] == selected_country]
-
-        if st.checkbox("Mostrar análisis RFM"):
-            st.write(rfm)
-
-        if st.checkbox("Mostrar gráfico 3D por Sector"):
-            fig = plot_3d(rfm, operaciones)
-            st.pyplot(fig)
-
-        if st.checkbox("Mostrar gráfico 3D por País"):
-            fig = plot_3d_by_country(rfm)
-            st.pyplot(fig)
-
-        # Cálculo de estadísticas de segmentos
-        if st.checkbox("Mostrar estadísticas de segmentos"):
-            segment_stats = calculate_segment_statistics(rfm)
-            st.write(segment_stats)
+        # Libro en cualquiera de los dos formatos, en el esquema canónico
+        dataset = core.load_workbook(uploaded_file)
+        desembolsos, etapas = dataset.desembolsos, dataset.etapas
+        version = getattr(uploaded_file, 'file_id', uploaded_file)
+        fuente = None
+    else:
+        # Sin archivo: la cartera publicada, ya leída con la última copia de las hojas
+        refresher = get_refresher()
+        refresher.register('rfm', build_dataset)
+        snapshot = refresher.snapshot(timeout=0)
+        if snapshot is None or snapshot.datasets.get('rfm') is None:
+            if refresher.build_error('rfm') or (snapshot is not None and refresher.pending('rfm')):
+                show_load_error(refresher, 'rfm')
+            return
+        st.caption("Sin archivo: se muestra la cartera publicada en Google Sheets.")
+        show_freshness(snapshot)
+        desembolsos, etapas = snapshot.datasets['rfm']
+        version = snapshot.version
+        # La cartera publicada se resume de forma incremental: cada copia nueva solo suma sus desembolsos nuevos
+        fuente = 'rfm'
+    metrics.dataset_size(len(desembolsos))
+
+    # Fecha de corte: por defecto la del último desembolso; una fecha anterior muestra la cartera como estaba ese día
+    ultima = core.as_of_date(desembolsos)
+    fecha_corte = None
+    if pd.notna(ultima):
+        fecha_corte = st.date_input('Fecha de corte', value=ultima.date(), min_value=desembolsos['FechaEfectiva'].min().date(), max_value=ultima.date(),
+                                    help="Recency, el porcentaje desembolsado y el Estado se calculan con los desembolsos hechos hasta esta fecha.")
+    with metrics.stage('rfm'):
+        rfm, operaciones = load_rfm_table(desembolsos, etapas, version, fecha_corte)
+
+    # Segmentación: reglas RFM fijas o grupos de k-means calculados sobre toda la cartera (antes de los filtros)
+    modo = st.radio('Segmentación', ['Reglas RFM', 'K-means'], horizontal=True,
+                    help="K-means agrupa las etapas por Recency, Frequency, Monetary y porcentaje desembolsado estandarizados.")
+    centroides = None
+    if modo == 'K-means':
+        k = st.slider('Cantidad de grupos', min_value=2, max_value=10, value=K_GRUPOS)
+        with metrics.stage('kmeans'):
+            grupos, centroides = load_clusters(rfm, version, fecha_corte, k)
+        rfm = rfm.assign(Segment=grupos)
+
+    # Etapas que dejaron de desembolsar, sobre toda la cartera activa a la fecha de corte
+    if st.checkbox("Mostrar proyectos estancados"):
+        with metrics.stage('stalled'):
+            alertas = load_stalled_alerts(desembolsos, etapas, version, fecha_corte, fuente)
+        st.caption(f"Señales: {MESES_SIN_DESEMBOLSO} meses o más sin desembolsar, {VECES_INTERVALO:g} veces o más su intervalo "
+                   f"medio entre desembolsos y {PUNTOS_BRECHA:g} puntos o más por debajo de la curva de su sector a la misma edad.")
+        st.write(f"{len(alertas)} etapas con alguna señal, de más a menos señales y por saldo pendiente:", alertas)
+
+    # Selectbox para filtrar por Estado
+    estado_filter = st.selectbox('Filtrar por Estado', ['Todos', 'Terminado', 'Vigente'])
+    if estado_filter != 'Todos':
+        rfm = rfm[rfm['Estado'] == estado_filter]
+
+    # Selector de sector para el gráfico 3D
+    sectors = ['Todos'] + list(operaciones[core.SECTOR].unique())
+    selected_sector = st.selectbox('Selecciona un sector para el gráfico 3D', sectors)
+    if selected_sector != 'Todos':
+        rfm = rfm[rfm[core.SECTOR] == selected_sector]
+
+    # Selector de país para el gráfico 3D
+    countries = ['Todos'] + list(rfm['Country'].unique())
+    selected_country = st.selectbox('Selecciona un país para el gráfico 3D', countries)
+    if selected_country != 'Todos':
+        rfm = rfm[rfm['Country'] == selected_country]
+
+    if st.checkbox("Mostrar análisis RFM"):
+        st.write(rfm)
+
+    if st.checkbox("Mostrar gráfico 3D por Sector"):
+        fig = plot_3d(rfm, operaciones)
+        st.pyplot(fig)
+
+    if st.checkbox("Mostrar gráfico 3D por País"):
+        fig = plot_3d_by_country(rfm)
+        st.pyplot(fig)
+
+    # Cálculo de estadísticas de segmentos
+    if st.checkbox("Mostrar estadísticas de segmentos"):
+        segment_stats = calculate_segment_statistics(rfm)
+        st.write(segment_stats)
+        if centroides is not None:
+            st.write("Centroides de los grupos (toda la cartera):", centroides)
 
 
 if __name__ == "__main__":
-    main()
+    with metrics.page_run('estadisticas'):
+        main()
 
@@ -0,0 +1,94 @@
+import streamlit as st
+from streamlit.logger import get_logger
+from cohorts import TODOS, build_dataset, cohort_breakdown, load_cohort_curves
+import metrics
+from joins import show_join_reports
+from sheets_refresher import get_refresher
+from utils import excel_download, lazy_import, show_freshness, show_load_error
+
+pd = lazy_import('pandas')
+alt = lazy_import('altair')
+
+LOGGER = get_logger(__name__)
+
+# Espera máxima (segundos) por la primera descarga cuando todavía no hay ninguna copia
+PRIMERA_CARGA_TIMEOUT = 120
+
+# Curvas de una cohorte por país o por sector
+@st.cache_data(max_entries=256, show_spinner=False)
+def breakdown_for(_cube, version, cohorte, por):
+    return cohort_breakdown(_cube, cohorte, por)
+
+# Mapa de calor cohorte x años desde la vigencia
+def heatmap(curvas_df):
+    base = alt.Chart(curvas_df).encode(
+        x=alt.X('Anos:O', axis=alt.Axis(title='Años desde la Vigencia', labelAngle=0)),
+        y=alt.Y('Cohorte:O', axis=alt.Axis(title='Cohorte de Vigencia')),
+    )
+    celdas = base.mark_rect().encode(
+        color=alt.Color('Porcentaje Acumulado:Q', scale=alt.Scale(scheme='blues', domain=[0, 100]), title='% Acumulado'),
+        tooltip=['Cohorte', 'Anos', alt.Tooltip('Porcentaje Acumulado:Q', format='.1f'), 'Proyectos'],
+    )
+    texto = base.mark_text(baseline='middle', fontSize=10).encode(
+        text=alt.Text('Porcentaje Acumulado:Q', format='.0f'),
+        color=alt.condition('datum["Porcentaje Acumulado"] > 60', alt.value('white'), alt.value('black')),
+    )
+    return (celdas + texto).properties(title='Porcentaje Acumulado del Aporte por Cohorte de Vigencia', width=600, height=400)
+
+# Curvas superpuestas, una por valor de la columna 'serie'
+def curves_chart(data, serie, title):
+    return alt.Chart(data).mark_line(point=True).encode(
+        x=alt.X('Anos:O', axis=alt.Axis(title='Años desde la Vigencia', labelAngle=0)),
+        y=alt.Y('Porcentaje Acumulado:Q', axis=alt.Axis(title='Porcentaje Acumulado del Aporte')),
+        color=alt.Color(f'{serie}:N', title=serie),
+        tooltip=[serie, 'Anos', alt.Tooltip('Porcentaje Acumulado:Q', format='.2f'), 'Proyectos'],
+    ).properties(title=title, width=600, height=400)
+
+def run():
+    st.set_page_config(page_title="Cohortes de Vigencia", page_icon="📈")
+    st.title("Curvas de Desembolso por Cohorte de Vigencia 📈")
+    st.write("Compara la velocidad de desembolso de los proyectos según el año en que entraron en vigencia.")
+
+    refresher = get_refresher()
+    refresher.register('cohortes', build_dataset)
+    snapshot = refresher.snapshot(timeout=PRIMERA_CARGA_TIMEOUT)
+    if snapshot is None or snapshot.datasets.get('cohortes') is None:
+        show_load_error(refresher, 'cohortes')
+        return
+    show_freshness(snapshot)
+    cube, reports = snapshot.datasets['cohortes']
+    show_join_reports(reports)
+    if len(cube.cohortes) == 0:
+        st.warning("No hay desembolsos con fecha de vigencia y fecha efectiva válidas.")
+        return
+
+    pais = st.sidebar.selectbox('País', [TODOS] + cube.paises.tolist())
+    sector = st.sidebar.selectbox('Sector', [TODOS] + cube.sectores.tolist())
+    with metrics.stage('curves'):
+        curvas_df = load_cohort_curves(cube, snapshot.version, pais, sector)
+
+    st.altair_chart(heatmap(curvas_df), width='stretch')
+
+    cohortes = cube.cohortes.tolist()
+    seleccion = st.multiselect('Cohortes a comparar', cohortes, default=cohortes[-5:])
+    if seleccion:
+        st.altair_chart(curves_chart(curvas_df[curvas_df['Cohorte'].isin(seleccion)], 'Cohorte', 'Curvas por Cohorte'), width='stretch')
+
+    matriz = curvas_df.pivot(index='Cohorte', columns='Anos', values='Porcentaje Acumulado').round(2)
+    st.write('Porcentaje Acumulado del Aporte (filas: cohorte, columnas: años desde la vigencia):', matriz)
+    st.download_button(
+        label="Descargar Matriz de Cohortes en Excel",
+        data=excel_download(matriz.reset_index()),
+        file_name="cohortes_vigencia.xlsx",
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    )
+
+    # Una cohorte por país y por sector
+    cohorte = st.selectbox('Detalle de la Cohorte', cohortes, index=len(cohortes) - 1)
+    col_pais, col_sector = st.columns(2)
+    col_pais.altair_chart(curves_chart(breakdown_for(cube, snapshot.version, cohorte, 'Pais'), 'Pais', f'Cohorte {cohorte} por País'), width='stretch')
+    col_sector.altair_chart(curves_chart(breakdown_for(cube, snapshot.version, cohorte, 'Sector'), 'Sector', f'Cohorte {cohorte} por Sector'), width='stretch')
+
+if __name__ == "__main__":
+    with metrics.page_run('cohortes_vigencia'):
+        run()
@@ -0,0 +1,85 @@
+import streamlit as st
+from streamlit.logger import get_logger
+import core
+import metrics
+from simulation import annual_percentiles, build_dataset, country_percentiles, load_cash_flows
+from sheets_refresher import get_refresher
+from utils import excel_download, lazy_import, show_freshness, show_load_error
+
+pd = lazy_import('pandas')
+alt = lazy_import('altair')
+
+LOGGER = get_logger(__name__)
+
+# Espera máxima (segundos) por la primera descarga cuando todavía no hay ninguna copia
+PRIMERA_CARGA_TIMEOUT = 120
+
+# Abanico del flujo anual: banda P10-P90 y mediana
+def fan_chart(tabla):
+    base = alt.Chart(tabla).encode(x=alt.X('Año:O', axis=alt.Axis(title='Año', labelAngle=0)))
+    banda = base.mark_area(opacity=0.3).encode(
+        y=alt.Y('P10:Q', axis=alt.Axis(title='Desembolsos (millones)')),
+        y2='P90:Q',
+        tooltip=['Año', alt.Tooltip('P10:Q', format='.2f'), alt.Tooltip('P50:Q', format='.2f'), alt.Tooltip('P90:Q', format='.2f')],
+    )
+    mediana = base.mark_line(point=True).encode(y='P50:Q')
+    return (banda + mediana).properties(title='Flujo Anual de Desembolsos Simulado (P10 - P50 - P90)', width=600, height=400)
+
+def run():
+    st.set_page_config(page_title="Simulación de Flujos", page_icon="🎲")
+    st.title("Simulación de Flujos de Desembolso 🎲")
+    st.write("Proyecta los desembolsos pendientes de la cartera activa sorteando, año a año, porcentajes históricos "
+             "de proyectos del mismo país y sector con la misma antigüedad.")
+
+    refresher = get_refresher()
+    refresher.register('simulacion', build_dataset)
+    snapshot = refresher.snapshot(timeout=PRIMERA_CARGA_TIMEOUT)
+    if snapshot is None or snapshot.datasets.get('simulacion') is None:
+        show_load_error(refresher, 'simulacion')
+        return
+    show_freshness(snapshot)
+    desembolsos, etapas = snapshot.datasets['simulacion']
+    metrics.dataset_size(len(desembolsos))
+
+    ultima = core.as_of_date(desembolsos)
+    if pd.isna(ultima):
+        st.warning("No hay desembolsos con fecha efectiva válida.")
+        return
+    escenarios = st.sidebar.select_slider('Escenarios', options=[500, 1000, 2000, 5000, 10000], value=2000)
+    anos = st.sidebar.slider('Años a proyectar', min_value=3, max_value=15, value=10)
+    fecha_corte = st.sidebar.date_input('Fecha de corte', value=ultima.date(), min_value=desembolsos['FechaEfectiva'].min().date(), max_value=ultima.date(),
+                                        help="Se simula desde esta fecha con los desembolsos hechos hasta ella.")
+
+    with metrics.stage('simulation'):
+        try:
+            simulacion = load_cash_flows(desembolsos, etapas, snapshot.version, fecha_corte, escenarios, anos)
+        except ValueError as e:
+            st.error(str(e))
+            return
+    anual = annual_percentiles(simulacion)
+
+    col_etapas, col_saldo, col_total = st.columns(3)
+    col_etapas.metric('Etapas activas', simulacion.etapas)
+    col_saldo.metric('Saldo por desembolsar (millones)', f"{simulacion.saldo:,.2f}")
+    col_total.metric(f'Desembolsos P50 en {anos} años (millones)', f"{anual['P50 Acumulado'].iloc[-1]:,.2f}")
+    st.caption(f"El primer año ({anual['Año'].iloc[0]}) cubre solo lo que resta desde la fecha de corte.")
+
+    st.altair_chart(fan_chart(anual), width='stretch')
+    st.write('Percentiles del flujo anual de la cartera (millones):', anual)
+
+    # Cada país con sus propios percentiles: los P10/P90 por país no suman los de la cartera
+    por_pais = country_percentiles(simulacion)
+    st.write('P50 por país (millones):', por_pais.pivot(index='Pais', columns='Año', values='P50'))
+    with st.expander("P10 y P90 por país"):
+        st.write(por_pais)
+
+    st.download_button(
+        label="Descargar Simulación en Excel",
+        data=excel_download(pd.concat([anual.assign(Pais='Cartera')[por_pais.columns], por_pais], ignore_index=True)),
+        file_name="simulacion_flujos.xlsx",
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    )
+
+if __name__ == "__main__":
+    with metrics.page_run('simulacion_flujos'):
+        run()
@@ -0,0 +1,61 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing.context
+import os
+import sys
+import threading
+import types
+
+# Módulo principal que ven los procesos al arrancar: sin archivo ni spec, así no vuelven a ejecutar nada
+_WORKER_MAIN = types.ModuleType('__mp_main__')
+_main_lock = threading.Lock()
+
+
+# Proceso spawn que no vuelve a ejecutar el __main__ del padre. Streamlit instala la página en curso como __main__ y
+# spawn la volvería a importar (como __mp_main__) en cada proceso, con sus imports y sus st.title(...). Mientras se
+# lanza el proceso, __main__ es un módulo vacío; luego se restituye (si Streamlit no lo cambió entretanto).
+class _WorkerProcess(multiprocessing.context.SpawnProcess):
+    def start(self):
+        with _main_lock:
+            main = sys.modules.get('__main__')
+            sys.modules['__main__'] = _WORKER_MAIN
+            try:
+                super().start()
+            finally:
+                if sys.modules.get('__main__') is _WORKER_MAIN:
+                    sys.modules['__main__'] = main
+
+
+class _WorkerContext(multiprocessing.context.SpawnContext):
+    Process = _WorkerProcess
+
+
+# Pool de procesos (spawn) de un módulo, compartido por todas las sesiones del servidor: los procesos se arrancan con
+# la primera tarea y se reutilizan, así el arranque en frío se paga una sola vez. Cada proceso arranca sin la página en
+# curso e importa solo el módulo de la función que ejecuta (y lo que ese módulo importe).
+class SpawnPool:
+    def __init__(self, max_workers):
+        self.workers = max(1, min(max_workers, os.cpu_count() or 1))
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=_WorkerContext())
+            return self._executor
+
+    # Descarta el pool (p. ej. después de que un proceso murió); el siguiente uso arranca uno nuevo
+    def reset(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    # Resultados de fn sobre cada elemento, en orden; None si el pool se rompió (quien llama sigue en serie)
+    def map(self, fn, items):
+        try:
+            return list(self.executor().map(fn, items))
+        except BrokenProcessPool:
+            self.reset()
+            return None
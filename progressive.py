@@ -0,0 +1,127 @@
+import math
+import threading
+import time
+
+import metrics
+from utils import lazy_import
+
+np = lazy_import('numpy')
+
+# Etapas de la vista previa: la misma fracción de cada estrato, con un tope para que se calcule en milisegundos
+PREVIEW_FRACCION = 0.1
+PREVIEW_MAX_ETAPAS = 200
+
+# Cada cuánto la página revisa si terminó la etapa que espera (y si el usuario cambió algún widget)
+POLL_SECONDS = 0.25
+
+
+# Muestra estratificada de etapas: de cada estrato (p. ej. país x sector) se toma la misma fracción, al menos 'minimo'
+def stratified_sample(etapas, by, fraccion=PREVIEW_FRACCION, maximo=PREVIEW_MAX_ETAPAS, minimo=1, seed=0):
+    etapas = etapas.drop_duplicates(subset='IDEtapa')
+    if maximo is not None and len(etapas):
+        fraccion = min(fraccion, maximo / len(etapas))
+    orden = np.random.default_rng(seed).permutation(len(etapas))
+    mezcladas = etapas.iloc[orden]
+    grupos = mezcladas.groupby(by, dropna=False, sort=False)
+    posicion = grupos.cumcount().to_numpy()
+    cupo = np.maximum(np.ceil(grupos['IDEtapa'].transform('size').to_numpy() * fraccion), minimo)
+    return mezcladas.loc[posicion < cupo, 'IDEtapa'].to_numpy()
+
+
+# Cadena de etapas de una página ejecutada en un hilo aparte. 'steps' es una lista de (nombre, fn(resultados)) en orden;
+# cada fn recibe los resultados de las etapas anteriores. Cancelar detiene la cadena al terminar la etapa en curso.
+class BackgroundJob:
+    def __init__(self, key, steps, after=None):
+        self.key = key
+        self.steps = list(steps)
+        self._after = after
+        self._cancel = threading.Event()
+        self._ready = {nombre: threading.Event() for nombre, _ in self.steps}
+        self._results = {}
+        self._seconds = {}
+        self._errors = {}
+        self._reported = set()
+        self._thread = threading.Thread(target=self._run, name='progressive-job', daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def _run(self):
+        # El trabajo anterior de la sesión comparte el grafo de etapas: se espera a que suelte la etapa en curso
+        if self._after is not None:
+            self._after.join()
+            self._after = None
+        for nombre, fn in self.steps:
+            if self._cancel.is_set():
+                break
+            inicio = time.perf_counter()
+            try:
+                self._results[nombre] = fn(self._results)
+            except Exception as e:
+                self._errors[nombre] = e
+            self._seconds[nombre] = time.perf_counter() - inicio
+            self._ready[nombre].set()
+            if nombre in self._errors:
+                break
+        # Las etapas que no llegaron a ejecutarse quedan marcadas como canceladas
+        for nombre, evento in self._ready.items():
+            if not evento.is_set():
+                self._errors[nombre] = RuntimeError(f"Etapa '{nombre}' cancelada")
+                evento.set()
+
+    def done(self, nombre):
+        return self._ready[nombre].is_set()
+
+    def wait(self, nombre, timeout=None):
+        return self._ready[nombre].wait(timeout)
+
+    def result(self, nombre):
+        self.wait(nombre)
+        if nombre in self._errors:
+            raise self._errors[nombre]
+        # La duración de la etapa se cuenta una sola vez en las métricas de la ejecución que la recibe
+        if nombre not in self._reported:
+            self._reported.add(nombre)
+            metrics.stage_result(nombre, self._seconds[nombre])
+        return self._results[nombre]
+
+
+# Trabajo de la sesión para 'slot': se reutiliza mientras la clave no cambie; si cambió (otro archivo, otro widget),
+# el anterior se cancela y el nuevo empieza cuando este suelta la etapa en curso. 'steps' arma la lista de etapas.
+def session_job(slot, key, steps):
+    import streamlit as st
+
+    clave = f'progressive:{slot}'
+    anterior = st.session_state.get(clave)
+    if anterior is not None and anterior.key == key and not anterior.cancelled:
+        return anterior
+    if anterior is not None:
+        anterior.cancel()
+    job = BackgroundJob(key, steps(), after=anterior)
+    st.session_state[clave] = job
+    return job
+
+
+def cancel_session_job(slot):
+    import streamlit as st
+
+    anterior = st.session_state.pop(f'progressive:{slot}', None)
+    if anterior is not None:
+        anterior.cancel()
+
+
+# Espera el resultado de una etapa mostrando el avance en 'placeholder'. Cada actualización del marcador es un mensaje
+# al navegador: si el usuario cambió un widget, Streamlit interrumpe aquí la ejecución en vez de al final de la etapa.
+def wait_for(job, nombre, placeholder, mensaje):
+    inicio = time.monotonic()
+    while not job.wait(nombre, POLL_SECONDS):
+        placeholder.caption(f"{mensaje} ({math.floor(time.monotonic() - inicio)} s)")
+    return job.result(nombre)
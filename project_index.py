@@ -0,0 +1,104 @@
+from collections import namedtuple
+import functools
+
+from bucketing import GRANULARIDADES, period_end_year
+import core
+from envelope import build_envelope_matrix
+from forecast import forecast_projects
+import metrics
+from search_index import build_search_index
+from utils import lazy_import
+
+np = lazy_import('numpy')
+
+# Tablas precalculadas de un proyecto
+ProjectCurves = namedtuple('ProjectCurves', ['alias', 'por_periodo', 'por_ano_efectiva', 'proyeccion', 'parametros'])
+
+# Índice de la cartera: buscador del selector, curvas por IDEtapa y matriz para las bandas de percentiles
+ProjectIndex = namedtuple('ProjectIndex', ['data', 'periodo', 'buscador', 'curves', 'etapas_df', 'matriz', 'fila_by_etapa'])
+
+
+# Tablas de Monto, Monto Acumulado y porcentajes de todos los proyectos en una sola pasada, separadas por IDEtapa
+def curve_tables(df, group_col):
+    tabla = df.groupby(['IDEtapa', group_col])['Monto'].sum().reset_index()
+    por_etapa = tabla.groupby('IDEtapa')
+    tabla['Monto Acumulado'] = por_etapa['Monto'].cumsum()
+    tabla['Porcentaje del Monto'] = tabla['Monto'] / por_etapa['Monto'].transform('sum') * 100
+    tabla['Porcentaje Acumulado'] = tabla['Monto Acumulado'] / tabla.groupby('IDEtapa')['Monto Acumulado'].transform('max') * 100
+
+    # Convertir 'Monto' y 'Monto Acumulado' a millones y redondear a 2 decimales
+    tabla['Monto'] = (tabla['Monto'] / 1000000).round(2)
+    tabla['Monto Acumulado'] = (tabla['Monto Acumulado'] / 1000000).round(2)
+    return {etapa: grupo.reset_index(drop=True) for etapa, grupo in tabla.groupby('IDEtapa', sort=False)}
+
+
+# Construye el índice por proyecto a partir del dataset combinado (IDEtapa como texto)
+def build_project_index(filtered_df, periodo='Ano'):
+    alias = filtered_df.drop_duplicates(subset='IDEtapa').set_index('IDEtapa')['Alias'].fillna('')
+    buscador = build_search_index(filtered_df)
+
+    por_periodo = curve_tables(filtered_df, periodo)
+    por_ano_efectiva = curve_tables(filtered_df, 'Ano_FechaEfectiva')
+
+    # Proyección de todos los proyectos en un solo lote, también separada por IDEtapa
+    meses_por_periodo = dict(GRANULARIDADES.values())[periodo]
+    parametros_df, proyeccion_df = forecast_projects(filtered_df, etapa_col='IDEtapa', period_col=periodo, monto_col='Monto',
+                                                     aporte_col='AporteFONPLATAVigente', periodos_por_ano=12 // meses_por_periodo)
+    # El periodo de finalización se cuenta desde la vigencia de cada etapa: se muestra como año calendario
+    vigencia = filtered_df.drop_duplicates(subset='IDEtapa').set_index('IDEtapa')['FechaVigencia']
+    parametros_df['Año Fin Proyectado'] = period_end_year(vigencia.reindex(parametros_df['IDEtapa']).to_numpy(dtype='datetime64[ns]'),
+                                                          parametros_df['Fin Proyectado'].to_numpy(), meses_por_periodo)
+    proyeccion_df['Monto'] = (proyeccion_df['Monto Proyectado'] / 1000000).round(2)
+    proyeccion_df['Monto Acumulado'] = (proyeccion_df['Monto Acumulado Proyectado'] / 1000000).round(2)
+    proyecciones = {etapa: grupo.reset_index(drop=True) for etapa, grupo in proyeccion_df.groupby('IDEtapa', sort=False)}
+    parametros = parametros_df.set_index('IDEtapa').to_dict('index')
+    vacia = proyeccion_df.iloc[0:0]
+
+    curves = {
+        etapa: ProjectCurves(
+            alias=nombre,
+            por_periodo=por_periodo.get(etapa),
+            por_ano_efectiva=por_ano_efectiva.get(etapa),
+            proyeccion=proyecciones.get(etapa, vacia),
+            parametros=parametros.get(etapa),
+        )
+        for etapa, nombre in alias.items()
+    }
+
+    etapas_df, matriz = build_envelope_matrix(filtered_df, etapa_col='IDEtapa', period_col=periodo, monto_col='Monto', aporte_col='AporteFONPLATAVigente')
+    fila_by_etapa = dict(zip(etapas_df['IDEtapa'], np.arange(len(etapas_df))))
+
+    return ProjectIndex(filtered_df, periodo, buscador, curves, etapas_df, matriz, fila_by_etapa)
+
+
+# Dataset combinado de Curvas_Proyectos a partir de las hojas de Google Sheets, en el esquema canónico: solo los
+# desembolsos con ambas fechas y hechos desde la vigencia, con el año de la fecha efectiva
+def process_data(frames, reports=None):
+    desembolsos, _ = core.from_sheets(frames, reports)
+    filtered_df = core.since_vigencia(desembolsos).copy()
+    filtered_df['Ano_FechaEfectiva'] = filtered_df['FechaEfectiva'].dt.year
+    return filtered_df
+
+
+# Constructor del dataset para el actualizador en segundo plano: dataset combinado y claves repetidas descartadas
+def build_dataset(frames):
+    reports = []
+    return process_data(frames, reports), reports
+
+
+def _build_project_index_cached(_filtered_df, version, periodo):
+    metrics.cache_miss('project_index')
+    return build_project_index(_filtered_df, periodo)
+
+
+@functools.lru_cache(maxsize=None)
+def _cached_index():
+    import streamlit as st
+
+    return st.cache_resource(max_entries=8, show_spinner=False)(_build_project_index_cached)
+
+
+# Índice por versión del dataset y granularidad, compartido entre sesiones (la página y el precalentamiento usan el mismo caché)
+def load_project_index(filtered_df, version, periodo):
+    metrics.cache_call('project_index')
+    return _cached_index()(filtered_df, version, periodo)
@@ -0,0 +1,147 @@
+import functools
+
+import core
+from joins import build_dimension, merge_many_to_one
+from kmeans import minibatch_kmeans, standardize
+import metrics
+from utils import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Variables de la segmentación por k-means y cantidad de grupos por defecto
+FEATURES = ['Recency', 'Frequency', 'Monetary', 'Desembolsado']
+K_GRUPOS = 5
+
+
+# Función para calcular los puntajes RFM; 'Recency' son los días desde el último desembolso hasta la fecha de corte
+def calculate_rfm_scores(data, fecha_corte):
+    recency = data.groupby('IDEtapa')['FechaEfectiva'].max().reset_index()
+    recency['Recency'] = (pd.Timestamp(fecha_corte) - recency['FechaEfectiva']).dt.days
+    frequency = data.groupby('IDEtapa').size().reset_index(name='Frequency')
+    monetary = data.groupby('IDEtapa')['Monto'].sum().reset_index()
+    monetary.rename(columns={'Monto': 'Monetary'}, inplace=True)
+    rfm = recency.merge(frequency, on='IDEtapa').merge(monetary, on='IDEtapa')
+    return rfm
+
+# Cuartil de cada valor (1 a 4): 1 hasta el percentil 25 inclusive, ... 4 por encima del 75 (y los NaN)
+def _quartile(serie):
+    cortes = serie.quantile(q=[0.25, 0.5, 0.75]).to_numpy()
+    return np.searchsorted(cortes, serie.to_numpy(), side='left') + 1
+
+# Función para asignar puntajes R, F, M (Frequency y Monetary puntúan al revés: 1 es el cuartil más alto)
+def assign_rfm_scores(rfm):
+    rfm['R_Score'] = _quartile(rfm['Recency'])
+    rfm['F_Score'] = 5 - _quartile(rfm['Frequency'])
+    rfm['M_Score'] = 5 - _quartile(rfm['Monetary'])
+    return rfm
+
+# Función para asignar segmentos con las reglas RFM, evaluadas para todas las etapas a la vez en el mismo orden
+def assign_segments(rfm):
+    r, f, m = rfm['R_Score'], rfm['F_Score'], rfm['M_Score']
+    return np.select(
+        [(r <= 2) & (f <= 2), f <= 2, (r <= 2) & (f > 2) & (m > 2), r <= 2, (r >= 3) & (f <= 2) & (m <= 2), (r == 4) & (f <= 2) & (m <= 2)],
+        ['Champions', 'Loyal Customers', 'Potential Loyalist', 'New Customers', 'At Risk', 'Can’t Lose Them'],
+        default='Hibernating',
+    )
+
+# Estadísticas por segmento (reglas RFM o grupos de k-means): medias de R, F, M y del porcentaje desembolsado
+def calculate_segment_statistics(rfm):
+    segment_stats = rfm.groupby('Segment').agg(
+        Recency_mean=('Recency', 'mean'),
+        Frequency_mean=('Frequency', 'mean'),
+        Monetary_mean=('Monetary', 'mean'),
+        Desembolsado_mean=('Desembolsado', 'mean'),
+        Count=('IDEtapa', 'count')
+    ).reset_index()
+
+    # Aplicar redondeo después del cálculo
+    segment_stats['Recency_mean'] = segment_stats['Recency_mean'].round(0)
+    segment_stats['Frequency_mean'] = segment_stats['Frequency_mean'].round(0)
+    segment_stats['Monetary_mean'] = (segment_stats['Monetary_mean']/1000000).round(3)
+    segment_stats['Desembolsado_mean'] = segment_stats['Desembolsado_mean'].round(1)
+
+    return segment_stats
+
+
+# Tabla RFM por etapa con su segmento, sector, aporte, porcentaje desembolsado, estado y país a la fecha de corte
+# (por defecto la del último desembolso): solo cuentan los desembolsos hechos hasta ese día
+def rfm_table(desembolsos, etapas, fecha_corte=None):
+    if fecha_corte is None:
+        fecha_corte = core.as_of_date(desembolsos)
+    desembolsos = core.filter_as_of(desembolsos, fecha_corte)
+    operaciones = build_dimension(etapas, 'IDEtapa', columns=[core.SECTOR, core.APORTE])
+    rfm = calculate_rfm_scores(desembolsos, fecha_corte)
+    rfm = assign_rfm_scores(rfm)
+    rfm['Segment'] = assign_segments(rfm)
+    rfm = merge_many_to_one(rfm, operaciones, on='IDEtapa')
+    rfm['Desembolsado'] = (rfm['Monetary'] / rfm[core.APORTE]) * 100
+    rfm['Estado'] = np.where(rfm['Desembolsado'] == 100, 'Terminado', 'Vigente')
+    rfm['Country'] = rfm['IDEtapa'].str[:2]
+    return rfm, operaciones
+
+
+def _rfm_table_cached(_desembolsos, _etapas, version, fecha_corte):
+    metrics.cache_miss('rfm_table')
+    return rfm_table(_desembolsos, _etapas, fecha_corte)
+
+
+@functools.lru_cache(maxsize=None)
+def _cached_rfm():
+    import streamlit as st
+
+    return st.cache_data(max_entries=32, show_spinner=False)(_rfm_table_cached)
+
+
+# Tabla RFM por versión del dataset y fecha de corte, compartida entre sesiones (la fecha por defecto se precalcula)
+def load_rfm_table(desembolsos, etapas, version, fecha_corte=None):
+    metrics.cache_call('rfm_table')
+    if fecha_corte is None:
+        fecha_corte = core.as_of_date(desembolsos)
+    return _cached_rfm()(desembolsos, etapas, version, pd.Timestamp(fecha_corte))
+
+
+# Grupos de k-means sobre Recency, Frequency, Monetary y porcentaje desembolsado estandarizados (los faltantes toman
+# la mediana, igual que los infinitos del porcentaje desembolsado de las etapas sin aporte). Los grupos se numeran por
+# porcentaje desembolsado medio creciente, así sus nombres no dependen de la inicialización. Devuelve el nombre del
+# grupo de cada etapa y los centroides en las unidades originales (ningún grupo si no hay etapas).
+def cluster_projects(rfm, k=K_GRUPOS, seed=0):
+    if rfm.empty:
+        return np.array([], dtype=object), pd.DataFrame(columns=['Segment', *FEATURES])
+    features = rfm[FEATURES].astype(float).replace([np.inf, -np.inf], np.nan)
+    features = features.fillna(features.median()).fillna(0)
+    X, media, desviacion = standardize(features.to_numpy())
+    centroides, etiquetas, _ = minibatch_kmeans(X, k, seed=seed)
+
+    centroides = pd.DataFrame(centroides * desviacion + media, columns=FEATURES)
+    orden = np.argsort(centroides['Desembolsado'].to_numpy(), kind='stable')
+    rango = np.empty(len(orden), dtype=np.int64)
+    rango[orden] = np.arange(len(orden))
+    nombres = np.array([f'Grupo {i + 1}' for i in range(len(orden))])
+    centroides = centroides.iloc[orden].reset_index(drop=True)
+    centroides.insert(0, 'Segment', nombres)
+    return nombres[rango[etiquetas]], centroides
+
+
+def _cluster_projects_cached(_rfm, version, fecha_corte, k):
+    metrics.cache_miss('rfm_clusters')
+    return cluster_projects(_rfm, k)
+
+
+@functools.lru_cache(maxsize=None)
+def _cached_clusters():
+    import streamlit as st
+
+    return st.cache_data(max_entries=32, show_spinner=False)(_cluster_projects_cached)
+
+
+# Grupos y centroides por versión del dataset, fecha de corte y cantidad de grupos, compartidos entre sesiones
+def load_clusters(rfm, version, fecha_corte, k=K_GRUPOS):
+    metrics.cache_call('rfm_clusters')
+    return _cached_clusters()(rfm, version, None if fecha_corte is None else pd.Timestamp(fecha_corte), k)
+
+
+# Constructor del dataset para el actualizador en segundo plano: desembolsos y etapas de la cartera publicada en
+# Google Sheets; la tabla RFM se calcula (y se guarda en caché) por fecha de corte
+def build_dataset(frames):
+    return core.from_sheets(frames)
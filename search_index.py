@@ -0,0 +1,111 @@
+from collections import defaultdict, namedtuple
+import bisect
+import re
+import unicodedata
+
+import core
+from utils import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Resultados que se envían al navegador por búsqueda
+MAX_RESULTADOS = 20
+
+# Campos indexados con su peso: una coincidencia en el identificador de la etapa vale más que una en el país o el sector
+CAMPOS = (('IDEtapa', 4), ('NoProyecto', 3), ('Alias', 2), ('Pais', 1), (core.SECTOR, 1))
+
+# Una coincidencia exacta de la palabra vale el doble que una de prefijo; una subcadena dentro de una palabra, casi nada
+EXACTA = 2.0
+SUBCADENA = 0.5
+
+_SEPARADORES = re.compile(r'[^0-9a-z]+')
+
+# Índice de búsqueda de la cartera: palabras ordenadas (para encontrar prefijos con una búsqueda binaria) con las filas
+# y pesos de sus apariciones contiguos a partir de 'inicios', el texto de cada etapa para las subcadenas y sus etiquetas
+SearchIndex = namedtuple('SearchIndex', ['etapas', 'etiquetas', 'palabras', 'inicios', 'filas', 'pesos', 'textos'])
+
+
+# Minúsculas y sin tildes: 'Asunción' y 'asuncion' son la misma palabra
+def normalize_text(texto):
+    texto = unicodedata.normalize('NFKD', str(texto).lower())
+    return ''.join(c for c in texto if not unicodedata.combining(c))
+
+
+# Palabras de un valor: el valor completo (p. ej. 'ar-0012') y sus partes ('ar', '0012')
+def tokenize(texto):
+    texto = normalize_text(texto).strip()
+    return ({texto} | set(_SEPARADORES.split(texto))) - {''}
+
+
+# Índice con una entrada por IDEtapa a partir del dataset combinado (se arma una vez por versión de los datos)
+def build_search_index(df):
+    etapas_df = df.drop_duplicates(subset='IDEtapa').sort_values('IDEtapa').reset_index(drop=True)
+    etapas = etapas_df['IDEtapa'].astype(str).to_numpy()
+    alias = etapas_df['Alias'].fillna('') if 'Alias' in etapas_df.columns else pd.Series('', index=etapas_df.index)
+    etiquetas = dict(zip(etapas, [f"{etapa} ({nombre})" for etapa, nombre in zip(etapas, alias)]))
+
+    columnas = {}
+    apariciones = defaultdict(dict)
+    for campo, peso in CAMPOS:
+        if campo not in etapas_df.columns:
+            continue
+        columna = etapas_df[campo].fillna('').astype(str)
+        if campo == 'Pais':
+            # El país se encuentra por su código y por su nombre
+            columna = columna + ' ' + core.country_name(etapas_df[campo]).fillna('').astype(str)
+        columnas[campo] = columna
+        for fila, valor in enumerate(columna):
+            for palabra in tokenize(valor):
+                apariciones[palabra][fila] = max(apariciones[palabra].get(fila, 0), peso)
+
+    palabras = sorted(apariciones)
+    filas, pesos, inicios = [], [], [0]
+    for palabra in palabras:
+        filas.extend(apariciones[palabra].keys())
+        pesos.extend(apariciones[palabra].values())
+        inicios.append(len(filas))
+
+    textos = pd.Series(' ', index=etapas_df.index)
+    for columna in columnas.values():
+        textos = textos + columna.map(normalize_text) + ' '
+    return SearchIndex(etapas, etiquetas, palabras, np.array(inicios), np.array(filas, dtype=np.int64),
+                       np.array(pesos, dtype=float), textos.to_numpy(dtype=str))
+
+
+# Puntaje de cada etapa para un término: el mejor peso entre las palabras que empiezan con él (el doble si es la
+# palabra completa). Solo si ninguna palabra del índice empieza así se busca el término como subcadena en el texto de
+# cada etapa (SUBCADENA), que es un recorrido de toda la cartera
+def _term_scores(index, termino):
+    puntajes = np.zeros(len(index.etapas))
+    desde = bisect.bisect_left(index.palabras, termino)
+    hasta = bisect.bisect_left(index.palabras, termino + '\uffff')
+    if hasta > desde:
+        filas = index.filas[index.inicios[desde]:index.inicios[hasta]]
+        pesos = index.pesos[index.inicios[desde]:index.inicios[hasta]].copy()
+        if index.palabras[desde] == termino:
+            pesos[:index.inicios[desde + 1] - index.inicios[desde]] *= EXACTA
+        np.maximum.at(puntajes, filas, pesos)
+        return puntajes
+    # Sin prefijos en el índice: recorrer el texto de todas las etapas buscando el término como subcadena
+    en_texto = np.char.find(index.textos, termino) >= 0
+    return np.where(en_texto, SUBCADENA, 0.0)
+
+
+# Las mejores 'limite' etapas para la búsqueda, de mayor a menor puntaje: cada término debe coincidir con algún campo
+# y los puntajes de los términos se suman. Sin búsqueda se devuelven las primeras etapas en orden.
+def search(index, consulta, limite=MAX_RESULTADOS):
+    terminos = [t for t in _SEPARADORES.split(normalize_text(consulta or '')) if t]
+    if not terminos:
+        return list(index.etapas[:limite])
+
+    total = np.zeros(len(index.etapas))
+    coinciden = np.ones(len(index.etapas), dtype=bool)
+    for termino in terminos:
+        puntajes = _term_scores(index, termino)
+        coinciden &= puntajes > 0
+        total += puntajes
+    candidatas = np.flatnonzero(coinciden)
+    # Orden estable: a igual puntaje, el orden de IDEtapa
+    orden = candidatas[np.argsort(-total[candidatas], kind='stable')][:limite]
+    return list(index.etapas[orden])
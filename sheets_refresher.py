@@ -0,0 +1,222 @@
+import io
+import os
+import pickle
+import threading
+import time
+import urllib.request
+from collections import namedtuple
+from datetime import datetime
+
+from streamlit.logger import get_logger
+
+from utils import lazy_import
+
+pd = lazy_import('pandas')
+
+LOGGER = get_logger(__name__)
+
+# URLs de las hojas de Google Sheets (se pueden reemplazar por variables de entorno, p. ej. para un servidor local de pruebas)
+SHEET_URLS = {
+    'proyectos': os.environ.get('SHEET_URL_PROYECTOS', "https://docs.google.com/spreadsheets/d/e/2PACX-1vSHedheaRLyqnjwtsRvlBFFOnzhfarkFMoJ04chQbKZCBRZXh_2REE3cmsRC69GwsUK0PoOVv95xptX/pub?gid=2084477941&single=true&output=csv"),
+    'operaciones': os.environ.get('SHEET_URL_OPERACIONES', "https://docs.google.com/spreadsheets/d/e/2PACX-1vSHedheaRLyqnjwtsRvlBFFOnzhfarkFMoJ04chQbKZCBRZXh_2REE3cmsRC69GwsUK0PoOVv95xptX/pub?gid=1468153763&single=true&output=csv"),
+    'desembolsos': os.environ.get('SHEET_URL_DESEMBOLSOS', "https://docs.google.com/spreadsheets/d/e/2PACX-1vSHedheaRLyqnjwtsRvlBFFOnzhfarkFMoJ04chQbKZCBRZXh_2REE3cmsRC69GwsUK0PoOVv95xptX/pub?gid=1657640798&single=true&output=csv"),
+}
+
+REFRESH_SECONDS = float(os.environ.get('DESEMBOLSOS_REFRESH_SECONDS', 300))
+SNAPSHOT_DIR = os.environ.get('DESEMBOLSOS_SNAPSHOT_DIR')
+FETCH_TIMEOUT = 30
+
+# Última copia válida: hojas crudas, datasets procesados por cada página, hora de descarga y último error
+Snapshot = namedtuple('Snapshot', ['version', 'frames', 'datasets', 'fetched_at', 'error'])
+
+
+# Descarga una hoja publicada como CSV
+def fetch_csv(url, timeout=FETCH_TIMEOUT):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return pd.read_csv(io.BytesIO(response.read()))
+
+
+# Descarga periódica de las hojas fuera del ciclo de las páginas (stale-while-revalidate):
+# las páginas siempre leen la última copia válida y nunca esperan a Google Sheets, salvo la primera vez.
+class SheetsRefresher:
+    def __init__(self, urls=None, interval=REFRESH_SECONDS, snapshot_dir=SNAPSHOT_DIR, fetch=fetch_csv):
+        self.urls = dict(urls or SHEET_URLS)
+        self.interval = interval
+        self.snapshot_dir = snapshot_dir
+        self.fetch = fetch
+        self._builders = {}
+        self._build_errors = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._built = threading.Condition(self._lock)
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        self._builder_thread = None
+        self._snapshot = None
+        self._load_from_disk()
+
+    # Registra la función que arma el dataset procesado de una página a partir de las hojas crudas. Nunca lo arma en
+    # el hilo de quien llama: si la última copia todavía no lo tiene, queda pendiente y lo arma un hilo del
+    # actualizador sobre esa copia (pending() dice si todavía se está armando).
+    def register(self, name, builder):
+        with self._lock:
+            self._builders[name] = builder
+            if name not in self._pending and (self._snapshot is None or name not in self._snapshot.datasets):
+                self._pending.add(name)
+                self._wake.set()
+
+    # Si el dataset de la página todavía no se armó con la última copia
+    def pending(self, name):
+        with self._lock:
+            return name in self._pending
+
+    # Espera a que se arme el dataset de la página (o todos los pendientes, sin nombre); devuelve si ya no está pendiente
+    def wait_built(self, name=None, timeout=None):
+        with self._built:
+            return self._built.wait_for(lambda: name not in self._pending if name else not self._pending, timeout)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return self
+            self._thread = threading.Thread(target=self._run, name='sheets-refresher', daemon=True)
+            self._builder_thread = threading.Thread(target=self._run_builds, name='sheets-builder', daemon=True)
+        self._thread.start()
+        self._builder_thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    # Última copia válida; solo espera si todavía no hay ninguna
+    def snapshot(self, timeout=None):
+        if self._snapshot is None:
+            self._ready.wait(timeout)
+        return self._snapshot
+
+    def dataset(self, name, timeout=None):
+        snapshot = self.snapshot(timeout)
+        if snapshot is None:
+            return None
+        return snapshot.datasets.get(name)
+
+    # Descarga las hojas y reconstruye los datasets; si algo falla se conserva la copia anterior
+    def refresh(self):
+        try:
+            frames = {nombre: self.fetch(url) for nombre, url in self.urls.items()}
+        except Exception as e:
+            LOGGER.error("Error al actualizar las hojas de Google Sheets: " + str(e))
+            with self._lock:
+                if self._snapshot is not None:
+                    self._snapshot = self._snapshot._replace(error=str(e))
+            self._ready.set()
+            return False
+
+        with self._lock:
+            builders = dict(self._builders)
+            version = self._snapshot.version + 1 if self._snapshot is not None else 1
+        datasets = {nombre: self._build(nombre, builder, frames) for nombre, builder in builders.items()}
+        with self._lock:
+            self._snapshot = Snapshot(version, frames, datasets, datetime.now(), None)
+            # Los registrados mientras se armaba esta copia siguen pendientes y se arman enseguida
+            self._pending -= set(datasets)
+            if self._pending:
+                self._wake.set()
+            self._built.notify_all()
+        self._save_to_disk()
+        self._ready.set()
+        return True
+
+    # Arma los datasets pendientes sobre la última copia y los agrega a esa misma copia (sin cambiar su versión)
+    def _build_pending(self):
+        with self._lock:
+            self._wake.clear()
+            snapshot = self._snapshot
+            builders = {nombre: self._builders[nombre] for nombre in self._pending}
+        if snapshot is None or not builders:
+            return
+        datasets = {nombre: self._build(nombre, builder, snapshot.frames) for nombre, builder in builders.items()}
+        with self._lock:
+            # Si mientras tanto llegó una copia nueva, los que sigan pendientes se arman otra vez sobre ella
+            if self._snapshot.frames is snapshot.frames:
+                self._snapshot = self._snapshot._replace(datasets={**self._snapshot.datasets, **datasets})
+                self._pending -= set(datasets)
+            if self._pending:
+                self._wake.set()
+            self._built.notify_all()
+
+    def _build(self, name, builder, frames):
+        try:
+            dataset = builder({nombre: df.copy() for nombre, df in frames.items()})
+        except Exception as e:
+            LOGGER.error(f"Error al procesar el dataset '{name}': {e}")
+            with self._lock:
+                self._build_errors[name] = str(e)
+            return None
+        with self._lock:
+            self._build_errors.pop(name, None)
+        return dataset
+
+    # Motivo por el que no se pudo armar el dataset de una página con la última copia (None si se armó)
+    def build_error(self, name):
+        with self._lock:
+            return self._build_errors.get(name)
+
+    def _run(self):
+        while not self._stop.is_set():
+            inicio = time.monotonic()
+            self.refresh()
+            self._stop.wait(max(self.interval - (time.monotonic() - inicio), 1))
+
+    # Hilo que arma los datasets registrados tarde, también mientras el otro hilo descarga (p. ej. sobre la copia en
+    # disco después de un reinicio)
+    def _run_builds(self):
+        while not self._stop.is_set():
+            self._wake.wait()
+            self._build_pending()
+
+    # Copia en disco de las hojas crudas para servir datos inmediatamente después de un reinicio
+    def _snapshot_path(self):
+        return os.path.join(self.snapshot_dir, 'sheets_snapshot.pkl') if self.snapshot_dir else None
+
+    def _save_to_disk(self):
+        path = self._snapshot_path()
+        if path is None:
+            return
+        try:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            tmp = path + '.tmp'
+            with open(tmp, 'wb') as f:
+                pickle.dump({'frames': self._snapshot.frames, 'fetched_at': self._snapshot.fetched_at}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except OSError as e:
+            LOGGER.error("No se pudo guardar la copia de las hojas: " + str(e))
+
+    def _load_from_disk(self):
+        path = self._snapshot_path()
+        if path is None or not os.path.exists(path):
+            return
+        try:
+            with open(path, 'rb') as f:
+                guardado = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            LOGGER.error("No se pudo leer la copia de las hojas: " + str(e))
+            return
+        self._snapshot = Snapshot(0, guardado['frames'], {}, guardado['fetched_at'], None)
+        self._ready.set()
+
+
+_refresher = None
+_refresher_lock = threading.Lock()
+
+
+# Instancia compartida por todas las sesiones del servidor
+def get_refresher():
+    global _refresher
+    with _refresher_lock:
+        if _refresher is None:
+            _refresher = SheetsRefresher().start()
+        return _refresher
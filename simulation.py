@@ -0,0 +1,227 @@
+from collections import namedtuple
+import functools
+import os
+
+import core
+from pools import SpawnPool
+from utils import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Escenarios por bloque: cada bloque tiene su propia semilla, así el resultado no depende de cuántos procesos haya
+ESCENARIOS_POR_BLOQUE = 250
+
+# Por debajo de estas celdas (escenarios x proyectos x años) arrancar procesos cuesta más que simular en serie
+MIN_CELDAS_PARALELO = 20_000_000
+MAX_WORKERS = 4
+
+# Observaciones mínimas de un país x sector y edad para muestrear de ellas; con menos se usa toda la cartera
+MIN_MUESTRA = 5
+
+# Edad máxima (años calendario desde la vigencia) con muestra propia; las edades mayores usan la de esta edad
+EDAD_MAXIMA = 15
+
+# Saldo mínimo (fracción del aporte) para considerar que una etapa todavía tiene desembolsos pendientes
+SALDO_MINIMO = 0.01
+
+PERCENTILES = (10, 50, 90)
+
+# Muestras históricas y cartera activa listas para simular, todo en arreglos:
+#   valores: fracción del saldo desembolsada en un año calendario, agrupada por muestra (inicio, largo de cada una)
+#   muestra_de: (grupo, edad) -> muestra que se usa, ya resueltas las muestras chicas (última fila: toda la cartera)
+#   grupo, edad, saldo, pais de cada etapa activa; fraccion_inicial: parte del año de corte que todavía falta
+CashFlowModel = namedtuple('CashFlowModel', ['valores', 'inicio', 'largo', 'muestra_de', 'grupo', 'edad', 'saldo', 'pais',
+                                             'paises', 'anos', 'fraccion_inicial'])
+
+# Resultado: flujos simulados escenario x país x año (millones), saldo inicial y cantidad de etapas activas
+CashFlowSimulation = namedtuple('CashFlowSimulation', ['flujos', 'paises', 'anos', 'saldo', 'etapas'])
+
+# Pool de procesos de la simulación, compartido por todas las sesiones
+_pool = SpawnPool(MAX_WORKERS)
+
+
+# Una fila por etapa con aporte, año de vigencia, país y sector ('Sin ...' cuando faltan)
+def _stage_attributes(etapas):
+    etapas = etapas.drop_duplicates(subset='IDEtapa').set_index('IDEtapa')
+    return pd.DataFrame({
+        'Aporte': etapas[core.APORTE].astype(float),
+        'Vigencia': etapas['FechaVigencia'].dt.year,
+        'Pais': core.country_name(etapas['Pais'].fillna('Sin País').astype(str)),
+        'Sector': etapas[core.SECTOR].fillna('Sin Sector').astype(str) if core.SECTOR in etapas.columns else 'Sin Sector',
+        'Activa': (etapas['Estado'].astype(str).str.strip().str.lower() == 'vigente') if 'Estado' in etapas.columns else True,
+    })
+
+
+# Arma el modelo a la fecha de corte. Para cada etapa y año calendario ya cerrado se mide qué fracción de su saldo al
+# comenzar el año desembolsó en ese año; esas fracciones, agrupadas por país x sector y edad de la etapa (años desde la
+# vigencia), son las muestras de las que se sortea el año de cada etapa activa.
+def build_model(desembolsos, etapas, fecha_corte, anos=10):
+    fecha_corte = pd.Timestamp(fecha_corte)
+    desembolsos = core.filter_as_of(desembolsos, fecha_corte)
+    atributos = _stage_attributes(etapas)
+    atributos = atributos[(atributos['Aporte'] > 0) & atributos['Vigencia'].notna()]
+    n_etapas = len(atributos)
+    fila = pd.Series(np.arange(n_etapas), index=atributos.index)
+    vigencia = atributos['Vigencia'].to_numpy(dtype=np.int64)
+    aporte = atributos['Aporte'].to_numpy()
+
+    # Monto por etapa y edad (año calendario del desembolso - año de vigencia)
+    datos = desembolsos[desembolsos['IDEtapa'].isin(atributos.index) & desembolsos['FechaEfectiva'].notna()]
+    filas = fila[datos['IDEtapa']].to_numpy()
+    edades = np.clip(datos['FechaEfectiva'].dt.year.to_numpy() - vigencia[filas], 0, None)
+    n_edades = max(int(edades.max()) + 1 if len(edades) else 0, EDAD_MAXIMA + 1)
+    montos = np.bincount(filas * n_edades + edades, weights=datos['Monto'].fillna(0).to_numpy(dtype=float),
+                         minlength=n_etapas * n_edades).reshape(n_etapas, n_edades)
+
+    # Fracción del saldo al comenzar cada año; solo cuentan los años cerrados con saldo pendiente
+    saldo_inicio = aporte[:, None] - np.concatenate([np.zeros((n_etapas, 1)), np.cumsum(montos, axis=1)[:, :-1]], axis=1)
+    cerrado = vigencia[:, None] + np.arange(n_edades)[None, :] < fecha_corte.year
+    pendiente = saldo_inicio > SALDO_MINIMO * aporte[:, None]
+    observada = cerrado & pendiente
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fracciones = np.clip(montos / saldo_inicio, 0.0, 1.0)
+
+    # Muestras por (grupo, edad); las edades mayores a EDAD_MAXIMA se juntan en la última
+    grupos, grupo_idx = np.unique(atributos['Pais'] + ' | ' + atributos['Sector'], return_inverse=True)
+    n_grupos = len(grupos)
+    obs_etapa, obs_edad = np.nonzero(observada)
+    obs_edad = np.minimum(obs_edad, EDAD_MAXIMA)
+    obs_valor = fracciones[obs_etapa, obs_edad]
+    if len(obs_valor) == 0:
+        raise ValueError("No hay años cerrados con desembolsos de los que tomar muestras")
+    # Cada observación entra en la muestra de su grupo y en la de toda la cartera (grupo n_grupos)
+    clave = np.concatenate([grupo_idx[obs_etapa] * (EDAD_MAXIMA + 1) + obs_edad, n_grupos * (EDAD_MAXIMA + 1) + obs_edad])
+    valores = np.concatenate([obs_valor, obs_valor])
+    orden = np.argsort(clave, kind='stable')
+    clave, valores = clave[orden], valores[orden]
+    n_muestras = (n_grupos + 1) * (EDAD_MAXIMA + 1)
+    largo = np.bincount(clave, minlength=n_muestras)
+    inicio = np.concatenate([[0], np.cumsum(largo)[:-1]])
+
+    # Muestras chicas: toda la cartera a esa edad; si tampoco hay, la edad anterior más cercana con datos
+    muestra_de = np.arange(n_muestras).reshape(n_grupos + 1, EDAD_MAXIMA + 1)
+    cartera = muestra_de[n_grupos].copy()
+    for edad in range(EDAD_MAXIMA + 1):
+        if largo[cartera[edad]] == 0:
+            cartera[edad] = cartera[edad - 1] if edad > 0 else -1
+    for edad in range(EDAD_MAXIMA, -1, -1):
+        if cartera[edad] == -1:
+            cartera[edad] = cartera[edad + 1]
+    muestra_de = np.where(largo[muestra_de] >= MIN_MUESTRA, muestra_de, cartera[None, :])
+
+    # Etapas activas: con saldo pendiente a la fecha de corte (y 'Vigente' cuando la hoja trae el estado)
+    saldo = aporte - montos.sum(axis=1)
+    activa = (saldo > SALDO_MINIMO * aporte) & atributos['Activa'].to_numpy(dtype=bool) & (vigencia <= fecha_corte.year)
+    paises, pais_idx = np.unique(atributos['Pais'].to_numpy()[activa], return_inverse=True)
+    edad_actual = np.minimum(fecha_corte.year - vigencia[activa], EDAD_MAXIMA)
+
+    # El primer año simulado es el resto del año de la fecha de corte
+    fraccion_inicial = 1.0 - (fecha_corte.dayofyear / (366 if fecha_corte.is_leap_year else 365))
+    anos = np.arange(fecha_corte.year, fecha_corte.year + anos)
+    return CashFlowModel(valores, inicio, largo, muestra_de, grupo_idx[activa], edad_actual, saldo[activa], pais_idx,
+                         paises, anos, fraccion_inicial)
+
+
+# Simula 'escenarios' trayectorias de todas las etapas activas a la vez: en cada año se sortea para cada escenario y
+# etapa una fracción de su muestra (país x sector y edad) y se desembolsa esa fracción del saldo. Devuelve los montos
+# escenario x país x año.
+def simulate(model, escenarios, semilla):
+    rng = np.random.default_rng(semilla)
+    n_anos = len(model.anos)
+    saldo = np.broadcast_to(model.saldo, (escenarios, len(model.saldo))).copy()
+    por_pais = np.zeros((len(model.saldo), len(model.paises)))
+    por_pais[np.arange(len(model.saldo)), model.pais] = 1.0
+    flujos = np.empty((escenarios, len(model.paises), n_anos))
+    for j in range(n_anos):
+        muestra = model.muestra_de[model.grupo, np.minimum(model.edad + j, EDAD_MAXIMA)]
+        sorteo = (rng.random(saldo.shape) * model.largo[muestra]).astype(np.int64)
+        fraccion = model.valores[model.inicio[muestra] + sorteo]
+        if j == 0:
+            fraccion = fraccion * model.fraccion_inicial
+        monto = fraccion * saldo
+        saldo -= monto
+        flujos[:, :, j] = monto @ por_pais
+    return flujos
+
+
+# Se ejecuta en los procesos del pool, que solo cargan NumPy y pandas
+def _simulate_chunk(args):
+    model, escenarios, semilla = args
+    return simulate(model, escenarios, semilla)
+
+
+# Simula en bloques de ESCENARIOS_POR_BLOQUE con semillas derivadas de 'semilla' (mismo resultado en serie o en
+# paralelo); los bloques se reparten en el pool de procesos cuando el volumen lo justifica
+def simulate_parallel(model, escenarios, semilla=0, max_workers=None):
+    tamanos = [min(ESCENARIOS_POR_BLOQUE, escenarios - i) for i in range(0, escenarios, ESCENARIOS_POR_BLOQUE)]
+    semillas = np.random.SeedSequence(semilla).spawn(len(tamanos))
+    bloques = [(model, n, s) for n, s in zip(tamanos, semillas)]
+    workers = min(len(bloques), max_workers or os.cpu_count() or 1, MAX_WORKERS)
+
+    if workers > 1 and escenarios * len(model.saldo) * len(model.anos) >= MIN_CELDAS_PARALELO:
+        flujos = _pool.map(_simulate_chunk, bloques)
+        if flujos is not None:
+            return np.concatenate(flujos)
+    return np.concatenate([_simulate_chunk(bloque) for bloque in bloques])
+
+
+# Modelo y simulación completos a la fecha de corte (por defecto la del último desembolso)
+def simulate_cash_flows(desembolsos, etapas, fecha_corte=None, escenarios=2000, anos=10, semilla=0):
+    if fecha_corte is None:
+        fecha_corte = core.as_of_date(desembolsos)
+    model = build_model(desembolsos, etapas, fecha_corte, anos)
+    flujos = simulate_parallel(model, escenarios, semilla) / 1e6
+    return CashFlowSimulation(flujos, model.paises, model.anos, float(model.saldo.sum()) / 1e6, len(model.saldo))
+
+
+# P10/P50/P90 y media del flujo anual de la cartera (millones) por año
+def annual_percentiles(simulacion):
+    total = simulacion.flujos.sum(axis=1)
+    tabla = pd.DataFrame(np.percentile(total, PERCENTILES, axis=0).T, columns=[f'P{p}' for p in PERCENTILES])
+    tabla.insert(0, 'Año', simulacion.anos)
+    tabla['Media'] = total.mean(axis=0)
+    tabla['P50 Acumulado'] = np.percentile(np.cumsum(total, axis=1), 50, axis=0)
+    return tabla.round(2)
+
+
+# Los mismos percentiles para cada país (cada país con sus propios escenarios; no suman el total de la cartera)
+def country_percentiles(simulacion):
+    valores = np.percentile(simulacion.flujos, PERCENTILES, axis=0)
+    n_paises, n_anos = valores.shape[1:]
+    tabla = pd.DataFrame({
+        'Pais': np.repeat(simulacion.paises, n_anos),
+        'Año': np.tile(simulacion.anos, n_paises),
+        **{f'P{p}': valores[i].ravel() for i, p in enumerate(PERCENTILES)},
+    })
+    return tabla.round(2)
+
+
+# Constructor del dataset para el actualizador: desembolsos y etapas de la cartera publicada en Google Sheets
+def build_dataset(frames):
+    return core.from_sheets(frames)
+
+
+def _simulate_cached(_desembolsos, _etapas, version, fecha_corte, escenarios, anos, semilla):
+    import metrics
+
+    metrics.cache_miss('cash_flows')
+    return simulate_cash_flows(_desembolsos, _etapas, fecha_corte, escenarios, anos, semilla)
+
+
+@functools.lru_cache(maxsize=None)
+def _cached_simulation():
+    import streamlit as st
+
+    return st.cache_data(max_entries=16, show_spinner=False)(_simulate_cached)
+
+
+# Simulación por versión del dataset, fecha de corte y parámetros, compartida entre sesiones
+def load_cash_flows(desembolsos, etapas, version, fecha_corte=None, escenarios=2000, anos=10, semilla=0):
+    # Los procesos del pool importan este módulo sin Streamlit: las métricas se cargan solo aquí
+    import metrics
+
+    metrics.cache_call('cash_flows')
+    if fecha_corte is None:
+        fecha_corte = core.as_of_date(desembolsos)
+    return _cached_simulation()(desembolsos, etapas, version, pd.Timestamp(fecha_corte), escenarios, anos, semilla)
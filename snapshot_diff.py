@@ -0,0 +1,105 @@
+from collections import namedtuple
+
+from joins import build_dimension
+from utils import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Tipos de cambio entre dos cortes
+NUEVO = 'Nuevo'
+ELIMINADO = 'Eliminado'
+MODIFICADO = 'Modificado'
+CAMBIOS = (NUEVO, ELIMINADO, MODIFICADO)
+
+# Sufijo de las columnas del corte anterior en las tablas de cambios
+ANTERIOR = ' (anterior)'
+
+# Clave de un desembolso en los dos formatos del libro y columnas que se comparan
+CLAVE_DESEMBOLSO = ['IDEtapa', 'IDDesembolso']
+COLUMNAS_DESEMBOLSO = ['Monto', 'FechaEfectiva']
+
+# Diff por clave: una fila por clave nueva, eliminada o modificada y la cantidad de cada tipo
+KeyedDiff = namedtuple('KeyedDiff', ['cambios', 'conteos'])
+
+
+# Huella de 64 bits de cada fila calculada sobre 'columns' (vectorizada: no compara celda a celda)
+def row_hashes(df, columns):
+    return pd.array(pd.util.hash_pandas_object(df[columns], index=False).to_numpy(), dtype='UInt64')
+
+
+# Compara dos cortes por clave en tiempo lineal: cada corte queda con una fila por clave y la huella de sus valores,
+# y un solo merge por hash de la clave separa las filas nuevas, las eliminadas y las que cambiaron de huella.
+# Solo en estas últimas se buscan las columnas que cambiaron. Las claves repetidas se reportan como en los merges.
+def keyed_diff(antes, despues, key, columns, reports=None):
+    key = [key] if isinstance(key, str) else list(key)
+    columns = [c for c in columns if c in antes.columns and c in despues.columns and c not in key]
+    a = build_dimension(antes, key, columns=columns, name='Corte anterior', reports=reports)
+    b = build_dimension(despues, key, columns=columns, name='Corte actual', reports=reports)
+    a = a.assign(_huella=row_hashes(a, columns))
+    b = b.assign(_huella=row_hashes(b, columns))
+
+    unido = a.merge(b, on=key, how='outer', suffixes=(ANTERIOR, ''), indicator=True, validate='one_to_one')
+    cambio = np.select(
+        [unido['_merge'].eq('right_only'), unido['_merge'].eq('left_only'),
+         unido['_huella' + ANTERIOR].ne(unido['_huella']).fillna(False).astype(bool)],
+        [NUEVO, ELIMINADO, MODIFICADO], default='')
+    unido = unido.assign(Cambio=cambio)
+    unido = unido[unido['Cambio'] != ''].reset_index(drop=True)
+
+    salida = key + ['Cambio']
+    distintas = {}
+    for c in columns:
+        previo, actual = unido[c + ANTERIOR], unido[c]
+        distintas[c] = previo.ne(actual) & (previo.notna() | actual.notna())
+        salida += [c + ANTERIOR, c]
+        if pd.api.types.is_numeric_dtype(actual) and pd.api.types.is_numeric_dtype(previo):
+            unido[f'Diferencia {c}'] = actual.fillna(0) - previo.fillna(0)
+            salida.append(f'Diferencia {c}')
+    # Nombres de las columnas distintas de cada fila: producto de la matriz booleana por los nombres terminados en ', '
+    if columns:
+        nombres = pd.DataFrame(distintas, index=unido.index).dot(pd.Series([f'{c}, ' for c in columns], index=columns))
+        unido['Columnas Modificadas'] = np.where(unido['Cambio'] == MODIFICADO, nombres.str[:-2], '')
+    else:
+        unido['Columnas Modificadas'] = ''
+
+    cambios = unido[salida + ['Columnas Modificadas']]
+    conteos = cambios['Cambio'].value_counts().reindex(CAMBIOS, fill_value=0)
+    return KeyedDiff(cambios, conteos)
+
+
+# Desembolsos nuevos, eliminados y con 'Monto' o 'FechaEfectiva' modificados entre dos libros normalizados (core.Dataset)
+def disbursement_changes(antes, despues, reports=None):
+    faltantes = [c for c in CLAVE_DESEMBOLSO if c not in antes.desembolsos.columns or c not in despues.desembolsos.columns]
+    if faltantes:
+        raise ValueError(f"Los libros no tienen la clave de los desembolsos: falta {', '.join(faltantes)}")
+    return keyed_diff(antes.desembolsos, despues.desembolsos, CLAVE_DESEMBOLSO, COLUMNAS_DESEMBOLSO, reports)
+
+
+# Etapas que cambiaron de categoría (incluidas las que aparecen o desaparecen) y la matriz de movimientos entre categorías
+def category_changes(final_antes, final_despues):
+    diff = keyed_diff(final_antes, final_despues, 'IDEtapa', ['Categoría', 'Total'])
+    cambios = diff.cambios
+    cambios = cambios[cambios['Categoría' + ANTERIOR].ne(cambios['Categoría'])].drop(columns='Columnas Modificadas')
+    movimientos = pd.crosstab(
+        cambios['Categoría' + ANTERIOR].fillna('(sin etapa)').rename('Categoría Anterior'),
+        cambios['Categoría'].fillna('(sin etapa)').rename('Categoría Actual'),
+    )
+    return cambios.reset_index(drop=True), movimientos
+
+
+# Diferencia celda a celda entre dos matrices por IDEtapa y periodo (actual - anterior); las filas y periodos que
+# faltan en un corte cuentan como cero. Solo quedan las etapas con alguna celda distinta.
+def delta_matrix(antes, despues, decimales=3):
+    delta = despues.sub(antes, fill_value=0).fillna(0).round(decimales)
+    periodos = sorted(c for c in delta.columns if c != 'Total')
+    delta = delta[periodos + (['Total'] if 'Total' in delta.columns else [])]
+    distintas = delta[periodos].ne(0)
+    return delta[distintas.any(axis=1)], int(distintas.to_numpy().sum())
+
+
+# Matrices de montos y porcentajes de cambio con la cantidad de celdas distintas de cada una
+def delta_matrices(pivots_antes, pivots_despues):
+    (montos, celdas_montos), (porcentajes, celdas_porcentajes) = (
+        delta_matrix(a, d) for a, d in zip(pivots_antes, pivots_despues))
+    return montos, porcentajes, celdas_montos, celdas_porcentajes
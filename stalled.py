@@ -0,0 +1,270 @@
+from collections import namedtuple
+import functools
+import threading
+
+from bucketing import elapsed_months
+import core
+import metrics
+from utils import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Señales de alerta: meses sin desembolsar, veces el intervalo medio de la propia etapa y puntos porcentuales por
+# debajo de la curva de su sector a la misma edad
+MESES_SIN_DESEMBOLSO = 12
+VECES_INTERVALO = 3.0
+PUNTOS_BRECHA = 20.0
+
+# Etapas mínimas de un sector a una edad para usar su curva; con menos se usa la de toda la cartera
+MIN_MUESTRA = 5
+
+# Saldo mínimo (fracción del aporte) para considerar que una etapa todavía tiene desembolsos pendientes
+SALDO_MINIMO = 0.01
+
+_DIAS_MES = 365.25 / 12
+_SIN_FECHA = 'NaT'
+
+# Resumen de los desembolsos de cada etapa (IDEtapa ordenados), suficiente para evaluar las alertas y para sumarle
+# desembolsos nuevos sin volver a leer los anteriores: cantidad, primera y última fecha, intervalo más largo entre dos
+# desembolsos (días), monto total y montos por año calendario a partir de 'ano_inicial'
+Aggregates = namedtuple('Aggregates', ['etapas', 'cantidad', 'primera', 'ultima', 'max_intervalo', 'total',
+                                       'ano_inicial', 'montos_ano'])
+
+# Estado incremental de una fuente: resumen de sus primeras 'filas' filas y su huella para reconocerlas
+StallState = namedtuple('StallState', ['agregados', 'filas', 'huella'])
+
+_estados = {}
+_estados_lock = threading.Lock()
+
+
+def _empty():
+    return Aggregates(np.array([], dtype=object), np.zeros(0, dtype=np.int64), np.array([], dtype='datetime64[D]'),
+                      np.array([], dtype='datetime64[D]'), np.zeros(0), np.zeros(0), 0, np.zeros((0, 0)))
+
+
+# Resume un bloque de desembolsos con operaciones agrupadas sobre el arreglo ordenado por (IDEtapa, FechaEfectiva):
+# cada etapa es un tramo contiguo y sus intervalos son las diferencias entre fechas vecinas del mismo tramo.
+# Los desembolsos sin fecha no se pueden ubicar en el tiempo y no cuentan.
+def aggregate(desembolsos):
+    datos = desembolsos[desembolsos['FechaEfectiva'].notna()]
+    if datos.empty:
+        return _empty()
+    ids = datos['IDEtapa'].astype(str).to_numpy(dtype=object)
+    fechas = datos['FechaEfectiva'].to_numpy(dtype='datetime64[D]')
+    montos = datos['Monto'].fillna(0).to_numpy(dtype=float)
+    orden = np.lexsort((fechas, ids))
+    ids, fechas, montos = ids[orden], fechas[orden], montos[orden]
+
+    etapas, inicio, fila = np.unique(ids, return_index=True, return_inverse=True)
+    fin = np.append(inicio[1:], len(ids))
+    # Intervalo hasta el desembolso siguiente de la misma etapa; el último de cada tramo queda en 0
+    intervalos = np.append(np.where(ids[1:] == ids[:-1], (fechas[1:] - fechas[:-1]).astype(np.int64), 0), 0)
+
+    anos = fechas.astype('datetime64[Y]').astype(np.int64) + 1970
+    ano_inicial = int(anos.min())
+    n_anos = int(anos.max()) - ano_inicial + 1
+    montos_ano = np.bincount(fila * n_anos + anos - ano_inicial, weights=montos,
+                             minlength=len(etapas) * n_anos).reshape(len(etapas), n_anos)
+    return Aggregates(etapas, fin - inicio, fechas[inicio], fechas[fin - 1],
+                      np.maximum.reduceat(intervalos, inicio).astype(float), np.add.reduceat(montos, inicio),
+                      ano_inicial, montos_ano)
+
+
+# Resumen de la unión de dos bloques, el segundo con desembolsos posteriores a los del primero en cada etapa
+def merge(a, b):
+    etapas = np.union1d(a.etapas, b.etapas).astype(object)
+    ia, ib = np.searchsorted(etapas, a.etapas), np.searchsorted(etapas, b.etapas)
+    n = len(etapas)
+
+    cantidad = np.zeros(n, dtype=np.int64)
+    cantidad[ia] += a.cantidad
+    cantidad[ib] += b.cantidad
+    primera = np.full(n, _SIN_FECHA, dtype='datetime64[D]')
+    primera[ib] = b.primera
+    primera[ia] = a.primera
+    ultima = np.full(n, _SIN_FECHA, dtype='datetime64[D]')
+    ultima[ia] = a.ultima
+    ultima[ib] = b.ultima
+    total = np.zeros(n)
+    total[ia] += a.total
+    total[ib] += b.total
+
+    # El intervalo más largo puede ser el que separa el último desembolso anterior del primero nuevo
+    anterior = np.full(n, _SIN_FECHA, dtype='datetime64[D]')
+    anterior[ia] = a.ultima
+    puente = np.zeros(n)
+    puente[ib] = np.where(np.isnat(anterior[ib]), 0, (b.primera - anterior[ib]).astype(np.int64))
+    max_intervalo = puente
+    max_intervalo[ia] = np.maximum(max_intervalo[ia], a.max_intervalo)
+    max_intervalo[ib] = np.maximum(max_intervalo[ib], b.max_intervalo)
+
+    anos = [x for x in (a, b) if x.montos_ano.size]
+    ano_inicial = min(x.ano_inicial for x in anos) if anos else 0
+    ano_final = max(x.ano_inicial + x.montos_ano.shape[1] for x in anos) if anos else 0
+    montos_ano = np.zeros((n, ano_final - ano_inicial))
+    for x, filas in ((a, ia), (b, ib)):
+        if x.montos_ano.size:
+            desde = x.ano_inicial - ano_inicial
+            montos_ano[filas, desde:desde + x.montos_ano.shape[1]] += x.montos_ano
+    return Aggregates(etapas, cantidad, primera, ultima, max_intervalo, total, ano_inicial, montos_ano)
+
+
+# Huella de cada fila que entra en el resumen: si el inicio de la hoja no cambió, solo hay que sumar las filas nuevas
+def _row_hashes(desembolsos):
+    columnas = [c for c in ('IDEtapa', 'FechaEfectiva', 'Monto') if c in desembolsos.columns]
+    return pd.util.hash_pandas_object(desembolsos[columnas], index=False).to_numpy()
+
+
+# Resumen de todos los desembolsos de una fuente reutilizando el de la copia anterior: cuando la hoja solo agregó
+# filas al final, y todas son posteriores a los desembolsos ya vistos de su etapa, se resumen solo esas filas.
+# Si cambió o se borró alguna fila anterior se vuelve a resumir todo.
+def update_state(estado, desembolsos):
+    n = len(desembolsos)
+    huellas = _row_hashes(desembolsos)
+    huella = int(huellas.sum(dtype=np.uint64))
+    if estado is not None and estado.filas <= n and int(huellas[:estado.filas].sum(dtype=np.uint64)) == estado.huella:
+        nuevas = desembolsos.iloc[estado.filas:]
+        parcial = aggregate(nuevas)
+        previas = estado.agregados
+        posicion = np.searchsorted(previas.etapas, parcial.etapas)
+        conocida = posicion < len(previas.etapas)
+        conocida[conocida] = previas.etapas[posicion[conocida]] == parcial.etapas[conocida]
+        if not (parcial.primera[conocida] < previas.ultima[posicion[conocida]]).any():
+            metrics.update_mode('stalled', incremental=True)
+            return StallState(merge(previas, parcial), n, huella)
+    metrics.update_mode('stalled', incremental=False)
+    return StallState(aggregate(desembolsos), n, huella)
+
+
+# Resumen de la fuente (p. ej. la cartera de Google Sheets) actualizado con la copia actual
+def incremental_aggregates(fuente, desembolsos):
+    with _estados_lock:
+        estado = update_state(_estados.get(fuente), desembolsos)
+        _estados[fuente] = estado
+    return estado.agregados
+
+
+# Valores del resumen en el orden de 'posicion' (-1: etapa sin desembolsos, toma 'vacio')
+def _align(valores, posicion, vacio):
+    salida = np.full(len(posicion), vacio, dtype=valores.dtype)
+    salida[posicion >= 0] = valores[posicion[posicion >= 0]]
+    return salida
+
+
+# Porcentaje acumulado esperado de cada sector al cierre de cada edad (años calendario desde la vigencia): mediana de
+# las etapas del sector que ya cerraron esa edad a la fecha de corte (la de toda la cartera si son menos de MIN_MUESTRA)
+def sector_curves(acumulado, sector, observada):
+    curvas = pd.DataFrame(np.where(observada, acumulado, np.nan))
+    cartera = curvas.median()
+    por_sector = curvas.groupby(sector).median()
+    suficientes = curvas.notna().groupby(sector).sum() >= MIN_MUESTRA
+    return por_sector.where(suficientes, cartera, axis=1).fillna(0)
+
+
+# Evalúa todas las etapas activas a la fecha de corte y devuelve las que tienen alguna señal, de mayor a menor
+# cantidad de señales y, a igual cantidad, por saldo pendiente
+def stalled_projects(agregados, etapas, fecha_corte):
+    fecha_corte = pd.Timestamp(fecha_corte).normalize()
+    columnas = [c for c in ('IDEtapa', 'Pais', core.SECTOR, core.APORTE, 'FechaVigencia') if c in etapas.columns]
+    atributos = etapas[columnas].drop_duplicates(subset='IDEtapa').set_index('IDEtapa')
+    atributos = atributos[(atributos[core.APORTE] > 0) & atributos['FechaVigencia'].notna()
+                          & (atributos['FechaVigencia'] <= fecha_corte)]
+    sector = (atributos[core.SECTOR].fillna('Sin Sector').astype(str) if core.SECTOR in atributos.columns
+              else pd.Series('Sin Sector', index=atributos.index)).to_numpy()
+    aporte = atributos[core.APORTE].to_numpy(dtype=float)
+    vigencia = atributos['FechaVigencia'].to_numpy(dtype='datetime64[D]')
+    ano_vigencia = vigencia.astype('datetime64[Y]').astype(np.int64) + 1970
+
+    # Resumen alineado con las etapas (las que nunca desembolsaron quedan sin fechas y en cero)
+    posicion = pd.Index(agregados.etapas).get_indexer(atributos.index)
+    tiene = posicion >= 0
+    cantidad = _align(agregados.cantidad, posicion, 0)
+    total = _align(agregados.total, posicion, 0.0)
+    primera = _align(agregados.primera, posicion, _SIN_FECHA)
+    ultima = _align(agregados.ultima, posicion, _SIN_FECHA)
+    max_intervalo = _align(agregados.max_intervalo, posicion, np.nan)
+
+    # Porcentaje acumulado al cierre de cada edad: acumulado por año calendario leído desde el año de vigencia
+    n_edades = int(fecha_corte.year - ano_vigencia.min()) + 1 if len(atributos) else 1
+    edades = np.arange(n_edades)
+    acumulado = np.zeros((len(atributos), n_edades))
+    if agregados.montos_ano.size:
+        acumulado_ano = np.concatenate([np.zeros((len(agregados.etapas), 1)), np.cumsum(agregados.montos_ano, axis=1)], axis=1)
+        columna = np.clip(ano_vigencia[tiene, None] + edades[None, :] - agregados.ano_inicial + 1, 0, acumulado_ano.shape[1] - 1)
+        acumulado[tiene] = acumulado_ano[posicion[tiene, None], columna] / aporte[tiene, None] * 100
+    curvas = sector_curves(acumulado, sector, ano_vigencia[:, None] + edades[None, :] < fecha_corte.year)
+
+    # Edad cerrada de cada etapa: el porcentaje de hoy debería alcanzar al menos el esperado al cierre del año anterior
+    edad_cerrada = fecha_corte.year - ano_vigencia - 1
+    esperado = np.where(edad_cerrada >= 0,
+                        curvas.to_numpy()[curvas.index.get_indexer(sector), np.clip(edad_cerrada, 0, n_edades - 1)], 0.0)
+    desembolsado = total / aporte * 100
+
+    # Tiempo sin desembolsar (desde la vigencia si nunca desembolsó) frente al intervalo medio de la etapa; con menos
+    # de dos desembolsos se toma la mediana de los intervalos medios de su sector
+    corte = np.datetime64(fecha_corte.date(), 'D')
+    desde = np.where(np.isnat(ultima), vigencia, ultima)
+    dias_sin = (corte - desde).astype(np.int64)
+    intervalo = pd.Series(np.where(cantidad > 1, (ultima - primera).astype('timedelta64[D]').astype(float)
+                                   / np.maximum(cantidad - 1, 1), np.nan))
+    intervalo = intervalo.fillna(intervalo.groupby(sector).transform('median')).fillna(intervalo.median()).to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        veces = np.where(intervalo > 0, dias_sin / intervalo, np.nan)
+
+    tabla = pd.DataFrame({
+        'IDEtapa': atributos.index,
+        'Pais': atributos['Pais'].to_numpy() if 'Pais' in atributos.columns else atributos.index.str[:2],
+        'Sector': sector,
+        'Último Desembolso': pd.to_datetime(ultima),
+        'Meses sin Desembolso': elapsed_months(desde, np.full(len(desde), corte)),
+        'Intervalo Medio (meses)': intervalo / _DIAS_MES,
+        'Veces el Intervalo': veces,
+        'Intervalo Máximo (meses)': np.where(cantidad > 1, max_intervalo, np.nan) / _DIAS_MES,
+        'Desembolsado': desembolsado,
+        'Esperado Sector': esperado,
+        'Brecha': np.maximum(esperado - desembolsado, 0),
+        'Saldo (millones)': (aporte - total) / 1e6,
+    })
+    tabla = tabla[tabla['Saldo (millones)'] * 1e6 > SALDO_MINIMO * aporte]
+    tabla['Señales'] = ((tabla['Meses sin Desembolso'] >= MESES_SIN_DESEMBOLSO).astype(int)
+                        + (tabla['Veces el Intervalo'] >= VECES_INTERVALO).astype(int)
+                        + (tabla['Brecha'] >= PUNTOS_BRECHA).astype(int))
+    tabla = tabla[tabla['Señales'] > 0].sort_values(['Señales', 'Saldo (millones)'], ascending=False)
+    numericas = tabla.select_dtypes('number').columns
+    return tabla.assign(**tabla[numericas].round(2)).reset_index(drop=True)
+
+
+# Alertas a la fecha de corte (por defecto la del último desembolso). Con 'fuente' y la fecha por defecto, el resumen
+# de los desembolsos se actualiza de forma incremental entre copias de la misma fuente.
+def stalled_alerts(desembolsos, etapas, fecha_corte=None, fuente=None):
+    ultima = core.as_of_date(desembolsos)
+    if fecha_corte is None or pd.isna(fecha_corte):
+        fecha_corte = ultima
+    if pd.isna(fecha_corte):
+        return stalled_projects(_empty(), etapas, pd.Timestamp.now().normalize())
+    if fuente is not None and pd.Timestamp(fecha_corte) >= ultima:
+        agregados = incremental_aggregates(fuente, desembolsos)
+    else:
+        agregados = aggregate(core.filter_as_of(desembolsos, fecha_corte))
+    return stalled_projects(agregados, etapas, fecha_corte)
+
+
+def _stalled_alerts_cached(_desembolsos, _etapas, version, fecha_corte, fuente):
+    metrics.cache_miss('stalled_alerts')
+    return stalled_alerts(_desembolsos, _etapas, fecha_corte, fuente)
+
+
+@functools.lru_cache(maxsize=None)
+def _cached_alerts():
+    import streamlit as st
+
+    return st.cache_data(max_entries=32, show_spinner=False)(_stalled_alerts_cached)
+
+
+# Alertas por versión del dataset y fecha de corte, compartidas entre sesiones
+def load_stalled_alerts(desembolsos, etapas, version, fecha_corte=None, fuente=None):
+    metrics.cache_call('stalled_alerts')
+    if fecha_corte is None:
+        fecha_corte = core.as_of_date(desembolsos)
+    return _cached_alerts()(desembolsos, etapas, version, pd.Timestamp(fecha_corte), fuente)
@@ -0,0 +1,118 @@
+import functools
+import io
+import itertools
+import os
+
+import core
+import metrics
+from utils import lazy_import
+from workbook import read_sheets, workbook_bytes
+
+pd = lazy_import('pandas')
+
+# Filas de desembolsos por bloque; la memoria máxima depende de esto, de las dimensiones y de los agregados
+CHUNK_ROWS = 200_000
+
+# Libros subidos desde este tamaño se agregan por bloques en lugar de cargar y unir la hoja de desembolsos entera
+MIN_BYTES_STREAMING = int(float(os.environ.get('DESEMBOLSOS_STREAMING_MB', 50)) * 2**20)
+
+
+# Bloques de un CSV (ruta, URL o archivo abierto)
+def iter_csv(source, chunksize=CHUNK_ROWS):
+    yield from pd.read_csv(source, chunksize=chunksize)
+
+
+# Bloques de una hoja de Excel leída fila a fila (openpyxl en modo solo lectura, sin cargar la hoja entera);
+# 'source' es una ruta o el contenido del libro
+def iter_xlsx(source, sheet, chunksize=CHUNK_ROWS):
+    import openpyxl
+
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    wb = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        filas = wb[sheet].iter_rows(values_only=True)
+        columnas = next(filas)
+        while True:
+            bloque = list(itertools.islice(filas, chunksize))
+            if not bloque:
+                break
+            yield pd.DataFrame(bloque, columns=columnas)
+    finally:
+        wb.close()
+
+
+# Bloques de la tabla de desembolsos del almacén local
+def iter_sqlite(conn, chunksize=CHUNK_ROWS):
+    yield from pd.read_sql_query('SELECT * FROM desembolsos', conn, chunksize=chunksize)
+
+
+# Suma de Monto por 'keys', acumulada bloque a bloque
+class RunningAggregate:
+    def __init__(self, keys):
+        self.keys = list(keys)
+        self.total = None
+
+    def add(self, parcial):
+        self.total = parcial if self.total is None else self.total.add(parcial, fill_value=0)
+
+    def result(self):
+        if self.total is None:
+            return pd.DataFrame(columns=self.keys + ['Monto'])
+        return self.total.sort_index().reset_index()
+
+
+# Suma el Monto por 'keys' de los desembolsos de 'chunks' con las mismas reglas que el cálculo en memoria: cada bloque
+# se une a la tabla de etapas (chica, en memoria) con core.join_stages y se filtra con 'filtro' (por defecto, las filas
+# con ambas fechas). Devuelve los montos sumados ordenados por 'keys' y las etapas en el esquema canónico.
+def stream_totals(chunks, hojas, layout, keys, filtro=core.with_dates, reports=None):
+    agregado = RunningAggregate(keys)
+    etapas = stage_keys = excluidas = None
+    for chunk in chunks:
+        if etapas is None:
+            etapas, stage_keys, excluidas = core.stage_dimension(hojas, layout, chunk, reports)
+        desembolsos = filtro(core.join_stages(chunk, etapas, stage_keys, layout, excluidas))
+        agregado.add(desembolsos.groupby(keys)[['Monto']].sum())
+    if etapas is None:
+        etapas, _, _ = core.stage_dimension(hojas, layout, pd.DataFrame(columns=['NoOperacion']), reports)
+    return agregado.result(), core._canonical(etapas, layout)
+
+
+# Tabla por proyecto y periodo (la de Curva Países y las matrices) calculada por bloques
+def stream_project_periods(chunks, hojas, layout, reports=None):
+    totales, etapas = stream_totals(chunks, hojas, layout, core.PROJECT_PERIOD_KEYS, reports=reports)
+    return core.project_period_totals(totales, etapas)
+
+
+# Filtros por nombre (la caché necesita argumentos que se puedan comparar)
+FILTROS = {'con_fechas': core.with_dates, 'desde_vigencia': lambda df: core.since_vigencia(core.with_dates(df))}
+
+
+# Montos sumados por 'keys' de un libro subido, sin cargar su hoja de desembolsos: las hojas de etapas y proyectos se
+# leen enteras (son chicas) y los desembolsos por bloques
+def _workbook_totals(data, keys, filtro_nombre):
+    metrics.cache_miss('stream_totals')
+    layout = core.detect_layout(core.workbook_sheet_names(data))
+    hojas = read_sheets(data, [h for h in layout.hojas if h != layout.hoja_desembolsos])
+    reports = []
+    totales, etapas = stream_totals(iter_xlsx(data, layout.hoja_desembolsos), hojas, layout, list(keys),
+                                    FILTROS[filtro_nombre], reports)
+    return totales, etapas, reports
+
+
+@functools.lru_cache(maxsize=None)
+def _cached_totals():
+    import streamlit as st
+
+    return st.cache_data(max_entries=4, show_spinner=False)(_workbook_totals)
+
+
+# Libros grandes: si el archivo subido pesa MIN_BYTES_STREAMING o más conviene agregarlo por bloques
+def is_large(source):
+    return len(workbook_bytes(source)) >= MIN_BYTES_STREAMING
+
+
+# Montos por 'keys', etapas canónicas y claves repetidas de un libro subido, por contenido del archivo
+def load_workbook_totals(source, keys, filtro='con_fechas'):
+    metrics.cache_call('stream_totals')
+    return _cached_totals()(workbook_bytes(source), tuple(keys), filtro)
@@ -0,0 +1,66 @@
+# Tiempos de cada paso de core.load_workbook en los dos formatos de libro, sobre una cartera sintética:
+#   python -m tools.bench_core --proyectos 3000 --repeat 5
+
+import argparse
+import pathlib
+import sys
+import tempfile
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+
+# Mejor tiempo (ms) de 'repeat' corridas y el último resultado
+def best_of(fn, repeat):
+    tiempos = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        tiempos.append(time.perf_counter() - start)
+    return min(tiempos) * 1000, result
+
+
+# Formato del libro, cantidad de desembolsos y de etapas, y el tiempo de cada paso
+def bench_layout(path, repeat):
+    import core
+    from bucketing import BUCKET_COLUMNS
+    from workbook import read_sheets, workbook_bytes
+
+    data = workbook_bytes(path)
+    rows = []
+    ms, layout = best_of(lambda: core.detect_layout(core.workbook_sheet_names(data)), repeat)
+    rows.append(('detect', ms))
+    ms, hojas = best_of(lambda: read_sheets(data, layout.hojas), repeat)
+    rows.append(('read', ms))
+    ms, (desembolsos, etapas) = best_of(lambda: core.normalize(hojas, layout), repeat)
+    rows.append(('normalize', ms))
+    ms, _ = best_of(lambda: core.cumulative_table(desembolsos, ['IDEtapa', *BUCKET_COLUMNS], 'IDEtapa',
+                                                  aporte=core.group_aporte(etapas, 'IDEtapa')), repeat)
+    rows.append(('cumulative_table', ms))
+    ms, _ = best_of(lambda: core.period_summary(desembolsos, 'Ano'), repeat)
+    rows.append(('period_summary', ms))
+    return layout.nombre, len(desembolsos), len(etapas), rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Tiempos de core.load_workbook por paso y formato de libro')
+    parser.add_argument('--proyectos', type=int, default=3000, help='proyectos de la cartera sintética')
+    parser.add_argument('--repeat', type=int, default=3, help='corridas por paso (se informa la mejor)')
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, str(ROOT))
+    from tools import synthetic
+
+    with tempfile.TemporaryDirectory(prefix='bench_core_') as tmp:
+        paths = synthetic.write(tmp, proyectos=args.proyectos)
+        for key in ('nuevo', 'anterior'):
+            nombre, filas, etapas, rows = bench_layout(paths[key], args.repeat)
+            print(f'{nombre} layout: {filas:,} disbursements, {etapas:,} stages')
+            for step, ms in rows:
+                print(f'  {step:18s} {ms:9.1f} ms')
+            print(f'  {"total":18s} {sum(ms for _, ms in rows):9.1f} ms')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,81 @@
+# Tiempo de importación de cada página en su primera visita, además de Streamlit (que el servidor ya cargó). Termina
+# con 1 si una página pasa el presupuesto o importa al cargarse alguno de los módulos de HEAVY:
+#   python -m tools.import_report
+#   python -m tools.import_report --budget-ms 600
+
+import argparse
+import ast
+import pathlib
+import subprocess
+import sys
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+# Presupuesto de importación por página (ms), además de Streamlit
+BUDGET_MS = 100
+
+# Módulos que solo se cargan en el código que los usa (ver utils.lazy_import)
+HEAVY = ('numpy', 'pandas', 'altair', 'scipy', 'matplotlib', 'openpyxl')
+
+
+# Imports a nivel de módulo de un script, como líneas de código
+def eager_imports(path):
+    tree = ast.parse(path.read_text(encoding='utf-8'))
+    return [ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+
+
+# ({módulo de primer nivel: microsegundos acumulados}, módulos de HEAVY cargados) de los imports dados, en un
+# intérprete nuevo con -X importtime
+def measure(statements):
+    code = ('import streamlit\nimport sys\nloaded = set(sys.modules)\nprint("--", file=sys.stderr)\n'
+            + '\n'.join(statements)
+            + f'\nprint(",".join(m for m in {HEAVY!r} if m in sys.modules and m not in loaded))')
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+
+    # Solo cuenta lo que se importa con Streamlit ya cargado
+    lines = proc.stderr.split('--\n', 1)[-1].splitlines()
+    costs = {}
+    for line in lines:
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Los imports anidados van con sangría debajo del módulo que los provocó
+        if not name[1:].startswith(' ') and cumulative.strip().isdigit():
+            costs[name.strip()] = int(cumulative)
+    heavy = [name for name in proc.stdout.strip().split(',') if name]
+    return costs, heavy
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Tiempo de importación de cada página')
+    parser.add_argument('--budget-ms', type=float, default=BUDGET_MS, help='falla si una página tarda más que esto (ms)')
+    parser.add_argument('--top', type=int, default=5, help='módulos que se listan por página')
+    args = parser.parse_args(argv)
+
+    scripts = [ROOT / 'Hello.py', *sorted((ROOT / 'pages').glob('*.py'))]
+    over_budget, eager = [], []
+    for script in scripts:
+        costs, heavy = measure(eager_imports(script))
+        total_ms = sum(costs.values()) / 1000
+        print(f'{script.relative_to(ROOT)}: {total_ms:8.1f} ms' + (f'  (eager: {", ".join(heavy)})' if heavy else ''))
+        for name, micros in sorted(costs.items(), key=lambda item: -item[1])[:args.top]:
+            print(f'    {micros / 1000:8.1f} ms  {name}')
+        if total_ms > args.budget_ms:
+            over_budget.append(script.name)
+        if heavy:
+            eager.append(script.name)
+
+    if over_budget:
+        print(f'Over the {args.budget_ms} ms budget: {", ".join(over_budget)}')
+    if eager:
+        print(f'Heavy modules imported eagerly by: {", ".join(eager)}')
+    return 1 if over_budget or eager else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
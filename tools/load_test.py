@@ -0,0 +1,239 @@
+# Prueba de carga: N analistas simulados a la vez por página con AppTest, cada uno en su hilo de este proceso (comparten
+# st.cache_* y el actualizador de Google Sheets como las sesiones de un servidor). Informa latencia por rerun (p50, p95,
+# p99), reruns por segundo y memoria por página, sin red: datos de tools.synthetic y hojas de tools.sheets_standin.
+#   python -m tools.load_test --sessions 8 --steps 10
+#   python -m tools.load_test --pages matrices curvas --sessions 16 --json carga.json
+
+import argparse
+import json
+import os
+import pathlib
+import random
+import re
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+
+def _find(at, kind, label):
+    for widget in getattr(at, kind):
+        if widget.label == label:
+            return widget
+    raise LookupError(f'No {kind} labelled {label!r}')
+
+
+def _countries(at, rng, paso):
+    widget = _find(at, 'multiselect', 'Selecciona Países:')
+    return widget.set_value(rng.sample(list(widget.options), rng.randint(1, len(widget.options))))
+
+
+def _granularity(at, rng, paso):
+    widget = _find(at, 'selectbox', 'Granularidad')
+    return widget.set_value(rng.choice(widget.options))
+
+
+def _cycle(kind, label):
+    def action(at, rng, paso):
+        widget = _find(at, kind, label)
+        return widget.set_value(widget.options[(paso + 1) % len(widget.options)])
+    return action
+
+
+def _month(at, rng, paso):
+    return _find(at, 'slider', 'Selecciona el Mes').set_value(rng.randint(1, 12))
+
+
+def _year(at, rng, paso):
+    widget = _find(at, 'slider', 'Selecciona el Año')
+    return widget.set_value(rng.randint(widget.min, widget.max))
+
+
+def _search(at, rng, paso):
+    # Escribe el comienzo de un IDEtapa, como al buscar un proyecto
+    widget = _find(at, 'text_input', 'Buscar proyecto')
+    return widget.input(f"{rng.choice(('AR', 'BO', 'BR', 'PY', 'UR'))}0")
+
+
+def _pick(at, rng, paso):
+    # Las opciones del selector son IDEtapa mostrados como 'IDEtapa (Alias)'
+    widget = _find(at, 'selectbox', 'Select IDEtapa to filter')
+    return widget.select(rng.choice(widget.options).split(' (')[0])
+
+
+def _horizon(at, rng, paso):
+    widget = _find(at, 'slider', 'Años a proyectar')
+    return widget.set_value(rng.randint(widget.min, widget.max))
+
+
+# Página -> (script, libro que se "sube" o None si lee Google Sheets, acciones que alterna cada sesión)
+SCENARIOS = {
+    'matrices': ('0_Matrices_Desembolsos.py', 'anterior', [_countries, _countries, _granularity]),
+    'curvas': ('1_Curvas_Proyectos.py', None, [_search, _pick, _pick]),
+    'sectores': ('2_Curva_Sectores.py', 'nuevo', [_cycle('selectbox', 'Selecciona el Sector:'), _granularity]),
+    'paises': ('3_Curva_Paises.py', 'nuevo', [_cycle('selectbox', 'Selecciona el País:'), _granularity]),
+    'mensual': ('4_Años_Desembolsos.py', 'nuevo', [_month, _month, _month, _year]),
+    'rfm': ('5_Estadisticas.py', 'anterior', [_cycle('selectbox', 'Filtrar por Estado')]),
+    'sheets': ('6_e.py', None, [_countries, _granularity]),
+    'cohortes': ('7_Cohortes_Vigencia.py', None, [_cycle('selectbox', 'Detalle de la Cohorte'), _cycle('selectbox', 'País')]),
+    'simulacion': ('8_Simulacion_Flujos.py', None, [_cycle('select_slider', 'Escenarios'), _horizon]),
+}
+
+
+# Copia la página a workdir con el libro en lugar de st.file_uploader, que AppTest no puede manejar
+def prepare_page(script, workbook, workdir):
+    source = (ROOT / 'pages' / script).read_text(encoding='utf-8')
+    if workbook is not None:
+        source = re.sub(r'st\.file_uploader\([^)]*\)', repr(str(workbook)), source)
+    target = workdir / script
+    target.write_text(source, encoding='utf-8')
+    return target
+
+
+# Memoria residente en bytes (Linux); en otros sistemas, la máxima
+def current_rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# Memoria máxima del proceso, medida en segundo plano mientras una página está bajo carga
+class MemorySampler:
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = current_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+# Un analista: primera carga y 'steps' cambios de widgets; devuelve (latencias, primera carga, errores)
+def run_session(path, actions, steps, seed, timeout, delay=0.0):
+    from streamlit.testing.v1 import AppTest
+
+    time.sleep(delay)
+    rng = random.Random(seed)
+    at = AppTest.from_file(str(path), default_timeout=timeout)
+    latencies, errors = [], []
+
+    start = time.perf_counter()
+    at.run()
+    first = time.perf_counter() - start
+    errors += [e.message for e in at.exception]
+
+    for paso in range(steps):
+        try:
+            widget = actions[paso % len(actions)](at, rng, paso)
+        except LookupError as exc:
+            errors.append(str(exc))
+            break
+        start = time.perf_counter()
+        widget.run()
+        latencies.append(time.perf_counter() - start)
+        errors += [e.message for e in at.exception]
+    return latencies, first, errors
+
+
+# Resumen de 'sessions' sesiones simultáneas sobre una página, que arrancan repartidas en ramp_up segundos
+def load_page(name, path, actions, sessions, steps, timeout, ramp_up=0.0):
+    base = current_rss()
+    start = time.perf_counter()
+    with MemorySampler() as memory, ThreadPoolExecutor(max_workers=sessions) as executor:
+        results = list(executor.map(
+            lambda seed: run_session(path, actions, steps, seed, timeout, ramp_up * seed / sessions), range(sessions)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([l for r in results for l in r[0]]) * 1000
+    first = np.array([r[1] for r in results]) * 1000
+    reruns = len(latencies) + len(first)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (np.nan,) * 3
+    return {
+        'page': name,
+        'sessions': sessions,
+        'reruns': reruns,
+        'first_ms': float(np.mean(first)),
+        'p50_ms': float(p50),
+        'p95_ms': float(p95),
+        'p99_ms': float(p99),
+        'throughput_rps': reruns / elapsed,
+        'rss_mib': current_rss() / 2**20,
+        'rss_growth_mib': (memory.peak - base) / 2**20,
+        'errors': sum(len(r[2]) for r in results),
+        'messages': sorted({m for r in results for m in r[2]}),
+    }
+
+
+def print_report(rows):
+    header = f'{"page":10s} {"sess":>4s} {"reruns":>6s} {"first":>8s} {"p50":>8s} {"p95":>8s} {"p99":>8s} {"rerun/s":>8s} {"RSS":>7s} {"+peak":>7s} {"err":>4s}'
+    print(header)
+    print('-' * len(header))
+    for r in rows:
+        print(f'{r["page"]:10s} {r["sessions"]:4d} {r["reruns"]:6d} {r["first_ms"]:8.0f} {r["p50_ms"]:8.0f} {r["p95_ms"]:8.0f} '
+              f'{r["p99_ms"]:8.0f} {r["throughput_rps"]:8.2f} {r["rss_mib"]:7.0f} {r["rss_growth_mib"]:7.0f} {r["errors"]:4d}')
+    print('latencies in ms, memory in MiB (+peak: growth while the page was under load)')
+    for r in rows:
+        for message in r['messages']:
+            print(f'{r["page"]}: {message}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Prueba de carga de las páginas con sesiones simultáneas')
+    parser.add_argument('--pages', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--sessions', type=int, default=4, help='sesiones simultáneas por página')
+    parser.add_argument('--steps', type=int, default=6, help='cambios de widgets por sesión')
+    parser.add_argument('--proyectos', type=int, default=500, help='proyectos de la cartera sintética')
+    parser.add_argument('--ramp-up', type=float, default=1.0, help='segundos en los que arrancan las sesiones de una página')
+    parser.add_argument('--timeout', type=float, default=600, help='segundos máximos por rerun')
+    parser.add_argument('--json', type=pathlib.Path, help='guarda también los resultados en JSON')
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, str(ROOT))
+    from tools import sheets_standin, synthetic
+
+    with tempfile.TemporaryDirectory(prefix='load_test_') as tmp:
+        tmp = pathlib.Path(tmp)
+        data = synthetic.write(tmp / 'data', proyectos=args.proyectos)
+        server, urls = sheets_standin.serve(data['sheets'])
+        # Antes de que alguna página importe sheets_refresher, que lee las URLs al importarse
+        os.environ.update(sheets_standin.environment(urls))
+        os.environ.pop('DESEMBOLSOS_SNAPSHOT_DIR', None)
+
+        pages = tmp / 'pages'
+        pages.mkdir()
+        rows = []
+        try:
+            for name in args.pages:
+                script, workbook, actions = SCENARIOS[name]
+                path = prepare_page(script, data[workbook] if workbook else None, pages)
+                rows.append(load_page(name, path, actions, args.sessions, args.steps, args.timeout, args.ramp_up))
+                print(f'{name}: done in {rows[-1]["reruns"] / rows[-1]["throughput_rps"]:.1f} s', file=sys.stderr)
+        finally:
+            server.shutdown()
+
+    print_report(rows)
+    if args.json:
+        args.json.write_text(json.dumps(rows, indent=2))
+    return 1 if any(r['errors'] for r in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
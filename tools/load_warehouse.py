@@ -0,0 +1,52 @@
+# Arma el almacén SQLite local opcional con Proyectos, Operaciones y OperacionesDesembolsos, desde un libro o desde
+# Google Sheets; las páginas lo consultan con filtros en SQL en lugar de leer cada libro subido:
+#   python -m tools.load_warehouse desembolsos.db --xlsx Operaciones.xlsx
+#   python -m tools.load_warehouse desembolsos.db --sheets
+#   DESEMBOLSOS_WAREHOUSE=desembolsos.db streamlit run Hello.py
+
+import argparse
+import pathlib
+import sqlite3
+import sys
+import time
+
+from warehouse import TABLAS, build_warehouse
+
+
+# {hoja: DataFrame} del libro o de las hojas publicadas
+def load_sources(args):
+    if args.xlsx:
+        from workbook import read_sheets
+        return read_sheets(args.xlsx, list(TABLAS.values()))
+
+    from sheets_refresher import SHEET_URLS, fetch_csv
+    urls = {'Proyectos': SHEET_URLS['proyectos'], 'Operaciones': SHEET_URLS['operaciones'],
+            'OperacionesDesembolsos': SHEET_URLS['desembolsos']}
+    return {hoja: fetch_csv(url) for hoja, url in urls.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Arma el almacén SQLite local')
+    parser.add_argument('database', type=pathlib.Path)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--xlsx', type=pathlib.Path, help='libro con las tres hojas')
+    source.add_argument('--sheets', action='store_true', help='descarga las hojas publicadas en Google Sheets')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    hojas = load_sources(args)
+    build_warehouse(str(args.database), hojas)
+
+    with sqlite3.connect(args.database) as conn:
+        for tabla in TABLAS:
+            filas = conn.execute(f'SELECT COUNT(*) FROM {tabla}').fetchone()[0]
+            print(f'{tabla:12s} {filas:10d} rows')
+        indices = [fila[0] for fila in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' ORDER BY name")]
+    conn.close()
+    print(f'Indexes: {", ".join(indices)}')
+    print(f'Built {args.database} in {time.perf_counter() - start:.1f} s')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+# Resumen de las métricas por rerun que escribe metrics.page_run (el archivo y sus copias rotadas .1, .2, ...): por
+# página, percentiles de latencia, tamaño de los datos, bytes enviados, memoria, concurrencia, aciertos de caché y
+# resúmenes incrementales; luego los percentiles de duración de cada etapa.
+#   DESEMBOLSOS_METRICS_FILE=logs/metrics.jsonl streamlit run Hello.py
+#   python -m tools.metrics_report logs/metrics.jsonl --since 2024-06-01
+
+import argparse
+import collections
+import glob
+import json
+import pathlib
+import sys
+
+import numpy as np
+
+PERCENTILES = (50, 95, 99)
+
+
+# Registros del archivo de métricas y de sus copias rotadas, del más antiguo al más nuevo
+def read_records(path, since=None, pages=None):
+    # RotatingFileHandler: .1 es la copia más reciente y la de número más alto, la más antigua
+    backups = [p for p in glob.glob(f'{glob.escape(str(path))}.*') if p.rsplit('.', 1)[1].isdigit()]
+    paths = sorted(backups, key=lambda p: int(p.rsplit('.', 1)[1]), reverse=True) + [str(path)]
+    records = []
+    for name in paths:
+        if not pathlib.Path(name).exists():
+            continue
+        with open(name, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if since and record.get('ts', '') < since:
+                    continue
+                if pages and record.get('page') not in pages:
+                    continue
+                records.append(record)
+    return records
+
+
+def percentiles(values):
+    values = [v for v in values if v is not None]
+    if not values:
+        return [np.nan] * len(PERCENTILES)
+    return list(np.percentile(values, PERCENTILES))
+
+
+# Filas de resumen por página y filas de duración por (página, etapa)
+def summarize(records, include_stopped=False):
+    by_page = collections.defaultdict(list)
+    for record in records:
+        if include_stopped or record.get('status') == 'ok':
+            by_page[record['page']].append(record)
+
+    pages, stages = [], []
+    for page, rows in sorted(by_page.items()):
+        hits = collections.Counter()
+        misses = collections.Counter()
+        incremental = collections.Counter()
+        full = collections.Counter()
+        durations = collections.defaultdict(list)
+        for row in rows:
+            for cache, counts in (row.get('cache') or {}).items():
+                hits[cache] += counts.get('hits', 0)
+                misses[cache] += counts.get('misses', 0)
+            for name, counts in (row.get('updates') or {}).items():
+                incremental[name] += counts.get('incremental', 0)
+                full[name] += counts.get('full', 0)
+            for stage, ms in (row.get('stages') or {}).items():
+                durations[stage].append(ms)
+
+        rows_sizes = [r['rows'] for r in rows if r.get('rows') is not None]
+        sessions = [r['sessions'] for r in rows if r.get('sessions') is not None]
+        pages.append({
+            'page': page,
+            'reruns': len(rows),
+            'total_ms': percentiles(r['total_ms'] for r in rows),
+            'rows': int(np.median(rows_sizes)) if rows_sizes else None,
+            'kib_sent': percentiles(r['bytes_sent'] / 1024 if r.get('bytes_sent') is not None else None for r in rows),
+            'peak_rss_mib': max((r.get('peak_rss_mib') or 0) for r in rows),
+            'max_sessions': max(sessions) if sessions else None,
+            'max_concurrent': max(r.get('concurrent_runs', 0) for r in rows),
+            'cache_hit_ratio': {cache: hits[cache] / (hits[cache] + misses[cache])
+                                for cache in sorted(hits | misses) if hits[cache] + misses[cache]},
+            'incremental_ratio': {name: incremental[name] / (incremental[name] + full[name])
+                                  for name in sorted(incremental | full) if incremental[name] + full[name]},
+        })
+        for stage, values in sorted(durations.items()):
+            stages.append({'page': page, 'stage': stage, 'runs': len(values), 'ms': percentiles(values)})
+    return pages, stages
+
+
+def _fmt(value, width=8, digits=0):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return f'{"-":>{width}s}'
+    return f'{value:>{width},.{digits}f}'
+
+
+def print_report(pages, stages):
+    header = (f'{"page":22s} {"reruns":>6s} {"p50":>8s} {"p95":>8s} {"p99":>8s} {"rows":>9s} '
+              f'{"KiB p50":>8s} {"KiB p95":>8s} {"peakRSS":>8s} {"sess":>5s} {"conc":>5s}')
+    print(header)
+    print('-' * len(header))
+    for p in pages:
+        p50, p95, p99 = p['total_ms']
+        k50, k95, _ = p['kib_sent']
+        print(f'{p["page"]:22s} {p["reruns"]:>6d} {_fmt(p50)} {_fmt(p95)} {_fmt(p99)} {_fmt(p["rows"], 9)} '
+              f'{_fmt(k50)} {_fmt(k95)} {_fmt(p["peak_rss_mib"])} {_fmt(p["max_sessions"], 5)} {_fmt(p["max_concurrent"], 5)}')
+    print('latencies in ms, peak RSS in MiB')
+
+    print()
+    header = f'{"page":22s} {"stage":16s} {"runs":>6s} {"p50":>9s} {"p95":>9s} {"p99":>9s}'
+    print(header)
+    print('-' * len(header))
+    for s in stages:
+        p50, p95, p99 = s['ms']
+        print(f'{s["page"]:22s} {s["stage"]:16s} {s["runs"]:>6d} {_fmt(p50, 9, 1)} {_fmt(p95, 9, 1)} {_fmt(p99, 9, 1)}')
+
+    ratios = [(p['page'], cache, ratio) for p in pages for cache, ratio in p['cache_hit_ratio'].items()]
+    if ratios:
+        print()
+        print(f'{"page":22s} {"cache":16s} {"hit ratio":>9s}')
+        for page, cache, ratio in ratios:
+            print(f'{page:22s} {cache:16s} {ratio:>9.1%}')
+
+    ratios = [(p['page'], name, ratio) for p in pages for name, ratio in p['incremental_ratio'].items()]
+    if ratios:
+        print()
+        print(f'{"page":22s} {"update":16s} {"incremental":>11s}')
+        for page, name, ratio in ratios:
+            print(f'{page:22s} {name:16s} {ratio:>11.1%}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Resumen de las métricas por rerun de las páginas')
+    parser.add_argument('path', type=pathlib.Path, help='archivo JSONL de métricas (también lee sus copias rotadas)')
+    parser.add_argument('--since', help='solo registros desde esta fecha y hora ISO')
+    parser.add_argument('--pages', nargs='+', help='solo estas páginas')
+    parser.add_argument('--include-stopped', action='store_true', help='cuenta también los reruns interrumpidos por otro')
+    parser.add_argument('--json', type=pathlib.Path, help='guarda también el resumen en JSON')
+    args = parser.parse_args(argv)
+
+    records = read_records(args.path, args.since, args.pages)
+    if not records:
+        print(f'no records in {args.path}', file=sys.stderr)
+        return 1
+    pages, stages = summarize(records, args.include_stopped)
+    print_report(pages, stages)
+    if args.json:
+        args.json.write_text(json.dumps({'pages': pages, 'stages': stages}, indent=2, default=float))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,26 @@
+# Arranca la aplicación con el precalentamiento (warmup) ya en marcha en el proceso del servidor, para que los datos de
+# las páginas estén listos antes del primer visitante. Los argumentos extra van a 'streamlit run':
+#   DESEMBOLSOS_SNAPSHOT_DIR=data/ python -m tools.serve --server.port 8501
+
+import os
+import pathlib
+import sys
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    os.environ['DESEMBOLSOS_WARMUP'] = '1'
+    sys.path.insert(0, str(ROOT))
+
+    import warmup
+    from streamlit.web import cli
+
+    warmup.get_warmup()
+    sys.argv = ['streamlit', 'run', str(ROOT / 'Hello.py'), *argv]
+    return cli.main()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,65 @@
+# Sustituto local de las hojas publicadas en Google Sheets: sirve proyectos.csv, operaciones.csv y desembolsos.csv de
+# un directorio, con demora o fallas opcionales, para probar sin red el actualizador y las páginas que leen las hojas.
+#   python -m tools.sheets_standin data/ --port 8765 --delay 2
+#   SHEET_URL_PROYECTOS=http://127.0.0.1:8765/proyectos.csv ... streamlit run Hello.py
+
+import argparse
+import functools
+import http.server
+import pathlib
+import random
+import threading
+import time
+
+SHEETS = ('proyectos', 'operaciones', 'desembolsos')
+
+
+class StandInHandler(http.server.SimpleHTTPRequestHandler):
+    delay = 0.0
+    fail_rate = 0.0
+
+    def do_GET(self):
+        if self.delay:
+            time.sleep(self.delay)
+        if self.fail_rate and random.random() < self.fail_rate:
+            self.send_error(503, 'Simulated upstream failure')
+            return
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Arranca el sustituto en un hilo daemon; devuelve (servidor, {hoja: URL})
+def serve(directory, port=0, delay=0.0, fail_rate=0.0):
+    handler = type('Handler', (StandInHandler,), {'delay': delay, 'fail_rate': fail_rate})
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), functools.partial(handler, directory=str(directory)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, {name: f'http://{host}:{port}/{name}.csv' for name in SHEETS}
+
+
+# Variables de entorno que apuntan la aplicación al sustituto
+def environment(urls):
+    return {f'SHEET_URL_{name.upper()}': url for name, url in urls.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Sirve las hojas de Google Sheets desde un directorio local')
+    parser.add_argument('directory', type=pathlib.Path)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--delay', type=float, default=0.0, help='segundos de espera antes de cada respuesta')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fracción de pedidos que se responden con 503')
+    args = parser.parse_args(argv)
+
+    server, urls = serve(args.directory, args.port, args.delay, args.fail_rate)
+    for name, value in environment(urls).items():
+        print(f'export {name}={value}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
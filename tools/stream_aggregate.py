@@ -0,0 +1,66 @@
+# Agregación por bloques de historiales de desembolsos grandes: une cada bloque con Operaciones y Proyectos (en memoria)
+# y lo suma a los totales por proyecto y período, así la memoria no crece con las filas de desembolsos. El resultado es
+# la tabla de Curva Países (mismas reglas de unión y de fechas que la página).
+#   python -m tools.stream_aggregate export.xlsx -o agregado.xlsx
+#   python -m tools.stream_aggregate desembolsos.db
+#   python -m tools.stream_aggregate desembolsos.csv --operaciones operaciones.csv --proyectos proyectos.csv
+
+import argparse
+import pathlib
+import resource
+import sys
+import time
+
+import core
+from streaming import CHUNK_ROWS, iter_csv, iter_sqlite, iter_xlsx, stream_project_periods
+
+
+# (bloques, hojas) de la fuente; hojas tiene Operaciones y Proyectos
+def open_source(args):
+    import pandas as pd
+
+    suffix = args.source.suffix.lower()
+    if suffix == '.xlsx':
+        from workbook import read_sheets
+        hojas = read_sheets(args.source, ['Proyectos', 'Operaciones'])
+        return iter_xlsx(args.source, 'OperacionesDesembolsos', args.chunksize), hojas
+    if suffix in ('.db', '.sqlite'):
+        import warehouse
+        conn = warehouse.connect(str(args.source))
+        hojas = {'Operaciones': pd.read_sql_query('SELECT * FROM operaciones', conn),
+                 'Proyectos': pd.read_sql_query('SELECT * FROM proyectos', conn)}
+        return iter_sqlite(conn, args.chunksize), hojas
+    if args.operaciones is None or args.proyectos is None:
+        raise SystemExit('--operaciones and --proyectos are required for CSV sources')
+    hojas = {'Operaciones': pd.read_csv(args.operaciones), 'Proyectos': pd.read_csv(args.proyectos)}
+    return iter_csv(args.source, args.chunksize), hojas
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Agrega por bloques un historial de desembolsos grande')
+    parser.add_argument('source', type=pathlib.Path, help='libro .xlsx, almacén .db o .csv de desembolsos')
+    parser.add_argument('--operaciones', help='CSV de Operaciones (solo con fuentes CSV)')
+    parser.add_argument('--proyectos', help='CSV de Proyectos (solo con fuentes CSV)')
+    parser.add_argument('--chunksize', type=int, default=CHUNK_ROWS)
+    parser.add_argument('-o', '--output', type=pathlib.Path, help='guarda el resultado en .xlsx o .csv')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    chunks, hojas = open_source(args)
+    resultado = stream_project_periods(chunks, hojas, core.LAYOUT_OPERACIONES)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    print(f'{resultado["NoProyecto"].nunique():,} projects -> {len(resultado):,} (project, stage, period) rows '
+          f'in {elapsed:.1f} s, peak RSS {peak / 2**20:.0f} MiB')
+    if args.output is None:
+        print(resultado.head(20).to_string(index=False))
+    elif args.output.suffix.lower() == '.xlsx':
+        resultado.to_excel(args.output, index=False)
+    else:
+        resultado.to_csv(args.output, index=False)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
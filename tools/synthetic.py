@@ -0,0 +1,124 @@
+# Cartera sintética y reproducible para las mediciones y las pruebas de carga sin red. Escribe el libro nuevo
+# (Proyectos / Operaciones / OperacionesDesembolsos), el anterior (Desembolsos / Operaciones con AporteFonplata y
+# SECTOR) y los CSV de las hojas publicadas, con montos y fechas en formato español (para tools.sheets_standin).
+#   python -m tools.synthetic data/ --proyectos 1500
+
+import argparse
+import pathlib
+import sys
+
+import numpy as np
+
+PAISES = ('AR', 'BO', 'BR', 'PY', 'UR')
+LIBRO_NUEVO = 'operaciones_desembolsos.xlsx'
+LIBRO_ANTERIOR = 'desembolsos_operaciones.xlsx'
+HOY = np.datetime64('2024-06-30')
+
+
+# Montos con separadores en formato español (1.234,56), como en las hojas publicadas
+def _spanish_amount(values):
+    return [f'{v:,.2f}'.replace(',', 'X').replace('.', ',').replace('X', '.') for v in values]
+
+
+# DataFrames (proyectos, operaciones, desembolsos) con el formato del libro nuevo
+def build_frames(proyectos=1500, seed=0):
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    i = np.arange(proyectos)
+    pais = np.array(PAISES)[i % len(PAISES)]
+    no_proyecto = [f'{p}-{n:04d}' for p, n in zip(pais, i)]
+    vigencia = np.datetime64('2010-01-01') + rng.integers(0, 4000, proyectos).astype('timedelta64[D]')
+    aporte = rng.integers(5, 100, proyectos) * 1e6
+
+    df_proyectos = pd.DataFrame({
+        'NoProyecto': no_proyecto,
+        'IDAreaPrioritaria': [f'S{n % 4}' for n in i],
+        'IDAreaIntervencion': [f'SS{n % 7}' for n in i],
+        'Pais': pais,
+        'Alias': [f'Proyecto {n}' for n in i],
+    })
+    df_operaciones = pd.DataFrame({
+        'NoProyecto': no_proyecto,
+        'NoOperacion': [f'OP{n}' for n in i],
+        'NoEtapa': 1,
+        'IDEtapa': [f'{p}{n:04d}' for p, n in zip(pais, i)],
+        'IDOperacion': i,
+        'Alias': df_proyectos['Alias'],
+        'Pais': pais,
+        'FechaVigencia': vigencia,
+        'Estado': 'Vigente',
+        'AporteFONPLATAVigente': aporte,
+    })
+
+    # Entre 3 y 19 desembolsos por proyecto que suman entre el 30% y el 100% del aporte
+    cantidad = rng.integers(3, 20, proyectos)
+    proyecto = np.repeat(i, cantidad)
+    peso = rng.exponential(size=len(proyecto))
+    total_por_proyecto = np.bincount(proyecto, weights=peso)
+    fraccion = peso / total_por_proyecto[proyecto] * rng.uniform(0.3, 1.0, proyectos)[proyecto]
+    fecha = vigencia[proyecto] + rng.integers(10, 3000, len(proyecto)).astype('timedelta64[D]')
+    pasados = fecha <= HOY
+
+    df_desembolsos = pd.DataFrame({
+        'IDDesembolso': np.arange(1, len(proyecto) + 1),
+        'NoOperacion': df_operaciones['NoOperacion'].to_numpy()[proyecto],
+        'NoEtapa': 1,
+        'Monto': np.round(aporte[proyecto] * fraccion, 2),
+        'FechaEfectiva': fecha,
+    })[pasados].reset_index(drop=True)
+    return df_proyectos, df_operaciones, df_desembolsos
+
+
+# Escribe los dos libros y los CSV en directory; devuelve sus rutas
+def write(directory, proyectos=1500, seed=0):
+    import pandas as pd
+
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    df_proyectos, df_operaciones, df_desembolsos = build_frames(proyectos, seed)
+
+    nuevo = directory / LIBRO_NUEVO
+    with pd.ExcelWriter(nuevo) as writer:
+        df_proyectos.to_excel(writer, sheet_name='Proyectos', index=False)
+        df_operaciones.to_excel(writer, sheet_name='Operaciones', index=False)
+        df_desembolsos.to_excel(writer, sheet_name='OperacionesDesembolsos', index=False)
+
+    anterior = directory / LIBRO_ANTERIOR
+    operaciones_anterior = df_operaciones.rename(columns={'AporteFONPLATAVigente': 'AporteFonplata'})
+    operaciones_anterior['SECTOR'] = df_proyectos['IDAreaPrioritaria']
+    operaciones_anterior['SUBSECTOR'] = df_proyectos['IDAreaIntervencion']
+    desembolsos_anterior = df_desembolsos.merge(df_operaciones[['NoOperacion', 'IDEtapa']], on='NoOperacion')
+    with pd.ExcelWriter(anterior) as writer:
+        desembolsos_anterior.to_excel(writer, sheet_name='Desembolsos', index=False)
+        operaciones_anterior.to_excel(writer, sheet_name='Operaciones', index=False)
+
+    df_proyectos.to_csv(directory / 'proyectos.csv', index=False)
+    operaciones_csv = df_operaciones.assign(
+        FechaVigencia=df_operaciones['FechaVigencia'].dt.strftime('%d/%m/%Y'),
+        AporteFONPLATAVigente=_spanish_amount(df_operaciones['AporteFONPLATAVigente']),
+    )
+    operaciones_csv.to_csv(directory / 'operaciones.csv', index=False)
+    desembolsos_csv = df_desembolsos.assign(
+        FechaEfectiva=df_desembolsos['FechaEfectiva'].dt.strftime('%d/%m/%Y'),
+        Monto=_spanish_amount(df_desembolsos['Monto']),
+    )
+    desembolsos_csv.to_csv(directory / 'desembolsos.csv', index=False)
+    return {'nuevo': nuevo, 'anterior': anterior, 'sheets': directory}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Escribe una cartera sintética (libros y CSV)')
+    parser.add_argument('directory', type=pathlib.Path)
+    parser.add_argument('--proyectos', type=int, default=1500)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    paths = write(args.directory, args.proyectos, args.seed)
+    for name, path in paths.items():
+        print(f'{name:8s} {path}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
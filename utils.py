@@ -12,10 +12,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
+import importlib
 import inspect
+import sys
 import textwrap
-
-import streamlit as st
+import threading
+import types
 
 
 def show_code(demo):
@@ -26,3 +29,80 @@ def show_code(demo):
         st.markdown("## Code")
         sourcelines, _ = inspect.getsourcelines(demo)
         st.code(textwrap.dedent("".join(sourcelines[1:])))
+
+
+_import_lock = threading.RLock()
+
+# Longest wait of a page whose Sheets dataset is still being built before it reruns
+PENDING_SECONDS = 1.0
+
+
+class _LazyModule(types.ModuleType):
+    """Placeholder that imports the real module on first attribute access.
+
+    importlib.util.LazyLoader is not thread-safe before Python 3.12: a second
+    session could see the half-initialized module while the first one was still
+    executing it. Deferred imports are serialized here instead, so the per-module
+    import locks of two sessions cannot deadlock and hand out a partial module.
+    """
+
+    def __getattr__(self, attr):
+        with _import_lock:
+            module = importlib.import_module(self.__name__)
+            self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+
+def lazy_import(name):
+    """Import a module on first attribute access instead of at page load."""
+    module = sys.modules.get(name)
+    # Another session may be executing the import right now: never hand out the half-built module
+    if module is not None and not getattr(getattr(module, '__spec__', None), '_initializing', False):
+        return module
+    return _LazyModule(name)
+
+
+# Streamlit is bound lazily too: forecast, kmeans and the other modules that run in the spawn pools import
+# lazy_import from here, and their worker processes never need Streamlit
+st = lazy_import('streamlit')
+
+
+def dataframe_to_excel_bytes(df, sheet_name='Resultados'):
+    """Export a DataFrame to an in-memory xlsx (openpyxl is only loaded here)."""
+    import io
+
+    import pandas as pd
+
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        df.to_excel(writer, sheet_name=sheet_name, index=False)
+    output.seek(0)
+    return output
+
+
+def excel_download(df, sheet_name='Resultados'):
+    """Deferred export for st.download_button: the workbook is built only when the user clicks."""
+    # Copy so that later in-place edits on the page do not leak into the export
+    return functools.partial(dataframe_to_excel_bytes, df.copy(), sheet_name)
+
+
+def show_load_error(refresher, name):
+    """Explain why a Sheets-backed dataset is missing (the builder's error, if it failed).
+
+    While the refresher is still building the page's dataset on the latest snapshot, say so
+    and rerun the page as soon as it is ready (checking again every PENDING_SECONDS).
+    """
+    if refresher.snapshot(timeout=0) is not None and refresher.pending(name):
+        st.info("Preparando los datos de esta página con la última copia de Google Sheets...")
+        refresher.wait_built(name, PENDING_SECONDS)
+        st.rerun()
+    error = refresher.build_error(name)
+    st.error("Error en la carga de datos desde Google Sheets." + (f" {error}" if error else ""))
+
+
+def show_freshness(snapshot):
+    """Show when the served data was downloaded and whether the last refresh failed."""
+    fetched_at = snapshot.fetched_at.strftime('%d/%m/%Y %H:%M')
+    if snapshot.error:
+        st.warning(f"No se pudo actualizar desde Google Sheets; se muestran los datos del {fetched_at}.")
+    st.caption(f"Datos de Google Sheets al {fetched_at}")
@@ -0,0 +1,156 @@
+from contextlib import contextmanager
+import os
+import sqlite3
+
+from core import to_number
+from utils import lazy_import
+
+pd = lazy_import('pandas')
+
+# Almacén local opcional (SQLite); si la variable no está definida las páginas siguen trabajando con archivos subidos
+WAREHOUSE_PATH = os.environ.get('DESEMBOLSOS_WAREHOUSE')
+
+# Tabla del almacén -> hoja del libro de la que se carga
+TABLAS = {'proyectos': 'Proyectos', 'operaciones': 'Operaciones', 'desembolsos': 'OperacionesDesembolsos'}
+
+# Índices por tabla; los que son prefijo de otro ya creado sobran (('NoOperacion',) solo se crea si no hay 'NoEtapa')
+INDICES = {
+    'proyectos': [('NoProyecto',), ('Pais',)],
+    'operaciones': [('IDEtapa',), ('NoOperacion', 'NoEtapa'), ('NoOperacion',), ('NoProyecto',)],
+    'desembolsos': [('NoOperacion', 'NoEtapa'), ('NoOperacion',), ('FechaEfectiva',)],
+}
+
+# Columnas que identifican la etapa de un desembolso
+CLAVES_ETAPA = ('IDEtapa', 'NoOperacion', 'NoEtapa')
+
+FECHAS = ('FechaEfectiva', 'FechaVigencia')
+MONTOS = ('Monto', 'AporteFONPLATAVigente')
+
+
+# Fechas como texto ISO 'AAAA-MM-DD': se ordenan igual que las fechas y los índices sirven para rangos
+def _normalize(df):
+    df = df.copy()
+    for columna in FECHAS:
+        if columna in df.columns:
+            df[columna] = pd.to_datetime(df[columna], dayfirst=True, errors='coerce').dt.strftime('%Y-%m-%d')
+    for columna in MONTOS:
+        if columna in df.columns:
+            df[columna] = to_number(df[columna])
+    return df
+
+
+# Crea (o reemplaza) el almacén a partir de las hojas {nombre de hoja: DataFrame}
+def build_warehouse(path, hojas):
+    tmp = path + '.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    with sqlite3.connect(tmp) as conn:
+        for tabla, hoja in TABLAS.items():
+            df = _normalize(hojas[hoja])
+            df.to_sql(tabla, conn, index=False)
+            creados = []
+            for columnas in INDICES[tabla]:
+                if not all(c in df.columns for c in columnas) or any(c[:len(columnas)] == columnas for c in creados):
+                    continue
+                conn.execute(f'CREATE INDEX idx_{tabla}_{"_".join(columnas)} ON {tabla} ({", ".join(columnas)})')
+                creados.append(columnas)
+        conn.execute('ANALYZE')
+    conn.close()
+    os.replace(tmp, path)
+
+
+# Conexión de solo lectura
+def connect(path=None):
+    path = path or WAREHOUSE_PATH
+    return sqlite3.connect(f'file:{path}?mode=ro', uri=True, check_same_thread=False)
+
+
+# Conexión de solo lectura que se cierra al salir del bloque
+@contextmanager
+def connection(path=None):
+    conn = connect(path)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+# Cambia cada vez que se reconstruye el almacén (sirve como clave de caché)
+def version(path=None):
+    return os.stat(path or WAREHOUSE_PATH).st_mtime_ns
+
+
+def _columns(conn, tabla):
+    return [fila[1] for fila in conn.execute(f'PRAGMA table_info({tabla})')]
+
+
+def _read(conn, sql, params):
+    df = pd.read_sql_query(sql, conn, params=params)
+    for columna in FECHAS:
+        if columna in df.columns:
+            df[columna] = pd.to_datetime(df[columna], format='%Y-%m-%d')
+    return df
+
+
+# Países disponibles (DISTINCT resuelto con el índice)
+def countries(conn):
+    return [fila[0] for fila in conn.execute('SELECT DISTINCT Pais FROM proyectos WHERE Pais IS NOT NULL ORDER BY Pais')]
+
+
+# Primer y último año con desembolsos (MIN/MAX resueltos con el índice de 'FechaEfectiva'); None si ningún
+# desembolso tiene fecha
+def year_range(conn):
+    minimo, maximo = conn.execute('SELECT MIN(FechaEfectiva), MAX(FechaEfectiva) FROM desembolsos').fetchone()
+    if minimo is None:
+        return None
+    return int(minimo[:4]), int(maximo[:4])
+
+
+# Hojas filtradas en SQLite; devuelve {nombre de hoja: DataFrame} con el mismo formato que load_sheets.
+# 'desde' y 'hasta' son fechas 'AAAA-MM-DD' (hasta excluida). Con 'agregar', los desembolsos llegan sumados por etapa
+# y 'FechaEfectiva' (GROUP BY en SQLite): basta para los montos por periodo y trae muchas menos filas.
+def query_frames(conn, pais=None, proyecto=None, etapa=None, desde=None, hasta=None, agregar=False):
+    condiciones, params = [], []
+    if pais is not None:
+        if 'Pais' in _columns(conn, 'proyectos'):
+            condiciones.append('o.NoProyecto IN (SELECT NoProyecto FROM proyectos WHERE Pais = ?)')
+        else:
+            condiciones.append('o.Pais = ?')
+        params.append(pais)
+    if proyecto is not None:
+        condiciones.append('o.NoProyecto = ?')
+        params.append(proyecto)
+    if etapa is not None:
+        condiciones.append('o.IDEtapa = ?')
+        params.append(etapa)
+    where_op = ' AND '.join(condiciones)
+
+    operaciones = _read(conn, 'SELECT * FROM operaciones o' + (f' WHERE {where_op}' if where_op else ''), params)
+
+    claves = ['NoOperacion', 'NoEtapa'] if 'NoEtapa' in _columns(conn, 'desembolsos') else ['NoOperacion']
+    condiciones_d, params_d = [], []
+    if where_op:
+        # Subconsulta IN sobre la clave de etapa: se resuelve con el índice de desembolsos (NoOperacion, NoEtapa)
+        clave_d = '(' + ', '.join(f'd.{c}' for c in claves) + ')'
+        clave_o = ', '.join(f'o.{c}' for c in claves)
+        condiciones_d.append(f'{clave_d} IN (SELECT {clave_o} FROM operaciones o WHERE {where_op})')
+        params_d.extend(params)
+    if desde is not None:
+        condiciones_d.append('d.FechaEfectiva >= ?')
+        params_d.append(desde)
+    if hasta is not None:
+        condiciones_d.append('d.FechaEfectiva < ?')
+        params_d.append(hasta)
+    where_d = ' WHERE ' + ' AND '.join(condiciones_d) if condiciones_d else ''
+    if agregar:
+        grupo = ', '.join(f'd.{c}' for c in CLAVES_ETAPA + ('FechaEfectiva',) if c in _columns(conn, 'desembolsos'))
+        desembolsos = _read(conn, f'SELECT {grupo}, SUM(d.Monto) AS Monto FROM desembolsos d{where_d} GROUP BY {grupo}', params_d)
+    else:
+        desembolsos = _read(conn, 'SELECT d.* FROM desembolsos d' + where_d, params_d)
+
+    if pais is None and proyecto is None and etapa is None:
+        proyectos = _read(conn, 'SELECT * FROM proyectos', [])
+    else:
+        proyectos = _read(conn, 'SELECT * FROM proyectos WHERE NoProyecto IN (SELECT NoProyecto FROM operaciones o WHERE ' + where_op + ')', params)
+
+    return {'Proyectos': proyectos, 'Operaciones': operaciones, 'OperacionesDesembolsos': desembolsos}
@@ -0,0 +1,207 @@
+import importlib
+import os
+import threading
+import time
+from collections import namedtuple
+
+from streamlit.logger import get_logger
+
+from sheets_refresher import get_refresher
+
+LOGGER = get_logger(__name__)
+
+# Precalentamiento opcional al arrancar el servidor (DESEMBOLSOS_WARMUP=1)
+ENABLED = os.environ.get('DESEMBOLSOS_WARMUP', '').lower() in ('1', 'true', 'si', 'sí')
+
+# Espera máxima (segundos) por la primera copia de las hojas y por el arranque del servidor de Streamlit
+PRIMERA_CARGA_TIMEOUT = 120
+RUNTIME_TIMEOUT = 60
+
+# Cada cuánto se revisa si el actualizador trajo una copia nueva de las hojas
+REVISION_SECONDS = 5
+
+# Datasets de las páginas que leen Google Sheets, en el orden en que se arman: nombre, módulo y función que lo arma.
+# Los módulos (con pandas y numpy) se importan en el hilo del precalentamiento, no al importar este módulo.
+BUILDERS = (
+    ('kpis', 'kpis', 'build_kpis'),
+    ('curvas_proyectos', 'project_index', 'build_dataset'),
+    ('matrices', 'matrices', 'build_dataset'),
+    ('cohortes', 'cohorts', 'build_dataset'),
+    ('rfm', 'rfm', 'build_dataset'),
+    ('simulacion', 'simulation', 'build_dataset'),
+)
+
+# Avance del precalentamiento: versión de la copia, pasos totales y hechos, paso en curso, errores y si ya terminó
+Progress = namedtuple('Progress', ['version', 'total', 'hechos', 'paso', 'errores', 'terminado'])
+
+
+# Índices por proyecto de todas las granularidades (caché de recursos de project_index)
+def _warm_project_index(snapshot):
+    import project_index
+    from bucketing import BUCKET_COLUMNS
+
+    dataset = snapshot.datasets.get('curvas_proyectos')
+    if dataset is not None:
+        for periodo in BUCKET_COLUMNS:
+            project_index.load_project_index(dataset[0], snapshot.version, periodo)
+
+
+# Matrices de montos y porcentajes de Matrices de Desembolsos con la selección por defecto (todos los países)
+def _warm_pivots(snapshot):
+    import matrices
+    from bucketing import BUCKET_COLUMNS
+
+    dataset = snapshot.datasets.get('matrices')
+    if dataset is not None:
+        result_df = dataset[0]
+        for periodo in BUCKET_COLUMNS:
+            matrices.load_pivot_tables(result_df, snapshot.version, result_df['Pais'].unique(), periodo)
+
+
+# Curvas de todas las cohortes sin filtros (la vista inicial de Cohortes de Vigencia)
+def _warm_cohort_curves(snapshot):
+    import cohorts
+
+    dataset = snapshot.datasets.get('cohortes')
+    if dataset is not None:
+        cohorts.load_cohort_curves(dataset[0], snapshot.version, cohorts.TODOS, cohorts.TODOS)
+
+
+# Tabla RFM de Estadísticas sin archivo, sus grupos de k-means y los proyectos estancados, a la fecha de corte por
+# defecto (la del último desembolso)
+def _warm_rfm(snapshot):
+    import core
+    import rfm
+    import stalled
+
+    dataset = snapshot.datasets.get('rfm')
+    if dataset is not None:
+        fecha_corte = core.as_of_date(dataset[0])
+        tabla, _ = rfm.load_rfm_table(*dataset, snapshot.version, fecha_corte)
+        rfm.load_clusters(tabla, snapshot.version, fecha_corte)
+        stalled.load_stalled_alerts(*dataset, snapshot.version, fecha_corte, fuente='rfm')
+
+
+# Simulación de flujos con los parámetros por defecto de la página, a la fecha del último desembolso
+def _warm_cash_flows(snapshot):
+    import simulation
+
+    dataset = snapshot.datasets.get('simulacion')
+    if dataset is not None:
+        simulation.load_cash_flows(*dataset, snapshot.version)
+
+
+# Resultados derivados que se recalculan con cada copia nueva de las hojas
+DERIVADOS = (
+    ('índice de proyectos', _warm_project_index),
+    ('matrices', _warm_pivots),
+    ('curvas de cohortes', _warm_cohort_curves),
+    ('tabla RFM', _warm_rfm),
+    ('simulación de flujos', _warm_cash_flows),
+)
+
+
+# Hilo de precalentamiento: arma los datasets de las páginas y sus resultados más pedidos antes de la primera visita
+# y los vuelve a calcular cada vez que el actualizador trae una copia nueva, para que ninguna sesión pague el cálculo.
+class Warmup:
+    def __init__(self, refresher_factory=get_refresher, builders=BUILDERS, derivados=DERIVADOS):
+        self.refresher_factory = refresher_factory
+        self.builders = builders
+        self.derivados = derivados
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._progress = Progress(None, 2 + len(builders) + len(derivados), 0, None, (), False)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return self
+            self._thread = threading.Thread(target=self._run, name='warmup', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def progress(self):
+        return self._progress
+
+    def _step(self, paso, fn, *args):
+        with self._lock:
+            self._progress = self._progress._replace(paso=paso)
+        try:
+            fn(*args)
+        except Exception as e:
+            LOGGER.error(f"Error en el precalentamiento ({paso}): {e}")
+            with self._lock:
+                self._progress = self._progress._replace(errores=self._progress.errores + (f'{paso}: {e}',))
+        with self._lock:
+            self._progress = self._progress._replace(hechos=self._progress.hechos + 1)
+
+    def _run(self):
+        import workbook
+
+        inicio = time.monotonic()
+        self._step('procesos de lectura', workbook.prestart)
+        # Los cachés de datos son del servidor: se espera a que exista para no llenar un caché descartable
+        self._step('servidor', _wait_for_runtime, RUNTIME_TIMEOUT)
+
+        refresher = self.refresher_factory()
+        snapshot = refresher.snapshot(timeout=PRIMERA_CARGA_TIMEOUT)
+        # El actualizador arma cada dataset en su propio hilo sobre la copia cargada (disco o descarga); cada paso
+        # espera a que termine para que los resultados derivados lo encuentren
+        for nombre, modulo, funcion in self.builders:
+            self._step(f'dataset {nombre}', _register, refresher, nombre, modulo, funcion)
+
+        version = None
+        while not self._stop.is_set():
+            snapshot = refresher.snapshot(timeout=0)
+            if snapshot is not None and snapshot.version != version:
+                if version is not None:
+                    with self._lock:
+                        self._progress = self._progress._replace(total=self._progress.total + len(self.derivados), terminado=False)
+                for paso, fn in self.derivados:
+                    self._step(paso, fn, snapshot)
+                version = snapshot.version
+                with self._lock:
+                    self._progress = self._progress._replace(version=version, paso=None, terminado=True)
+                LOGGER.info(f"Precalentamiento de la versión {version} terminado en {time.monotonic() - inicio:.1f} s")
+                inicio = time.monotonic()
+            self._stop.wait(REVISION_SECONDS)
+
+
+def _register(refresher, nombre, modulo, funcion):
+    refresher.register(nombre, getattr(importlib.import_module(modulo), funcion))
+    if not refresher.wait_built(nombre, PRIMERA_CARGA_TIMEOUT):
+        raise TimeoutError(f"el dataset no se armó en {PRIMERA_CARGA_TIMEOUT} s")
+
+
+def _wait_for_runtime(timeout):
+    from streamlit.runtime import Runtime
+
+    limite = time.monotonic() + timeout
+    while not Runtime.exists():
+        if time.monotonic() > limite:
+            raise TimeoutError(f"el servidor de Streamlit no arrancó en {timeout} s")
+        time.sleep(0.1)
+
+
+_warmup = None
+_warmup_lock = threading.Lock()
+
+
+# Instancia compartida por todas las sesiones del servidor; se arranca una sola vez
+def get_warmup():
+    global _warmup
+    with _warmup_lock:
+        if _warmup is None:
+            _warmup = Warmup().start()
+        return _warmup
+
+
+# Arranca el precalentamiento si está habilitado; devuelve la instancia o None. Lo llama la portada (Hello.py) y
+# tools.serve, que lo arranca junto con el servidor; importar este módulo no arranca nada.
+def start_if_enabled():
+    return get_warmup() if ENABLED else None
+
@@ -0,0 +1,81 @@
+import functools
+import io
+import os
+
+from pools import SpawnPool
+
+# Por debajo de este tamaño arrancar procesos cuesta más que leer las hojas en serie
+MIN_BYTES_PARALELO = 256 * 1024
+MAX_WORKERS = 4
+
+# Pool de lectura compartido por todas las sesiones
+_pool = SpawnPool(MAX_WORKERS)
+
+
+# Contenido del libro: archivo subido en Streamlit, bytes o ruta
+def workbook_bytes(source):
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source)
+    if hasattr(source, 'getvalue'):
+        return source.getvalue()
+    with open(source, 'rb') as f:
+        return f.read()
+
+
+# Se ejecuta en los procesos del pool, que no cargan Streamlit
+def _parse_sheet(args):
+    import pandas as pd
+
+    data, sheet = args
+    return pd.read_excel(io.BytesIO(data), sheet_name=sheet, engine='openpyxl')
+
+
+# Se ejecuta en los procesos del pool: deja cargados pandas y openpyxl para la primera lectura
+def _preload(_):
+    import openpyxl  # noqa: F401
+    import pandas  # noqa: F401
+
+
+# Arranca los procesos del pool antes de la primera subida (un arranque en frío por proceso cuesta segundos)
+def prestart():
+    _pool.map(_preload, range(_pool.workers))
+
+
+# Lee varias hojas del libro a partir de una sola lectura del archivo; cada hoja se procesa en un proceso distinto
+def read_sheets(source, sheet_names, max_workers=None):
+    data = workbook_bytes(source)
+    sheet_names = list(sheet_names)
+    workers = min(len(sheet_names), max_workers or os.cpu_count() or 1, MAX_WORKERS)
+
+    if workers > 1 and len(data) >= MIN_BYTES_PARALELO:
+        frames = _pool.map(_parse_sheet, [(data, sheet) for sheet in sheet_names])
+        if frames is not None:
+            return dict(zip(sheet_names, frames))
+
+    import pandas as pd
+
+    with pd.ExcelFile(io.BytesIO(data), engine='openpyxl') as xls:
+        return {sheet: xls.parse(sheet) for sheet in sheet_names}
+
+
+def _read_sheets_cached(data, sheet_names):
+    import metrics
+
+    metrics.cache_miss('load_sheets')
+    return read_sheets(data, sheet_names)
+
+
+@functools.lru_cache(maxsize=None)
+def _cached_reader():
+    import streamlit as st
+
+    return st.cache_data(max_entries=4, show_spinner=False)(_read_sheets_cached)
+
+
+# Igual que read_sheets pero cacheado por contenido del archivo: volver a la página no vuelve a leer el libro
+def load_sheets(source, sheet_names):
+    # Los procesos del pool importan este módulo sin Streamlit: las métricas se cargan solo aquí
+    import metrics
+
+    metrics.cache_call('load_sheets')
+    return _cached_reader()(workbook_bytes(source), tuple(sheet_names))